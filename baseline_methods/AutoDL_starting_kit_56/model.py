@@ -29,6 +29,8 @@ import os
 
 # Import the challenge algorithm (model) API from algorithm.py
 import algorithm
+# Time budget management shared with the other models, see step_scheduler.py
+import step_scheduler
 
 # Utility packages
 import time
@@ -45,6 +47,10 @@ class Model(algorithm.Algorithm):
   def __init__(self, metadata):
     super(Model, self).__init__(metadata)
 
+    # Batch size of the datasets given by the ingestion program, see
+    # D_train.init(batch_size=30, repeat=True)
+    self.batch_size = 30
+
     # Get dataset name.
     self.dataset_name = self.metadata_.get_dataset_name()\
                           .split('/')[-2].split('.')[0]
@@ -64,14 +70,10 @@ class Model(algorithm.Algorithm):
       model_dir='checkpoints_' + self.dataset_name)
 
     # Attributes for managing time budget
-    # Cumulated number of training steps
+    # The datasets are batched by the ingestion program, one step is one
+    # batch
     self.birthday = time.time()
-    self.total_train_time = 0
-    self.cumulated_num_steps = 0
-    self.estimated_time_per_step = None
-    self.total_test_time = 0
-    self.cumulated_num_tests = 0
-    self.estimated_time_test = None
+    self.scheduler = step_scheduler.StepScheduler(first_steps=1)
     self.done_training = False
     self.early_stop_proba = 0.05
     ################################################
@@ -115,58 +117,35 @@ class Model(algorithm.Algorithm):
       features, labels = iterator.get_next()
       return features, labels
 
-    if not remaining_time_budget: # This is never true in the competition anyway
-      remaining_time_budget = 1200 # if no time limit is given, set to 20min
-
-    # The following snippet of code intends to do
-    # 1. If no training is done before, train for 1 step (one batch);
-    # 2. Otherwise, estimate training time per step and time needed for test,
-    #    then compare to remaining time budget to compute a potential maximum
-    #    number of steps (max_steps) that can be trained within time budget;
-    # 3. Choose a number (steps_to_train) between 0 and max_steps and train for
-    #    this many steps. Double it each time.
-    if not self.estimated_time_per_step:
-      steps_to_train = 1
-    else:
-      if self.estimated_time_test:
-        tentative_estimated_time_test = self.estimated_time_test
-      else:
-        tentative_estimated_time_test = 50 # conservative estimation for test
-      max_steps = int((remaining_time_budget - tentative_estimated_time_test) / self.estimated_time_per_step)
-      max_steps = max(max_steps, 1)
-      if self.cumulated_num_tests < np.log(max_steps) / np.log(2):
-        steps_to_train = int(2 ** self.cumulated_num_tests) # Double steps_to_train after each test
-      else:
-        steps_to_train = np.random.randint(1, max_steps // 2)
+    # Get number of steps to train according to the strategy of
+    # step_scheduler.StepScheduler
+    steps_to_train = self.scheduler.get_steps_to_train(remaining_time_budget)
     if steps_to_train <= 0:
       print_log("Not enough time remaining for training. " +\
-            "Estimated time for training per step: {:.2f}, ".format(self.estimated_time_per_step) +\
-            "and for test: {}, ".format(tentative_estimated_time_test) +\
-            "but remaining time budget is: {:.2f}. ".format(remaining_time_budget) +\
-            "Skipping...")
+            "Remaining time budget: {:.2f} sec. "\
+            .format(remaining_time_budget) +\
+            str(self.scheduler) + " Skipping...")
       self.done_training = True
     else:
       msg_est = ""
-      if self.estimated_time_per_step:
+      estimated_time_per_step = self.scheduler.get_step_time()
+      if estimated_time_per_step:
         msg_est = "estimated time for this: " +\
-                  "{:.2f} sec.".format(steps_to_train * self.estimated_time_per_step)
+                  "{:.2f} sec.".format(steps_to_train * estimated_time_per_step)
       print_log("Begin training for another {} steps...{}".format(steps_to_train, msg_est))
+      # Start training, timed for time budget managing
       train_start = time.time()
-      # Start training
-      with tf.Session() as sess:
-        self.classifier.train(
-          input_fn=train_input_fn,
-          steps=steps_to_train)
+      with self.scheduler.time_train(steps_to_train):
+        with tf.Session() as sess:
+          self.classifier.train(
+            input_fn=train_input_fn,
+            steps=steps_to_train)
       train_end = time.time()
-      # Update for time budget managing
       train_duration = train_end - train_start
-      self.total_train_time += train_duration
-      self.cumulated_num_steps += steps_to_train
-      self.estimated_time_per_step = self.total_train_time / self.cumulated_num_steps
       print_log("{} steps trained. {:.2f} sec used. ".format(steps_to_train, train_duration) +\
-            "Now total steps trained: {}. ".format(self.cumulated_num_steps) +\
-            "Total time used for training: {:.2f} sec. ".format(self.total_train_time) +\
-            "Current estimated time per step: {:.2e} sec.".format(self.estimated_time_per_step))
+            "Total time used for training: {:.2f} sec. "\
+            .format(self.scheduler.total_train_time) +\
+            str(self.scheduler))
 
   def test(self, dataset, remaining_time_budget=None):
     """Test this algorithm on the tensorflow |dataset|.
@@ -201,32 +180,31 @@ class Model(algorithm.Algorithm):
       print_log("Oops! Choose to stop early for next call!")
       self.done_training = True
     test_begin = time.time()
-    if remaining_time_budget and self.estimated_time_test and\
-        self.estimated_time_test > remaining_time_budget:
+    estimated_time_test = self.scheduler.get_test_time(pessimistic=True)
+    if not self.scheduler.can_test(remaining_time_budget):
       print_log("Not enough time for test. " +\
-            "Estimated time for test: {:.2e}, ".format(self.estimated_time_test) +\
+            "Estimated time for test: {:.2e}, ".format(estimated_time_test) +\
             "But remaining time budget is: {:.2f}. ".format(remaining_time_budget) +\
             "Stop train/predict process by returning None.")
       return None
 
-    msg_est = ""
-    if self.estimated_time_test:
-      msg_est = "estimated time: {:.2e} sec.".format(self.estimated_time_test)
+    msg_est = "estimated time: {:.2e} sec.".format(estimated_time_test)
     print_log("Begin testing...", msg_est)
-    test_results = self.classifier.predict(input_fn=test_input_fn)
-    predictions = [x['probabilities'] for x in test_results]
-    has_same_length = (len({len(x) for x in predictions}) == 1)
-    print_log("Asserting predictions have the same number of columns...")
-    assert(has_same_length)
-    predictions = np.array(predictions)
+    # Start testing (i.e. making prediction on test set), timed for time
+    # budget managing
+    with self.scheduler.time_test(remaining_time_budget):
+      test_results = self.classifier.predict(input_fn=test_input_fn)
+      predictions = [x['probabilities'] for x in test_results]
+      has_same_length = (len({len(x) for x in predictions}) == 1)
+      print_log("Asserting predictions have the same number of columns...")
+      assert(has_same_length)
+      predictions = np.array(predictions)
     test_end = time.time()
     test_duration = test_end - test_begin
-    self.total_test_time += test_duration
-    self.cumulated_num_tests += 1
-    self.estimated_time_test = self.total_test_time / self.cumulated_num_tests
     print_log("[+] Successfully made one prediction. {:.2f} sec used. ".format(test_duration) +\
-          "Total time used for testing: {:.2f} sec. ".format(self.total_test_time) +\
-          "Current estimated time for test: {:.2e} sec.".format(self.estimated_time_test))
+          "Total time used for testing: {:.2f} sec. "\
+          .format(self.scheduler.total_test_time) +\
+          str(self.scheduler))
     return predictions
 
   ##############################################################################
@@ -482,11 +460,11 @@ class Model(algorithm.Algorithm):
     """The criterion to stop further training (thus finish train/predict
     process).
     """
-    # return self.cumulated_num_tests > 10 # Limit to make 10 predictions
+    # return self.scheduler.num_tests > 10 # Limit to make 10 predictions
     # return np.random.rand() < self.early_stop_proba
-    batch_size = 30 # See ingestion program: D_train.init(batch_size=30, repeat=True)
+    batch_size = self.batch_size
     num_examples = self.metadata_.size()
-    num_epochs = self.cumulated_num_steps * batch_size / num_examples
+    num_epochs = self.scheduler.cumulated_num_steps * batch_size / num_examples
     return num_epochs > self.num_epochs_we_want_to_train # Train for 40 epochs then stop
 
 def print_log(*content):
@@ -29,6 +29,7 @@ import os
 
 # Import the challenge algorithm (model) API from algorithm.py
 import algorithm
+from dataset import AutoDLDataset
 
 # Utility packages
 import time
@@ -43,6 +44,10 @@ class Model(algorithm.Algorithm):
   def __init__(self, metadata):
     super(Model, self).__init__(metadata)
 
+    # Batch size of the datasets given by the ingestion program, see
+    # D_train.init(batch_size=30, repeat=True)
+    self.batch_size = 30
+
     # Get dataset name.
     self.dataset_name = self.metadata_.get_dataset_name()\
                           .split('/')[-2].split('.')[0]
@@ -89,30 +94,16 @@ class Model(algorithm.Algorithm):
       return
 
     # Transform data to numpy.ndarray if not done yet
-    if not self.X_train or not self.Y_train:
-      # Turn `features` in the tensor tuples (matrix_bundle_0,...,matrix_bundle_(N-1), labels)
-      # to a dict. This example model only uses the first matrix bundle
-      # (i.e. matrix_bundle_0) (see the documentation of this train() function above for the description of each example)
-      dataset = dataset.map(lambda *x: ({'x': x[0]}, x[-1]))
-      iterator = dataset.make_one_shot_iterator()
-      next_element = iterator.get_next()
-      counter = 0
-      X_train = []
-      Y_train = []
-      with tf.Session() as sess:
-        while True:
-          try:
-            features, labels = sess.run(next_element)
-            X_train.append(features.flatten())
-            Y_train.append(labels.flatten())
-            counter += 1
-            if counter % 1000 == 0:
-              print(counter)
-          except tf.errors.OutOfRangeError:
-            print("The End.", counter)
-            break
-      self.X_train = np.array(X_train)
-      self.Y_train = np.array(Y_train)
+    if self.X_train is None or self.Y_train is None:
+      # The training set is exported once to memory-mapped .npy files (see
+      # AutoDLDataset.to_numpy), which avoids iterating over `dataset` example
+      # by example. This example model only uses the first matrix bundle
+      # (i.e. matrix_bundle_0).
+      autodl_dataset = AutoDLDataset(self.metadata_.get_dataset_name())
+      arrays = autodl_dataset.to_numpy(mmap=True)
+      self.X_train = arrays[0].reshape(len(arrays[0]), -1)
+      self.Y_train = arrays[-1]
+      print("Number of training examples:", len(self.X_train))
 
     if not remaining_time_budget: # This is never true in the competition anyway
       remaining_time_budget = 1200 # if no time limit is given, set to 20min
@@ -143,7 +134,7 @@ class Model(algorithm.Algorithm):
       return None
 
     # Transform data to numpy.ndarray if not done yet
-    if not self.X_test:
+    if self.X_test is None:
       # Turn `features` in the tensor tuples (matrix_bundle_0,...,matrix_bundle_(N-1), labels)
       # to a dict. This example model only uses the first matrix bundle
       # (i.e. matrix_bundle_0) (see the documentation of this train() function above for the description of each example)
@@ -406,7 +397,7 @@ class Model(algorithm.Algorithm):
     """
     # return self.cumulated_num_tests > 10 # Limit to make 10 predictions
     # return np.random.rand() < self.early_stop_proba
-    batch_size = 30 # See ingestion program: D_train.init(batch_size=30, repeat=True)
+    batch_size = self.batch_size
     num_examples = self.metadata_.size()
     num_epochs = self.cumulated_num_steps * batch_size / num_examples
     return num_epochs > self.num_epochs_we_want_to_train # Train for certain number of epochs then stop
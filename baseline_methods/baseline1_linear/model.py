@@ -29,6 +29,12 @@ import os
 
 # Import the challenge algorithm (model) API from algorithm.py
 import algorithm
+# Time budget management shared with the other models, see step_scheduler.py
+import step_scheduler
+# Input pipelines shared with the other models, see input_pipeline.py
+import input_pipeline
+# Choice of the batch size shared with the other models, see batch_size_probe.py
+import batch_size_probe
 
 # Utility packages
 import time
@@ -55,8 +61,21 @@ class Model(algorithm.Algorithm):
     sequence_size = self.metadata_.get_sequence_size()
     self.fixed_sequence_size = sequence_size > 0
 
-    # Set batch size (for both training and testing)
-    self.batch_size = 30
+    # Attributes for preprocessing
+    self.default_image_size = (112,112)
+    self.default_num_frames = 10
+    self.default_shuffle_buffer = 100
+
+    # Set batch size (for both training and testing), see batch_size_probe.py
+    self.default_batch_size = 30
+    example_shape = batch_size_probe.get_preprocessed_shape(
+        batch_size_probe.get_example_shape(self.metadata_),
+        self.preprocess_tensor_4d)
+    self.batch_size_probe = batch_size_probe.BatchSizeProbe(
+        self.model_fn, example_shape, self.output_dim,
+        max_batch_size=self.num_examples_train)
+    self.batch_size = self.batch_size_probe.run() or self.default_batch_size
+    print_log("Batch size: {}".format(self.batch_size))
 
     model_fn = self.model_fn
 
@@ -70,20 +89,19 @@ class Model(algorithm.Algorithm):
       model_fn=model_fn,
       model_dir=model_dir)
 
-    # Attributes for preprocessing
-    self.default_image_size = (112,112)
-    self.default_num_frames = 10
-    self.default_shuffle_buffer = 100
+    # No cache of the training examples before shuffling (see
+    # input_pipeline.py): it lives in the iterator, which the Estimator
+    # rebuilds at each call, so it would be filled again at each call
+    self.cache_examples = None
+    # Reports whether the training rounds are input-bound or compute-bound
+    self.input_profiler = input_pipeline.InputProfiler()
 
     # Attributes for managing time budget
-    # Cumulated number of training steps
+    # The expected score is assumed to reach half its maximum after one epoch
     self.birthday = time.time()
-    self.total_train_time = 0
-    self.cumulated_num_steps = 0
-    self.estimated_time_per_step = None
-    self.total_test_time = 0
-    self.cumulated_num_tests = 0
-    self.estimated_time_test = None
+    steps_per_epoch = max(self.num_examples_train / self.batch_size, 1)
+    self.scheduler = step_scheduler.StepScheduler(
+        expected_score=step_scheduler.saturating_score(steps_per_epoch))
     self.trained = False
     self.done_training = False
     # Critical number for early stopping
@@ -127,37 +145,34 @@ class Model(algorithm.Algorithm):
 
     if steps_to_train <= 0:
       print_log("Not enough time remaining for training. " +
-            "Estimated time for training per step: {:.2f}, "\
-            .format(self.estimated_time_per_step) +
-            "and for test: {}, ".format(tentative_estimated_time_test) +
-            "but remaining time budget is: {:.2f}. "\
+            "Remaining time budget: {:.2f} sec. "\
             .format(remaining_time_budget) +
-            "Skipping...")
+            str(self.scheduler) + " Skipping...")
       self.done_training = True
     else:
       msg_est = ""
-      if self.estimated_time_per_step:
+      estimated_time_per_step = self.scheduler.get_step_time()
+      if estimated_time_per_step:
         msg_est = "estimated time for this: " +\
-                  "{:.2f} sec.".format(steps_to_train * self.estimated_time_per_step)
+                  "{:.2f} sec.".format(steps_to_train * estimated_time_per_step)
       print_log("Begin training for another {} steps...{}".format(steps_to_train, msg_est))
 
       # Prepare input function for training
       train_input_fn = lambda: self.input_function(dataset, is_training=True)
 
-      # Start training
+      # Start training, timed for time budget managing
       train_start = time.time()
-      self.classifier.train(input_fn=train_input_fn, steps=steps_to_train)
+      with self.scheduler.time_train(steps_to_train):
+        self.classifier.train(
+            input_fn=train_input_fn, steps=steps_to_train,
+            hooks=[input_pipeline.InputProfilerHook(self.input_profiler)])
       train_end = time.time()
 
-      # Update for time budget managing
       train_duration = train_end - train_start
-      self.total_train_time += train_duration
-      self.cumulated_num_steps += steps_to_train
-      self.estimated_time_per_step = self.total_train_time / self.cumulated_num_steps
       print_log("{} steps trained. {:.2f} sec used. ".format(steps_to_train, train_duration) +\
-            "Now total steps trained: {}. ".format(self.cumulated_num_steps) +\
-            "Total time used for training: {:.2f} sec. ".format(self.total_train_time) +\
-            "Current estimated time per step: {:.2e} sec.".format(self.estimated_time_per_step))
+            "Total time used for training: {:.2f} sec. "\
+            .format(self.scheduler.total_train_time) +\
+            str(self.scheduler))
 
   def test(self, dataset, remaining_time_budget=None):
     """Test this algorithm on the tensorflow |dataset|.
@@ -188,38 +203,35 @@ class Model(algorithm.Algorithm):
       print_log("Oops! Choose to stop early for next call!")
       self.done_training = True
     test_begin = time.time()
-    if remaining_time_budget and self.estimated_time_test and\
-        self.estimated_time_test > remaining_time_budget:
+    estimated_time_test = self.scheduler.get_test_time(pessimistic=True)
+    if not self.scheduler.can_test(remaining_time_budget):
       print_log("Not enough time for test. " +\
-            "Estimated time for test: {:.2e}, ".format(self.estimated_time_test) +\
+            "Estimated time for test: {:.2e}, ".format(estimated_time_test) +\
             "But remaining time budget is: {:.2f}. ".format(remaining_time_budget) +\
             "Stop train/predict process by returning None.")
       return None
-    msg_est = ""
-    if self.estimated_time_test:
-      msg_est = "estimated time: {:.2e} sec.".format(self.estimated_time_test)
+    msg_est = "estimated time: {:.2e} sec.".format(estimated_time_test)
     print_log("Begin testing...", msg_est)
 
     # Prepare input function for testing
     test_input_fn = lambda: self.input_function(dataset, is_training=False)
 
-    # Start testing (i.e. making prediction on test set)
-    test_results = self.classifier.predict(input_fn=test_input_fn)
+    # Start testing (i.e. making prediction on test set), timed for time
+    # budget managing
+    with self.scheduler.time_test(remaining_time_budget):
+      test_results = self.classifier.predict(input_fn=test_input_fn)
 
-    predictions = [x['probabilities'] for x in test_results]
-    has_same_length = (len({len(x) for x in predictions}) == 1)
-    print_log("Asserting predictions have the same number of columns...")
-    assert(has_same_length)
-    predictions = np.array(predictions)
+      predictions = [x['probabilities'] for x in test_results]
+      has_same_length = (len({len(x) for x in predictions}) == 1)
+      print_log("Asserting predictions have the same number of columns...")
+      assert(has_same_length)
+      predictions = np.array(predictions)
     test_end = time.time()
-    # Update some variables for time management
     test_duration = test_end - test_begin
-    self.total_test_time += test_duration
-    self.cumulated_num_tests += 1
-    self.estimated_time_test = self.total_test_time / self.cumulated_num_tests
     print_log("[+] Successfully made one prediction. {:.2f} sec used. ".format(test_duration) +\
-          "Total time used for testing: {:.2f} sec. ".format(self.total_test_time) +\
-          "Current estimated time for test: {:.2e} sec.".format(self.estimated_time_test))
+          "Total time used for testing: {:.2f} sec. "\
+          .format(self.scheduler.total_test_time) +\
+          str(self.scheduler))
     return predictions
 
   ##############################################################################
@@ -288,19 +300,16 @@ class Model(algorithm.Algorithm):
     For more information on how to write an input function, see:
       https://www.tensorflow.org/guide/custom_estimators#write_an_input_function
     """
-    dataset = dataset.map(lambda *x: (self.preprocess_tensor_4d(x[0]), x[1]))
-
-    if is_training:
-      # Shuffle input examples
-      dataset = dataset.shuffle(buffer_size=self.default_shuffle_buffer)
-      # Convert to RepeatDataset to train for several epochs
-      dataset = dataset.repeat()
-
-    # Set batch size
-    dataset = dataset.batch(batch_size=self.batch_size)
-
-    iterator = dataset.make_one_shot_iterator()
-    example, labels = iterator.get_next()
+    # Preprocess the examples only if some of their dimensions are unknown,
+    # preprocess_tensor_4d leaves the others unchanged
+    map_fn = None
+    if not dataset.output_shapes[0].is_fully_defined():
+      map_fn = lambda *x: (self.preprocess_tensor_4d(x[0]), x[1])
+    dataset = input_pipeline.build_input_pipeline(
+        dataset, self.batch_size, is_training, map_fn=map_fn,
+        shuffle_buffer=self.default_shuffle_buffer,
+        cache=self.cache_examples, num_examples=self.num_examples_train)
+    example, labels = input_pipeline.get_next_batch(dataset)
     return example, labels
 
   def preprocess_tensor_4d(self, tensor_4d):
@@ -348,31 +357,16 @@ class Model(algorithm.Algorithm):
   def get_steps_to_train(self, remaining_time_budget):
     """Get number of steps for training according to `remaining_time_budget`.
 
-    The strategy is:
+    The strategy is the one of `step_scheduler.StepScheduler`:
       1. If no training is done before, train for 10 steps (ten batches);
       2. Otherwise, estimate training time per step and time needed for test,
          then compare to remaining time budget to compute a potential maximum
          number of steps (max_steps) that can be trained within time budget;
-      3. Choose a number (steps_to_train) between 0 and max_steps and train for
-         this many steps. Double it each time.
+      3. Choose a number (steps_to_train) between 0 and max_steps maximizing
+         the expected area under the learning curve, and train for this many
+         steps.
     """
-    if not remaining_time_budget: # This is never true in the competition anyway
-      remaining_time_budget = 1200 # if no time limit is given, set to 20min
-
-    if not self.estimated_time_per_step:
-      steps_to_train = 10
-    else:
-      if self.estimated_time_test:
-        tentative_estimated_time_test = self.estimated_time_test
-      else:
-        tentative_estimated_time_test = 50 # conservative estimation for test
-      max_steps = int((remaining_time_budget - tentative_estimated_time_test) / self.estimated_time_per_step)
-      max_steps = max(max_steps, 1)
-      if self.cumulated_num_tests < np.log(max_steps) / np.log(2):
-        steps_to_train = int(2 ** self.cumulated_num_tests) # Double steps_to_train after each test
-      else:
-        steps_to_train = 0
-    return steps_to_train
+    return self.scheduler.get_steps_to_train(remaining_time_budget)
 
   def age(self):
     return time.time() - self.birthday
@@ -381,11 +375,11 @@ class Model(algorithm.Algorithm):
     """The criterion to stop further training (thus finish train/predict
     process).
     """
-    # return self.cumulated_num_tests > 10 # Limit to make 10 predictions
+    # return self.scheduler.num_tests > 10 # Limit to make 10 predictions
     # return np.random.rand() < self.early_stop_proba
     batch_size = self.batch_size
     num_examples = self.metadata_.size()
-    num_epochs = self.cumulated_num_steps * batch_size / num_examples
+    num_epochs = self.scheduler.cumulated_num_steps * batch_size / num_examples
     print_log("Model already trained for {} epochs.".format(num_epochs))
     return num_epochs > self.num_epochs_we_want_to_train # Train for at least certain number of epochs then stop
 
@@ -0,0 +1,286 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Choice of the batch size of a model by measuring its training steps.
+
+`BatchSizeProbe` trains a few steps of the model on random batches of the
+preprocessed examples, at increasing batch sizes, each in a new graph and
+session. For each batch size it measures the throughput (examples per second)
+and the peak memory of a step, i.e. the peak of the bytes allocated by
+TensorFlow during a traced step (or the increase of the resident memory of the
+process if TensorFlow does not report it).
+
+The batch sizes are probed in increasing order until:
+- the memory of the next batch size, extrapolated linearly from the previous
+  ones, exceeds the memory limit (by default a fraction of the available
+  memory, see resource_monitor.py), or a step runs out of memory;
+- the throughput stops increasing, i.e. a batch size does not increase it by
+  at least `min_gain` (relative) over the previous chosen one;
+- or the next batch size is not expected to be probed within `max_time`.
+The chosen batch size is the largest one that increased the throughput: the
+throughput of small batches is limited by the fixed costs of each step (e.g.
+for tabular data), while larger batches than needed only cost memory and make
+fewer updates of the weights in the same time.
+
+The probe runs when the model is created, which is after the ingestion
+program wrote start.txt: its time counts on the time axis of the learning
+curve, whose first seconds weigh the most (log scale, see the scoring
+program). `max_time` is thus a few seconds.
+
+`run` returns None if the batch sizes cannot be probed, e.g. if the
+preprocessed examples do not have a fixed shape: the model then falls back to
+a default batch size, as in the example below.
+
+  import batch_size_probe
+  ...
+  def __init__(self, metadata):
+    ...
+    example_shape = batch_size_probe.get_preprocessed_shape(
+        batch_size_probe.get_example_shape(self.metadata_),
+        self.preprocess_tensor_4d)
+    self.batch_size_probe = batch_size_probe.BatchSizeProbe(
+        self.model_fn, example_shape, self.output_dim,
+        max_batch_size=self.num_examples_train)
+    self.batch_size = self.batch_size_probe.run() or self.default_batch_size
+"""
+
+import time
+import tensorflow as tf
+import resource_monitor
+import tracing
+
+DEFAULT_BATCH_SIZES = (8, 16, 32, 64, 128, 256, 512)
+
+
+def get_example_shape(metadata, bundle_index=0):
+  """Shape [sequence_size, row_count, col_count, num_channels] of the examples
+  of the datasets of `metadata` (see dataset.py), with None for the unknown
+  dimensions."""
+  sequence_size = metadata.get_sequence_size()
+  row_count, col_count = metadata.get_matrix_size(bundle_index)
+  num_channels = metadata.get_num_channels(bundle_index)
+  if not (row_count > 0 and col_count > 0) and\
+      not metadata.has_num_channels(bundle_index):
+    # Compressed images of variable sizes are decoded in RGB
+    num_channels = 3
+  return [sequence_size if sequence_size > 0 else None,
+          row_count if row_count > 0 else None,
+          col_count if col_count > 0 else None,
+          num_channels]
+
+
+def get_preprocessed_shape(example_shape, preprocess_fn=None):
+  """Shape of the examples of shape `example_shape` after `preprocess_fn` (a
+  function of a tensor), as a list with None for the unknown dimensions."""
+  if preprocess_fn is None:
+    return list(example_shape)
+  with tf.Graph().as_default():
+    example = tf.placeholder(tf.float32, shape=example_shape)
+    return preprocess_fn(example).shape.as_list()
+
+
+def get_step_peak_memory(run_metadata):
+  """Peak bytes allocated by TensorFlow during a step traced in run_metadata,
+  summed over the allocators (devices), or None if not reported."""
+  peaks = {}
+  for device_stats in run_metadata.step_stats.dev_stats:
+    for node_stats in device_stats.node_stats:
+      for memory in node_stats.memory:
+        peaks[memory.allocator_name] = max(peaks.get(memory.allocator_name, 0),
+                                           memory.peak_bytes)
+  return sum(peaks.values()) or None
+
+
+class BatchSizeProbe(object):
+  """Measure the training steps of a model at increasing batch sizes and
+  choose the batch size.
+
+  See the module docstring for the strategy. After `run`, `measurements` holds
+  one dict per probed batch size (including the one that stopped the probe)
+  and `batch_size` the chosen one.
+  """
+
+  def __init__(self, model_fn, example_shape, output_dim,
+               batch_sizes=DEFAULT_BATCH_SIZES, max_batch_size=None,
+               memory_limit=None, memory_fraction=0.25, min_gain=0.1,
+               num_steps=3, min_steps_time=0.1, max_time=3, verbose=True):
+    """
+    Args:
+      model_fn: model function of a tf.estimator.Estimator, of (features,
+        labels, mode). Only the train_op of its EstimatorSpec in TRAIN mode is
+        used.
+      example_shape: fully defined shape of the preprocessed examples, without
+        the batch dimension (see `get_preprocessed_shape`).
+      output_dim: number of classes, the labels are of shape
+        [batch_size, output_dim].
+      batch_sizes: candidate batch sizes, probed in increasing order.
+      max_batch_size: larger batch sizes are not probed, e.g. the number of
+        training examples. None for no limit.
+      memory_limit: maximum peak memory in bytes of a step, by default
+        memory_fraction of the memory available when `run` is called.
+      memory_fraction: see memory_limit. The rest is left to the datasets and
+        the input pipelines.
+      min_gain: minimum relative increase of the throughput for which a
+        larger batch size is chosen.
+      num_steps: minimum number of timed steps of each batch size, after a
+        first step which initializes the graph and traces the memory.
+      min_steps_time: the steps are timed for at least this time in seconds,
+        so that the throughput of fast steps is not noise.
+      max_time: time budget of the probe in seconds, counted in the time
+        budget of the model (see the module docstring). The first batch size
+        is always probed.
+      verbose: whether to print the measurements.
+    """
+    self.model_fn = model_fn
+    self.example_shape = list(example_shape)
+    self.output_dim = output_dim
+    self.batch_sizes = sorted(b for b in batch_sizes
+                              if max_batch_size is None or b <= max_batch_size)
+    if not self.batch_sizes:
+      self.batch_sizes = [min(batch_sizes)]
+    self.memory_limit = memory_limit
+    self.memory_fraction = memory_fraction
+    self.min_gain = min_gain
+    self.num_steps = num_steps
+    self.min_steps_time = min_steps_time
+    self.max_time = max_time
+    self.verbose = verbose
+    self.measurements = []
+    self.batch_size = None
+
+  def measure(self, batch_size):
+    """Train at least num_steps + 1 steps on random batches of batch_size
+    examples.
+
+    Returns:
+      The measurement, a dict.
+    """
+    begin = time.time()
+    rss_before = tracing.get_rss()
+    graph = tf.Graph()
+    with graph.as_default():
+      tf.train.get_or_create_global_step()
+      features = tf.random.uniform([batch_size] + self.example_shape)
+      labels = tf.cast(
+          tf.random.uniform([batch_size, self.output_dim]) < 0.5, tf.float32)
+      train_op = self.model_fn(features, labels,
+                               tf.estimator.ModeKeys.TRAIN).train_op
+      with tf.Session() as session:
+        session.run(tf.global_variables_initializer())
+        # The first step also allocates the buffers of the ops: traced
+        run_metadata = tf.RunMetadata()
+        session.run(train_op,
+                    options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                    run_metadata=run_metadata)
+        steps_begin = time.time()
+        num_steps = 0
+        while num_steps < self.num_steps or\
+            time.time() - steps_begin < self.min_steps_time:
+          session.run(train_op)
+          num_steps += 1
+        step_time = (time.time() - steps_begin) / num_steps
+        peak_memory = get_step_peak_memory(run_metadata)
+        if peak_memory is None and rss_before is not None:
+          rss_after = tracing.get_rss()
+          if rss_after is not None:
+            peak_memory = max(rss_after - rss_before, 0)
+    return {"batch_size": batch_size,
+            "step_time": step_time,
+            "examples_per_sec": batch_size / max(step_time, 1e-9),
+            "peak_memory": peak_memory,
+            "num_steps": num_steps,
+            "duration": time.time() - begin}
+
+  def predict_memory(self, batch_size):
+    """Peak memory of a step of batch_size examples, extrapolated linearly from
+    the measurements (None if unknown)."""
+    points = [(m["batch_size"], m["peak_memory"]) for m in self.measurements
+              if m["peak_memory"] is not None]
+    if not points:
+      return None
+    if len(points) == 1:
+      return points[0][1] * batch_size / float(points[0][0])
+    (b0, m0), (b1, m1) = points[-2:]
+    slope = max(m1 - m0, 0) / float(b1 - b0)
+    return m1 + slope * (batch_size - b1)
+
+  def run(self):
+    """Probe the batch sizes and choose one.
+
+    Returns:
+      The chosen batch size, or None if the shape of the examples is not fully
+      defined or no batch size could be probed.
+    """
+    if any(dim is None for dim in self.example_shape):
+      if self.verbose:
+        print("BATCH SIZE PROBE: examples of unknown shape {}, skipping."\
+              .format(self.example_shape))
+      return None
+    memory_limit = self.memory_limit
+    if memory_limit is None:
+      available = resource_monitor.read_available_memory()
+      if available is not None:
+        memory_limit = available * self.memory_fraction
+    begin = time.time()
+    chosen = None
+    stop_reason = "all batch sizes probed"
+    for batch_size in self.batch_sizes:
+      predicted_memory = self.predict_memory(batch_size)
+      if memory_limit is not None and predicted_memory is not None and\
+          predicted_memory > memory_limit:
+        stop_reason = "memory limit"
+        break
+      if self.measurements:
+        # The time of the steps grows with the batch size, not the time to
+        # build the graph and the session
+        last = self.measurements[-1]
+        steps_duration = (last["num_steps"] + 1) * last["step_time"]
+        predicted_duration = max(last["duration"] - steps_duration, 0) +\
+            steps_duration * batch_size / float(last["batch_size"])
+        if time.time() - begin + predicted_duration > self.max_time:
+          stop_reason = "time limit"
+          break
+      try:
+        measurement = self.measure(batch_size)
+      except tf.errors.ResourceExhaustedError:
+        stop_reason = "out of memory"
+        break
+      self.measurements.append(measurement)
+      if self.verbose:
+        print("BATCH SIZE PROBE: batch size {}: {:.2e} sec/step, {:.1f} "
+              "examples/sec, peak memory {} bytes."\
+              .format(batch_size, measurement["step_time"],
+                      measurement["examples_per_sec"],
+                      measurement["peak_memory"]))
+      if memory_limit is not None and measurement["peak_memory"] is not None\
+          and measurement["peak_memory"] > memory_limit:
+        stop_reason = "memory limit"
+        break
+      if chosen is not None and measurement["examples_per_sec"] <\
+          (1 + self.min_gain) * chosen["examples_per_sec"]:
+        stop_reason = "throughput stopped increasing"
+        break
+      chosen = measurement
+    if chosen is not None:
+      self.batch_size = chosen["batch_size"]
+    tracing.annotate(batch_size=self.batch_size,
+                     probe_duration=time.time() - begin)
+    if self.verbose:
+      print("BATCH SIZE PROBE: chose batch size {} among {} ({}, memory limit "
+            "{} bytes) in {:.2f} sec."\
+            .format(self.batch_size,
+                    [m["batch_size"] for m in self.measurements], stop_reason,
+                    None if memory_limit is None else int(memory_limit),
+                    time.time() - begin))
+    return self.batch_size
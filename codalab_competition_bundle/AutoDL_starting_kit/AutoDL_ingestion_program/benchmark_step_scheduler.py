@@ -0,0 +1,275 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Simulation of the train/predict process with the step schedulers.
+
+Compares the area under the learning curve (ALC, computed as in the scoring
+program) obtained with `StepScheduler` and with the previous schedule of the
+sample models (10 steps, then 1, 2, 4, ... steps), which is kept here as
+reference. The models are simulated: random times of the steps and
+predictions, with one-off costs in the first calls, and a saturating learning
+curve. Also counts the runs exceeding the time budget.
+
+Before the simulation, `check_budget_edges` checks the decisions of
+`StepScheduler` in deterministic cases at the edges of the time budget (no
+budget, no time left, steps of zero time), which random times rarely reach.
+Run for example:
+```
+python benchmark_step_scheduler.py --time_budget 7200 --num_runs 20
+```
+"""
+
+import argparse
+import math
+import random
+
+import step_scheduler
+
+
+# ======= Reference implementation ========
+
+def legacy_get_steps_to_train(remaining_time_budget, estimated_time_per_step,
+                              estimated_time_test, cumulated_num_tests):
+  if not estimated_time_per_step:
+    return 10
+  if estimated_time_test:
+    tentative_estimated_time_test = estimated_time_test
+  else:
+    tentative_estimated_time_test = 50 # conservative estimation for test
+  max_steps = int((remaining_time_budget - tentative_estimated_time_test) /
+                  estimated_time_per_step)
+  max_steps = max(max_steps, 1)
+  if cumulated_num_tests < math.log(max_steps) / math.log(2):
+    return int(2 ** cumulated_num_tests)
+  return 0
+
+
+class LegacyScheduler(object):
+  """The schedule of the sample models, behind the hooks of StepScheduler."""
+
+  def __init__(self):
+    self.total_train_time = 0
+    self.cumulated_num_steps = 0
+    self.total_test_time = 0
+    self.cumulated_num_tests = 0
+
+  def get_steps_to_train(self, remaining_time_budget):
+    return legacy_get_steps_to_train(
+        remaining_time_budget,
+        self.cumulated_num_steps and
+        self.total_train_time / self.cumulated_num_steps,
+        self.cumulated_num_tests and
+        self.total_test_time / self.cumulated_num_tests,
+        self.cumulated_num_tests)
+
+  def record_train(self, num_steps, duration):
+    self.total_train_time += duration
+    self.cumulated_num_steps += num_steps
+
+  def can_test(self, remaining_time_budget):
+    return not self.cumulated_num_tests or\
+        self.total_test_time / self.cumulated_num_tests <= remaining_time_budget
+
+  def record_test(self, duration, remaining_time_budget=None):
+    self.total_test_time += duration
+    self.cumulated_num_tests += 1
+
+
+# ======= Deterministic checks ========
+
+def _check(condition, message):
+  if not condition:
+    raise AssertionError("StepScheduler: " + message)
+
+
+def check_budget_edges():
+  """Check the decisions of StepScheduler at the edges of the time budget."""
+  scheduler = step_scheduler.StepScheduler(first_steps=10,
+                                           default_test_time=50)
+  _check(scheduler.can_test(None), "can_test(None) should be True")
+  _check(not scheduler.can_test(0), "can_test(0) should be False")
+  _check(not scheduler.can_test(49), "no time for the default test time")
+  _check(scheduler.can_test(50), "exactly the default test time")
+  _check(scheduler.get_steps_to_train(0) == 0,
+         "get_steps_to_train(0) should be 0")
+  _check(scheduler.get_steps_to_train(-1) == 0,
+         "get_steps_to_train(-1) should be 0")
+  _check(scheduler.get_steps_to_train(None) == 10,
+         "get_steps_to_train(None) should be first_steps")
+
+  # 1 sec/step and 10 sec/prediction, from the first calls
+  scheduler = step_scheduler.StepScheduler(first_steps=10)
+  _check(scheduler.get_steps_to_train(1200) == 10, "first_steps first")
+  scheduler.record_train(10, 10.)
+  scheduler.record_test(10., 1180.)
+  _check(scheduler.get_max_steps(110) == 100,
+         "get_max_steps(110) should be (110 - 10) / 1")
+  _check(scheduler.get_max_steps(10) == 0, "get_max_steps(10) should be 0")
+  _check(scheduler.get_max_steps(5) == 0, "get_max_steps(5) should be 0")
+  _check(scheduler.get_steps_to_train(10) == 0,
+         "no step when the prediction takes the remaining time")
+  steps = scheduler.get_steps_to_train(110)
+  _check(1 <= steps <= 100, "steps within get_max_steps, got {}".format(steps))
+  _check(not scheduler.can_test(9.9) and scheduler.can_test(10),
+         "can_test against the time of the first prediction")
+  scheduler = step_scheduler.StepScheduler(max_steps=50)
+  scheduler.get_steps_to_train(1200)
+  scheduler.record_train(10, 10.)
+  _check(scheduler.get_max_steps(1000) == 50, "get_max_steps capped")
+
+  # Steps of (almost) zero time: many steps, no division by zero
+  for step_duration in (0., 1e-12):
+    scheduler = step_scheduler.StepScheduler(first_steps=10)
+    scheduler.get_steps_to_train(1200)
+    scheduler.record_train(10, 10 * step_duration)
+    scheduler.record_train(20, 20 * step_duration)
+    scheduler.record_test(1., 1190.)
+    steps = scheduler.get_steps_to_train(1190)
+    _check(steps >= 1, "steps of {} sec, got {}".format(step_duration, steps))
+    _check(scheduler.get_max_steps(1190) >= steps,
+           "steps of {} sec within get_max_steps".format(step_duration))
+  print("StepScheduler: the checks at the edges of the time budget pass.")
+
+
+# ======= Simulation ========
+
+class SimulatedModel(object):
+  """Random times of the train and test calls of a model."""
+
+  def __init__(self, step_time, test_time, first_train_overhead,
+               first_test_overhead, call_overhead, half_steps, noise, seed):
+    self.step_time = step_time
+    self.test_time = test_time
+    self.first_train_overhead = first_train_overhead
+    self.first_test_overhead = first_test_overhead
+    self.call_overhead = call_overhead
+    self.half_steps = half_steps
+    self.noise = noise
+    self.random = random.Random(seed)
+    self.num_train_calls = 0
+    self.num_tests = 0
+
+  def _noise(self):
+    return self.random.uniform(1 - self.noise, 1 + self.noise)
+
+  def train(self, num_steps):
+    overhead = self.call_overhead
+    if not self.num_train_calls:
+      overhead += self.first_train_overhead
+    self.num_train_calls += 1
+    return overhead + num_steps * self.step_time * self._noise()
+
+  def test(self):
+    overhead = 0 if self.num_tests else self.first_test_overhead
+    self.num_tests += 1
+    return overhead + self.test_time * self._noise()
+
+  def score(self, num_steps):
+    return num_steps / float(num_steps + self.half_steps)
+
+
+def get_alc(points, time_budget):
+  """ALC of the (elapsed time, score) of the predictions, as in score.py."""
+  area = 0.
+  last_x, last_score = 0., 0.
+  for elapsed, score in points:
+    x = step_scheduler.log_time(elapsed, time_budget)
+    area += (x - last_x) * (score + last_score) / 2
+    last_x, last_score = x, score
+  return area + (1 - last_x) * last_score
+
+
+def simulate(scheduler, model, time_budget):
+  """Returns (ALC, number of predictions, number of steps, exceeded budget)."""
+  elapsed = 0.
+  num_steps = 0
+  points = []
+  while True:
+    steps = scheduler.get_steps_to_train(time_budget - elapsed)
+    if steps <= 0:
+      break
+    duration = model.train(steps)
+    elapsed += duration
+    num_steps += steps
+    scheduler.record_train(steps, duration)
+    if elapsed > time_budget:
+      return get_alc(points, time_budget), len(points), num_steps, True
+    if not scheduler.can_test(time_budget - elapsed):
+      break
+    duration = model.test()
+    elapsed += duration
+    if elapsed > time_budget:
+      return get_alc(points, time_budget), len(points), num_steps, True
+    scheduler.record_test(duration, time_budget - elapsed)
+    points.append((elapsed, model.score(num_steps)))
+  return get_alc(points, time_budget), len(points), num_steps, False
+
+
+def benchmark(args):
+  schedulers = [
+      ('legacy', LegacyScheduler),
+      ('step_scheduler', lambda: step_scheduler.StepScheduler(
+          expected_score=step_scheduler.saturating_score(
+              args.prior_half_steps))),
+  ]
+  print("Time budget: {} sec, time per step: {} sec, per prediction: {} sec, "
+        "half score at {} steps (prior: {})"\
+        .format(args.time_budget, args.step_time, args.test_time,
+                args.half_steps, args.prior_half_steps))
+  for name, scheduler_class in schedulers:
+    results = []
+    for seed in range(args.num_runs):
+      model = SimulatedModel(args.step_time, args.test_time,
+                             args.first_train_overhead,
+                             args.first_test_overhead, args.call_overhead,
+                             args.half_steps, args.noise, seed)
+      results.append(simulate(scheduler_class(), model, args.time_budget))
+    alcs = [r[0] for r in results]
+    print("{:>16}: mean ALC {:.4f} (min {:.4f}), {:.1f} predictions, "
+          "{:.0f} steps, {} of {} runs exceeded the time budget"\
+          .format(name, sum(alcs) / len(alcs), min(alcs),
+                  sum(r[1] for r in results) / float(len(results)),
+                  sum(r[2] for r in results) / float(len(results)),
+                  sum(r[3] for r in results), len(results)))
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Simulation of the train/predict process with the step '
+                  'schedulers.')
+  parser.add_argument('--time_budget', type=float, default=1200)
+  parser.add_argument('--num_runs', type=int, default=20)
+  parser.add_argument('--step_time', type=float, default=0.05,
+                      help='Mean time of a training step in seconds.')
+  parser.add_argument('--test_time', type=float, default=10,
+                      help='Mean time of a prediction in seconds.')
+  parser.add_argument('--first_train_overhead', type=float, default=20,
+                      help='One-off time of the first train call.')
+  parser.add_argument('--first_test_overhead', type=float, default=20,
+                      help='One-off time of the first prediction.')
+  parser.add_argument('--call_overhead', type=float, default=2,
+                      help='Time of each train call besides its steps.')
+  parser.add_argument('--noise', type=float, default=0.25,
+                      help='Relative amplitude of the random variations of '
+                           'the times.')
+  parser.add_argument('--half_steps', type=float, default=500,
+                      help='Number of steps to reach half the maximum score.')
+  parser.add_argument('--prior_half_steps', type=float, default=500,
+                      help='half_steps assumed by StepScheduler.')
+  check_budget_edges()
+  benchmark(parser.parse_args())
+
+
+if __name__ == '__main__':
+  main()
@@ -124,15 +124,29 @@ def vprint(mode, t):
         
 # ================ Output prediction results and prepare code submission =================
         
-def write(filename, predictions):
-    ''' Write prediction scores in prescribed format'''
-    with open(filename, "w") as output_file:
-        for row in predictions:
-            if type(row) is not np.ndarray and type(row) is not list:
-                row = [row]
-            for val in row:
-                output_file.write('{0:g} '.format(float(val)))
-            output_file.write('\n')
+def write(filename, predictions, binary=False):
+    ''' Write prediction scores in prescribed format.
+    If binary, the predictions are saved in the NumPy .npy format as float32
+    (without adding the .npy extension), which is much faster to write and to
+    read than text. The file is written under a temporary (hidden) name then
+    renamed, so that a reader never sees a partially written file.'''
+    dirname, basename = os.path.split(filename)
+    tmp_filename = os.path.join(dirname, '.' + basename + '.tmp')
+    if binary:
+        predictions = np.asarray(predictions, dtype=np.float32)
+        if predictions.ndim == 1:
+            predictions = predictions.reshape(-1, 1)
+        with open(tmp_filename, "wb") as output_file:
+            np.save(output_file, predictions)
+    else:
+        with open(tmp_filename, "w") as output_file:
+            for row in predictions:
+                if type(row) is not np.ndarray and type(row) is not list:
+                    row = [row]
+                for val in row:
+                    output_file.write('{0:g} '.format(float(val)))
+                output_file.write('\n')
+    os.rename(tmp_filename, filename)
 
 def zipdir(archivename, basedir):
     '''Zip directory, from J.F. Sebastian http://stackoverflow.com/'''
@@ -17,6 +17,10 @@
 Reads data in the Tensorflow AutoDL standard format.
 """
 import os
+import hashlib
+import shutil
+import tempfile
+import threading
 import tensorflow as tf
 import numpy as np
 import matplotlib.pyplot as plt
@@ -24,83 +28,28 @@ from tensorflow import app
 from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
-from google.protobuf import text_format
 import dataset_utils
-from data_pb2 import DataSpecification
-from data_pb2 import MatrixSpec
+# AutoDLMetadata does not depend on TensorFlow, it is imported here for
+# backward compatibility (dataset.AutoDLMetadata).
+from dataset_metadata import AutoDLMetadata
+from tfrecord_index import TFRecordIndex
 
-# FLAGS = flags.FLAGS
-#
-# flags.DEFINE_string("dataset_dir", "",
-#                     "absolute path to data directory.")
-#
-# def metadata_filename(dataset_name):
-#   return os.path.join(FLAGS.dataset_dir, dataset_name,
-#                       "metadata.textproto")
-#
-#
-# def dataset_file_pattern(dataset_name):
-#   return os.path.join(FLAGS.dataset_dir, dataset_name, "sample*")
+# Let tf.data choose the degree of parallelism (equal to -1)
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+# Caching of the parsed (and decoded) samples, see `AutoDLDataset`
+CACHE_MODES = (None, "memory", "disk", "auto")
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "autodl_cache")
+DEFAULT_CACHE_MEMORY_LIMIT = 2 * 1024 ** 3 # 2GB
 
-def metadata_filename(dataset_name):
-  return os.path.join("", dataset_name,
-                      "metadata.textproto")
+# Types of the bundles in the samples, see `AutoDLDataset`
+DTYPE_POLICIES = (None, "compact")
 
 
 def dataset_file_pattern(dataset_name):
   return os.path.join("", dataset_name, "sample*")
 
 
-class AutoDLMetadata(object):
-  """AutoDL data specification."""
-
-  def __init__(self, dataset_name):
-    self.dataset_name_ = dataset_name
-    self.metadata_ = DataSpecification()
-    with gfile.GFile(metadata_filename(dataset_name), "r") as f:
-      text_format.Merge(f.read(), self.metadata_)
-
-  def get_dataset_name(self):
-    return self.dataset_name_
-
-  def is_compressed(self, bundle_index):
-    return self.metadata_.matrix_spec[
-        bundle_index].format == MatrixSpec.COMPRESSED
-
-  def is_sparse(self, bundle_index):
-    return self.metadata_.matrix_spec[bundle_index].format == MatrixSpec.SPARSE
-
-  def get_bundle_size(self):
-    return len(self.metadata_.matrix_spec)
-
-  def get_matrix_size(self, bundle_index):
-    return (self.metadata_.matrix_spec[bundle_index].row_count,
-            self.metadata_.matrix_spec[bundle_index].col_count)
-
-  def get_num_channels(self, bundle_index):
-    return  self.metadata_.matrix_spec[bundle_index].num_channels
-
-  def get_tensor_size(self, bundle_index):
-    matrix_size = self.get_matrix_size(bundle_index)
-    num_channels = self.get_num_channels(bundle_index)
-    return matrix_size[0], matrix_size[1], num_channels
-
-  def get_sequence_size(self):
-    return self.metadata_.sequence_size
-
-  def get_output_size(self):
-    return self.metadata_.output_dim
-
-  def size(self):
-    return self.metadata_.sample_count
-
-  def get_label_to_index_map(self):
-    return self.metadata_.label_to_index_map
-
-  def get_feature_to_index_map(self):
-    return self.metadata_.feature_to_index_map
-
-
 class AutoDLDataset(object):
   """AutoDL Datasets out of TFRecords of SequenceExamples.
 
@@ -108,16 +57,107 @@ class AutoDLDataset(object):
      on the features and labels.
   """
 
-  def __init__(self, dataset_name):
+  def __init__(self, dataset_name, num_parallel_calls=None,
+               parse_batch_size=None, num_parallel_reads=None,
+               read_buffer_size=None, interleave_shards=False, sloppy=False,
+               cache=None, cache_dir=DEFAULT_CACHE_DIR,
+               cache_memory_limit=DEFAULT_CACHE_MEMORY_LIMIT,
+               persistent_iterator=False, sparse_output=False, decode_ratio=1,
+               decode_parallel_iterations=10, image_dtype=tf.float32,
+               dtype_policy=None):
     """Construct an AutoDL Dataset.
 
     Args:
       dataset_name: name of the dataset under the 'dataset_dir' flag.
+      num_parallel_calls: number of SequenceExamples parsed in parallel. `None`
+          parses sequentially and `AUTOTUNE` (-1) lets tf.data choose the
+          degree of parallelism. The order of the examples is preserved in
+          all cases.
+      parse_batch_size: if set, serialized records are grouped in batches of
+          this size and parsed with one call to the batched SequenceExample
+          parser, then unbatched. `None` parses one record at a time.
+      num_parallel_reads: number of shards (files matching `sample*`) read
+          concurrently. `None` reads the shards one after another in a single
+          stream.
+      read_buffer_size: size in bytes of the read buffer of each shard. `None`
+          uses the default of `tf.data.TFRecordDataset`.
+      interleave_shards: if False, the records come in the order of the
+          shards (as with sequential reads) and the upcoming shards are read
+          ahead in parallel. This is the order expected for a test set. If
+          True, the records of the shards being read are interleaved.
+      sloppy: only used with `interleave_shards`. If True, records are taken
+          from whichever shard is ready first, so the order is not
+          deterministic. Only suitable for training.
+      cache: one of `CACHE_MODES`. If not `None`, the parsed and decoded
+          samples are cached after the first full pass over the dataset, so
+          that later passes skip parsing and decoding. 'memory' keeps them in
+          memory, in the state of the iterator that made the pass: each
+          iterator (thus each graph, e.g. each `Estimator.train` call) starts
+          with an empty cache and parses the dataset again. 'disk' writes them
+          to a cache file in `cache_dir` that is reused by any later iterator,
+          dataset (or process) built on the same data and metadata. 'auto'
+          uses the memory if `persistent_iterator` and the estimated size of
+          the decoded dataset fits in `cache_memory_limit` bytes, and the disk
+          otherwise.
+      cache_dir: directory of the cache files of the 'disk' tier.
+      cache_memory_limit: memory ceiling in bytes of the 'auto' mode.
+      persistent_iterator: whether the dataset is iterated by a single
+          iterator for the whole process (e.g. one kept in a session that
+          lives across the calls of the model), which the 'memory' tier needs
+          to pay off. Only used by the 'auto' mode.
+      sparse_output: if True, SPARSE bundles are returned as `tf.SparseTensor`
+          objects of dense shape
+            [sequence_size, row_count, col_count, 1]
+          instead of being densified. Datasets with sparse tensors can still
+          be batched, which gives a batch of COO matrices with one more
+          dimension.
+      decode_ratio: downscaling ratio (1, 2, 4 or 8) applied while decoding
+          the JPEG images of COMPRESSED bundles (DCT scaling). Useful when
+          the model resizes the images anyway.
+      decode_parallel_iterations: number of frames of a sequence decoded in
+          parallel.
+      image_dtype: type of the decoded images. `tf.float32` gives values in
+          [0, 1), `tf.uint8` keeps the values in [0, 255] so that conversion
+          (and normalization) can be done after batching.
+      dtype_policy: type of the tensor of each bundle. `None` gives float32
+          tensors (and `image_dtype` for COMPRESSED bundles). 'compact' gives
+          uint8 images in [0, 255] for COMPRESSED bundles and float16 for
+          DENSE and SPARSE bundles, which divides the memory used by the
+          samples (shuffle buffer, cache) by 4 and 2 respectively. A dict
+          mapping bundle indexes to types overrides the type of these bundles
+          only. Normalization is left to the model (e.g. after batching).
+          uint8 is only allowed for COMPRESSED bundles. Labels stay float32.
     """
+    if cache not in CACHE_MODES:
+      raise ValueError("Unknown cache mode {}, should be one of {}."\
+                       .format(cache, CACHE_MODES))
+    if not isinstance(dtype_policy, dict) and\
+        dtype_policy not in DTYPE_POLICIES:
+      raise ValueError("Unknown dtype policy {}, should be a dict or one of "
+                       "{}.".format(dtype_policy, DTYPE_POLICIES))
     self.dataset_name_ = dataset_name
     self.metadata_ = AutoDLMetadata(dataset_name)
+    self.num_parallel_calls_ = num_parallel_calls
+    self.parse_batch_size_ = parse_batch_size
+    self.num_parallel_reads_ = num_parallel_reads
+    self.read_buffer_size_ = read_buffer_size
+    self.interleave_shards_ = interleave_shards
+    self.sloppy_ = sloppy
+    self.cache_ = cache
+    self.cache_dir_ = cache_dir
+    self.cache_memory_limit_ = cache_memory_limit
+    self.persistent_iterator_ = persistent_iterator
+    self.sparse_output_ = sparse_output
+    self.decode_ratio_ = decode_ratio
+    self.decode_parallel_iterations_ = decode_parallel_iterations
+    self.image_dtype_ = tf.as_dtype(image_dtype)
+    self.dtype_policy_ = dtype_policy
+    self.bundle_dtypes_ = [self._get_bundle_dtype(i)
+                           for i in range(self.metadata_.get_bundle_size())]
+    self.index_ = None
     self._create_dataset()
-    self.dataset_ = self.dataset_.map(self._parse_function)
+    self.dataset_ = self._parse_dataset(self.dataset_)
+    self.dataset_ = self._cache_dataset(self.dataset_)
 
   def get_dataset(self):
     """Returns a tf.data.dataset object."""
@@ -127,22 +167,143 @@ class AutoDLDataset(object):
     """Returns an AutoDLMetadata object."""
     return self.metadata_
 
+  def get_bundle_dtype(self, bundle_index):
+    """Returns the type of the tensor of bundle `bundle_index`."""
+    return self.bundle_dtypes_[bundle_index]
+
+  def _get_bundle_dtype(self, bundle_index):
+    """Type of bundle `bundle_index` according to `self.dtype_policy_`."""
+    is_compressed = self.metadata_.is_compressed(bundle_index)
+    if isinstance(self.dtype_policy_, dict) and\
+        bundle_index in self.dtype_policy_:
+      dtype = tf.as_dtype(self.dtype_policy_[bundle_index])
+    elif self.dtype_policy_ == "compact":
+      dtype = tf.uint8 if is_compressed else tf.float16
+    else:
+      dtype = self.image_dtype_ if is_compressed else tf.float32
+    if dtype == tf.uint8 and not is_compressed:
+      raise ValueError("Bundle {} is not COMPRESSED and cannot be converted "
+                       "to uint8 without loss.".format(bundle_index))
+    if not (dtype.is_floating or dtype == tf.uint8):
+      raise ValueError("Unsupported type {} for bundle {}."\
+                       .format(dtype.name, bundle_index))
+    return dtype
+
   def _feature_key(self, index, feature_name):
     return str(index) + "_" + feature_name
 
-  def _parse_function(self, sequence_example_proto):
-    """Parse a SequenceExample in the AutoDL/TensorFlow format.
+  def _parse_dataset(self, dataset):
+    """Map a dataset of serialized SequenceExamples to parsed samples."""
+    if not self.parse_batch_size_:
+      return dataset.map(self._parse_function,
+                         num_parallel_calls=self.num_parallel_calls_)
+    dataset = dataset.batch(self.parse_batch_size_)
+    dataset = dataset.map(self._parse_batch_function,
+                          num_parallel_calls=self.num_parallel_calls_)
+    # Slicing the parsed batch gives back, for each example, the same
+    # (contexts, features) structure as `tf.parse_single_sequence_example`,
+    # once the dense sequences are cut to their own length.
+    dataset = dataset.flat_map(
+        lambda contexts, features, lengths:
+        tf.data.Dataset.from_tensor_slices((contexts, features, lengths)))
+    return dataset.map(self._build_unpadded_sample,
+                       num_parallel_calls=self.num_parallel_calls_)
+
+  def _get_output_config(self):
+    """Options that change the content of the samples (thus of the cache)."""
+    return (self.sparse_output_, self.decode_ratio_,
+            tuple(dtype.name for dtype in self.bundle_dtypes_))
+
+  def _cache_key(self):
+    """Key of the cache file: hash of the dataset path and of its metadata.
+
+    The sizes of the shards and the output options are also hashed so that a
+    dataset rewritten in place or parsed differently does not hit a stale
+    cache.
+    """
+    key = hashlib.sha1()
+    key.update(os.path.abspath(self.dataset_name_).encode("utf-8"))
+    key.update(self.metadata_.metadata_.SerializeToString())
+    key.update(str(self._get_output_config()).encode("utf-8"))
+    files = gfile.Glob(dataset_file_pattern(self.dataset_name_))
+    for filename in sorted(files):
+      key.update("{}:{}".format(os.path.basename(filename),
+                                gfile.Stat(filename).length).encode("utf-8"))
+    return key.hexdigest()
+
+  def get_cache_filename(self):
+    """Returns the prefix of the files of the on-disk cache tier."""
+    return os.path.join(self.cache_dir_, self._cache_key())
+
+  def estimate_sample_nbytes(self):
+    """Estimate the size in bytes of one parsed sample from the metadata.
 
-    Args:
-      sequence_example_proto: a SequenceExample with "x_dense_input" or sparse
-          input representation.
     Returns:
-      An array of tensors. For first edition of AutoDl challenge, returns a
-          pair `(features, labels)` where `features` is a Tensor of shape
-            [sequence_size, row_count, col_count, num_channels]
-          and `labels` a Tensor of shape
-            [output_dim, ]
+      An integer, or `None` if some dimensions are unknown (e.g. for images
+      of variable sizes). Sparse bundles are counted as dense ones even with
+      `sparse_output`, since the number of non-zero entries is not known.
+    """
+    nbytes = 4 * self.metadata_.get_output_size() # labels
+    for i in range(self.metadata_.get_bundle_size()):
+      shape = self._get_bundle_shape(i)
+      if shape is None:
+        return None
+      nbytes += self.get_bundle_dtype(i).size * int(np.prod(shape))
+    return nbytes
+
+  def _cache_dataset(self, dataset):
+    """Apply the cache tier chosen by `self.cache_` to parsed `dataset`."""
+    if self.cache_ is None:
+      return dataset
+    cache = self.cache_
+    if cache == "auto":
+      sample_nbytes = self.estimate_sample_nbytes()
+      if self.persistent_iterator_ and sample_nbytes is not None and\
+          sample_nbytes * self.metadata_.size() <= self.cache_memory_limit_:
+        cache = "memory"
+      else:
+        cache = "disk"
+    if cache == "memory":
+      return dataset.cache()
+    gfile.MakeDirs(self.cache_dir_)
+    # Nothing else can be using the cache since no iterator was created yet.
+    self.remove_stale_cache_lockfiles()
+    return dataset.cache(self.get_cache_filename())
+
+  def remove_stale_cache_lockfiles(self):
+    """Remove the lockfiles of an incomplete on-disk cache.
+
+    A pass interrupted before the end leaves a lockfile without any index,
+    which would make the next pass fail. Must not be called while a pass
+    over the dataset is filling the cache.
+    """
+    filename = self.get_cache_filename()
+    if not gfile.Glob(filename + ".index"):
+      for lockfile in gfile.Glob(filename + "_*.lockfile"):
+        gfile.Remove(lockfile)
+
+  def _get_image_num_channels(self, bundle_index):
+    """Number of channels of the decoded images of a COMPRESSED bundle.
+
+    Images are decoded in RGB unless `num_channels` is set in the metadata.
     """
+    if self.metadata_.has_num_channels(bundle_index):
+      return self.metadata_.get_num_channels(bundle_index)
+    return 3
+
+  def _get_decoded_size(self, size):
+    """Size of an image axis after decoding with `self.decode_ratio_`."""
+    if size <= 0:
+      return size
+    return -(-size // self.decode_ratio_) # ceil, as done by libjpeg
+
+  def _get_context_features(self):
+    return {
+        "label_index": tf.VarLenFeature(tf.int64),
+        "label_score": tf.VarLenFeature(tf.float32)
+    }
+
+  def _get_sequence_features(self):
     sequence_features = {}
     for i in range(self.metadata_.get_bundle_size()):
       if self.metadata_.is_sparse(i):
@@ -159,14 +320,63 @@ class AutoDLDataset(object):
         sequence_features[self._feature_key(
             i, "dense_input")] = tf.FixedLenSequenceFeature(
                 self.metadata_.get_tensor_size(i), dtype=tf.float32)
+    return sequence_features
+
+  def _parse_function(self, sequence_example_proto):
+    """Parse a SequenceExample in the AutoDL/TensorFlow format.
+
+    Args:
+      sequence_example_proto: a SequenceExample with "x_dense_input" or sparse
+          input representation.
+    Returns:
+      An array of tensors. For first edition of AutoDl challenge, returns a
+          pair `(features, labels)` where `features` is a Tensor of shape
+            [sequence_size, row_count, col_count, num_channels]
+          and `labels` a Tensor of shape
+            [output_dim, ]
+    """
     contexts, features = tf.parse_single_sequence_example(
         sequence_example_proto,
-        context_features={
-            "label_index": tf.VarLenFeature(tf.int64),
-            "label_score": tf.VarLenFeature(tf.float32)
-        },
-        sequence_features=sequence_features)
+        context_features=self._get_context_features(),
+        sequence_features=self._get_sequence_features())
+    return self._build_sample(contexts, features)
+
+  def _parse_batch_function(self, sequence_example_protos):
+    """Parse a batch of SequenceExamples with a single parsing op.
+
+    Args:
+      sequence_example_protos: a 1-D string Tensor of serialized
+          SequenceExamples.
+    Returns:
+      A triple `(contexts, features, lengths)` of dicts of batched (dense or
+          sparse) Tensors, whose first dimension is the batch dimension.
+          `lengths` holds the length of the dense sequence features of each
+          example: they are padded to the longest sequence of the batch.
+    """
+    return tf.io.parse_sequence_example(
+        sequence_example_protos,
+        context_features=self._get_context_features(),
+        sequence_features=self._get_sequence_features())
+
+  def _build_unpadded_sample(self, contexts, features, lengths):
+    """Build the sample of one example of a parsed batch, without the
+    padding frames of its dense sequence features (see
+    `_parse_batch_function`)."""
+    features = dict(features)
+    for key, length in lengths.items():
+      if key in features:
+        features[key] = features[key][:length]
+    return self._build_sample(contexts, features)
+
+  def _build_sample(self, contexts, features):
+    """Build the sample tensors from parsed contexts and sequence features.
 
+    Args:
+      contexts: dict of parsed context features of one SequenceExample.
+      features: dict of parsed sequence features of one SequenceExample.
+    Returns:
+      An array of tensors, see `_parse_function`.
+    """
     sample = []
     for i in range(self.metadata_.get_bundle_size()):
       key_dense = self._feature_key(i, "dense_input")
@@ -183,17 +393,32 @@ class AutoDLDataset(object):
                            "be known but got {} instead..."\
                            .format((sequence_size, row_count, col_count)))
         f = tf.reshape(f, [sequence_size, row_count, col_count, num_channels])
+        if self.get_bundle_dtype(i) != tf.float32:
+          f = tf.cast(f, self.get_bundle_dtype(i))
         sample.append(f)
 
       sequence_size = sequence_size if sequence_size > 0 else None
       key_compressed = self._feature_key(i, "compressed")
       if key_compressed in features:
         compressed_images = features[key_compressed].values
+        num_channels = self._get_image_num_channels(i)
         # `images` here is a 4D-tensor of shape [T, H, W, C], some of which
         # might be unknown
-        images = tf.map_fn(
-            dataset_utils.decompress_image, compressed_images, dtype=tf.float32)
-        images.set_shape([sequence_size, row_count, col_count, 3]) # TODO: 3 to change to num_channels
+        if sequence_size == 1:
+          # No need for a loop over the frames
+          image = dataset_utils.decompress_image(
+              compressed_images[0], num_channels=num_channels,
+              dtype=self.get_bundle_dtype(i), ratio=self.decode_ratio_)
+          images = tf.expand_dims(image, 0)
+        else:
+          images = dataset_utils.decompress_images(
+              compressed_images, num_channels=num_channels,
+              dtype=self.get_bundle_dtype(i), ratio=self.decode_ratio_,
+              parallel_iterations=self.decode_parallel_iterations_)
+        images.set_shape([sequence_size,
+                          row_count and self._get_decoded_size(row_count),
+                          col_count and self._get_decoded_size(col_count),
+                          num_channels])
         sample.append(images)
 
       key_sparse_val = self._feature_key(i, "sparse_value")
@@ -203,6 +428,9 @@ class AutoDLDataset(object):
         sparse_col = features[key_sparse_col].values
         sparse_row = features[key_sparse_row].values
         sparse_val = features[key_sparse_val]
+        sparse_values = sparse_val.values
+        if self.get_bundle_dtype(i) != tf.float32:
+          sparse_values = tf.cast(sparse_values, self.get_bundle_dtype(i))
         indices = sparse_val.indices
         indices = tf.concat([
             tf.reshape(indices[:, 0], [-1, 1]),
@@ -211,13 +439,15 @@ class AutoDLDataset(object):
         ], 1)
         sparse_tensor = tf.sparse_reorder(
             tf.SparseTensor(
-                indices, sparse_val.values,
+                indices, sparse_values,
                 [sequence_size, row_count, col_count]))
-        # TODO: see how we can keep sparse tensors instead of
-        # returning dense ones.
-        tensor = tf.sparse_tensor_to_dense(sparse_tensor)
-        tensor = tf.reshape(tensor,
-                  [sequence_size, row_count, col_count, 1])
+        if self.sparse_output_:
+          tensor = tf.sparse_reshape(sparse_tensor,
+                                     [sequence_size, row_count, col_count, 1])
+        else:
+          tensor = tf.sparse_tensor_to_dense(sparse_tensor)
+          tensor = tf.reshape(tensor,
+                    [sequence_size, row_count, col_count, 1])
         sample.append(tensor)
 
     # Enforce the Sample tensors to have the correct sequence length.
@@ -240,16 +470,214 @@ class AutoDLDataset(object):
         raise IOError("Unable to find training files. data_pattern='" +
                       dataset_file_pattern(self.dataset_name_) + "'.")
       # logging.info("Number of training files: %s.", str(len(files)))
-      self.dataset_ = tf.data.TFRecordDataset(files)
+      if not self.num_parallel_reads_:
+        self.dataset_ = tf.data.TFRecordDataset(
+            files, buffer_size=self.read_buffer_size_)
+      else:
+        self.dataset_ = self._create_sharded_dataset(files)
+
+  def _create_sharded_dataset(self, files):
+    """Read the shards `files` with `self.num_parallel_reads_` readers."""
+    def read_shard(filename):
+      return tf.data.TFRecordDataset(filename,
+                                     buffer_size=self.read_buffer_size_)
+    files_dataset = tf.data.Dataset.from_tensor_slices(files)
+    if self.interleave_shards_:
+      interleave = tf.data.experimental.parallel_interleave(
+          read_shard,
+          cycle_length=self.num_parallel_reads_,
+          sloppy=self.sloppy_)
+    else:
+      # Only one shard is consumed at a time, which keeps the order of the
+      # files, while the next shards are opened and read in the background.
+      interleave = tf.data.experimental.parallel_interleave(
+          read_shard,
+          cycle_length=1,
+          prefetch_input_elements=self.num_parallel_reads_)
+    return files_dataset.apply(interleave)
+
+  def get_index(self):
+    """Returns a `TFRecordIndex` of the shards, built on first call.
+
+    Record ids follow the order of sequential reading of the shards, i.e. the
+    order of `get_dataset()` when shards are not interleaved.
+    """
+    if self.index_ is None:
+      files = gfile.Glob(dataset_file_pattern(self.dataset_name_))
+      self.index_ = TFRecordIndex(files)
+    return self.index_
+
+  def get_subset_dataset(self, record_ids):
+    """Returns a tf.data.Dataset of the examples `record_ids` (in this order).
+
+    Only the bytes of these records are read, using the offset index of the
+    shards. This allows random access, slicing (e.g. `range(100, 200)`),
+    sampling and sharding (e.g. `range(k, len(index), num_shards)`).
+    """
+    index = self.get_index()
+    record_ids = list(record_ids)
+    dataset = tf.data.Dataset.from_generator(
+        lambda: index.get_records(record_ids),
+        output_types=tf.string,
+        output_shapes=tf.TensorShape([]))
+    return self._parse_dataset(dataset)
+
+  def sample_record_ids(self, num_samples, seed=None):
+    """Returns `num_samples` distinct record ids drawn uniformly at random."""
+    num_records = len(self.get_index())
+    random_state = np.random.RandomState(seed)
+    record_ids = random_state.choice(num_records,
+                                     size=min(num_samples, num_records),
+                                     replace=False)
+    return sorted(record_ids)
+
+  def _get_bundle_shape(self, bundle_index):
+    """Shape [sequence_size, row_count, col_count, num_channels] of a bundle.
+
+    Returns `None` if some dimensions are unknown.
+    """
+    sequence_size = self.metadata_.get_sequence_size()
+    row_count, col_count = self.metadata_.get_matrix_size(bundle_index)
+    if self.metadata_.is_sparse(bundle_index):
+      num_channels = 1
+    elif self.metadata_.is_compressed(bundle_index):
+      num_channels = self._get_image_num_channels(bundle_index)
+      row_count = self._get_decoded_size(row_count)
+      col_count = self._get_decoded_size(col_count)
+    else:
+      num_channels = self.metadata_.get_num_channels(bundle_index)
+    shape = (sequence_size, row_count, col_count, num_channels)
+    if min(shape) <= 0:
+      return None
+    return shape
+
+  def get_numpy_dir(self):
+    """Returns the directory of the NumPy export of the dataset."""
+    return os.path.join(self.cache_dir_, self._cache_key() + "_numpy")
+
+  def export_numpy(self, export_dir=None, num_workers=4, batch_size=256):
+    """Write the samples of the dataset to `.npy` files.
+
+    The export contains one file `bundle_<i>.npy` per bundle, of shape
+      [num_examples, sequence_size, row_count, col_count, num_channels]
+    and one file `labels.npy` of shape [num_examples, output_dim], in the
+    order of the records (see `get_index`). The record ids are split in
+    `num_workers` contiguous ranges that are parsed concurrently and written
+    in place to memory-mapped files, so the dataset never needs to fit in
+    memory. The files are written in a temporary directory which is then
+    renamed, so an existing export is always complete.
+
+    Args:
+      export_dir: directory of the export, `get_numpy_dir()` by default (the
+          same key as the on-disk cache, so the export is reused by any later
+          dataset built on the same data, metadata and output options).
+      num_workers: number of ranges of records parsed concurrently.
+      batch_size: number of examples fetched at once by each worker.
+    Returns:
+      The path to the export directory.
+    Raises:
+      ValueError: if some bundle has an unknown shape (e.g. images of
+          variable sizes) or is returned as a `tf.SparseTensor`.
+    """
+    export_dir = export_dir or self.get_numpy_dir()
+    if gfile.IsDirectory(export_dir):
+      return export_dir
+    if self.sparse_output_:
+      raise ValueError("Cannot export a dataset with sparse_output=True.")
+    shapes = [self._get_bundle_shape(i)
+              for i in range(self.metadata_.get_bundle_size())]
+    if None in shapes:
+      raise ValueError("Cannot export bundles of unknown shape, got {}."\
+                       .format(shapes))
+    num_examples = len(self.get_index())
+    tmp_dir = export_dir + ".tmp.{}".format(os.getpid())
+    gfile.MakeDirs(tmp_dir)
+    arrays = [np.lib.format.open_memmap(
+        os.path.join(tmp_dir, "bundle_{}.npy".format(i)), mode="w+",
+        dtype=self.get_bundle_dtype(i).as_numpy_dtype,
+        shape=(num_examples,) + shape) for i, shape in enumerate(shapes)]
+    arrays.append(np.lib.format.open_memmap(
+        os.path.join(tmp_dir, "labels.npy"), mode="w+", dtype=np.float32,
+        shape=(num_examples, self.metadata_.get_output_size())))
+
+    # The graph is built in this thread, then each worker runs its own
+    # iterator in a shared session.
+    num_workers = max(1, min(num_workers, num_examples))
+    bounds = np.linspace(0, num_examples, num_workers + 1).astype(int)
+    graph = tf.Graph()
+    with graph.as_default():
+      next_elements = [self.get_subset_dataset(range(begin, end))\
+                       .batch(batch_size).make_one_shot_iterator().get_next()
+                       for begin, end in zip(bounds[:-1], bounds[1:])]
+    errors = []
+    def write_range(sess, next_element, begin):
+      try:
+        position = begin
+        while True:
+          try:
+            batch = sess.run(next_element)
+          except tf.errors.OutOfRangeError:
+            break
+          for array, values in zip(arrays, batch):
+            array[position:position + len(values)] = values
+          position += len(batch[-1])
+      except Exception as e: # pylint: disable=broad-except
+        errors.append(e)
+    try:
+      with tf.Session(graph=graph) as sess:
+        threads = [threading.Thread(target=write_range,
+                                    args=(sess, next_element, begin))
+                   for next_element, begin in zip(next_elements, bounds)]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+      if errors:
+        raise errors[0]
+      for array in arrays:
+        array.flush()
+      try:
+        os.rename(tmp_dir, export_dir)
+      except OSError:
+        # Exported concurrently by another process
+        if not gfile.IsDirectory(export_dir):
+          raise
+    finally:
+      if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    return export_dir
+
+  def to_numpy(self, mmap=True, export_dir=None, **kwargs):
+    """Returns the samples of the dataset as NumPy arrays.
+
+    The dataset is exported with `export_numpy` (passing `kwargs`) on the
+    first call.
+
+    Args:
+      mmap: if True, the arrays are read-only memory-mapped views of the
+          exported files, so nothing is copied in memory. Otherwise the
+          arrays are loaded in memory.
+      export_dir: see `export_numpy`.
+    Returns:
+      A list `[bundle_0, ..., bundle_(N-1), labels]` of arrays whose first
+          dimension is the example dimension, i.e. the structure of the
+          samples of `get_dataset()`, batched over the whole dataset.
+    """
+    export_dir = self.export_numpy(export_dir=export_dir, **kwargs)
+    mmap_mode = "r" if mmap else None
+    filenames = ["bundle_{}.npy".format(i)
+                 for i in range(self.metadata_.get_bundle_size())]
+    filenames.append("labels.npy")
+    return [np.load(os.path.join(export_dir, filename), mmap_mode=mmap_mode)
+            for filename in filenames]
 
   def get_nth_element(self, num):
-    """Get n-th element in `autodl_dataset` using iterator."""
-    dataset = self.get_dataset()
+    """Get n-th element in `autodl_dataset` using the offset index."""
+    dataset = self.get_subset_dataset([num])
     iterator = dataset.make_one_shot_iterator()
     next_element = iterator.get_next()
     with tf.Session() as sess:
-      for _ in range(num+1):
-        tensor_3d, labels = sess.run(next_element)
+      tensor_3d, labels = sess.run(next_element)
     return tensor_3d, labels
 
   def show_image(self, num):
@@ -0,0 +1,124 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Metadata of AutoDL datasets.
+
+Reads `metadata.textproto` with protobuf and the standard library only, so that
+the metadata of a dataset (shapes, sample_count, output_dim, ...) can be
+inspected without importing TensorFlow. The parsed `DataSpecification` is
+cached in a binary sidecar file next to the text proto, which makes the next
+openings a single read of a few bytes.
+"""
+
+import os
+from google.protobuf import text_format
+from data_pb2 import DataSpecification
+from data_pb2 import MatrixSpec
+
+METADATA_FILENAME = "metadata.textproto"
+SIDECAR_FILENAME = "metadata.binarypb"
+
+def metadata_filename(dataset_name):
+  return os.path.join("", dataset_name, METADATA_FILENAME)
+
+
+def sidecar_filename(dataset_name):
+  return os.path.join("", dataset_name, SIDECAR_FILENAME)
+
+
+def read_metadata(dataset_name, use_sidecar=True):
+  """Read the `DataSpecification` of the dataset `dataset_name`.
+
+  Args:
+    dataset_name: path to the directory containing `metadata.textproto`.
+    use_sidecar: if True, read the binary sidecar when it is at least as
+        recent as the text proto, and (re)write it otherwise. Failing to write
+        it (e.g. on a read-only dataset directory) is silently ignored.
+  Returns:
+    A `DataSpecification` proto.
+  """
+  metadata = DataSpecification()
+  text_path = metadata_filename(dataset_name)
+  binary_path = sidecar_filename(dataset_name)
+  if use_sidecar and os.path.isfile(binary_path) and\
+      os.path.getmtime(binary_path) >= os.path.getmtime(text_path):
+    with open(binary_path, "rb") as f:
+      metadata.ParseFromString(f.read())
+    return metadata
+  with open(text_path, "r") as f:
+    text_format.Merge(f.read(), metadata)
+  if use_sidecar:
+    # Write to a temporary file then rename it, so that concurrent readers
+    # never see a partially written sidecar.
+    tmp_path = binary_path + ".tmp.{}".format(os.getpid())
+    try:
+      with open(tmp_path, "wb") as f:
+        f.write(metadata.SerializeToString())
+      os.rename(tmp_path, binary_path)
+    except (IOError, OSError):
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+  return metadata
+
+
+class AutoDLMetadata(object):
+  """AutoDL data specification."""
+
+  def __init__(self, dataset_name, use_sidecar=True):
+    self.dataset_name_ = dataset_name
+    self.metadata_ = read_metadata(dataset_name, use_sidecar=use_sidecar)
+
+  def get_dataset_name(self):
+    return self.dataset_name_
+
+  def is_compressed(self, bundle_index):
+    return self.metadata_.matrix_spec[
+        bundle_index].format == MatrixSpec.COMPRESSED
+
+  def is_sparse(self, bundle_index):
+    return self.metadata_.matrix_spec[bundle_index].format == MatrixSpec.SPARSE
+
+  def get_bundle_size(self):
+    return len(self.metadata_.matrix_spec)
+
+  def get_matrix_size(self, bundle_index):
+    return (self.metadata_.matrix_spec[bundle_index].row_count,
+            self.metadata_.matrix_spec[bundle_index].col_count)
+
+  def get_num_channels(self, bundle_index):
+    return  self.metadata_.matrix_spec[bundle_index].num_channels
+
+  def has_num_channels(self, bundle_index):
+    """True if `num_channels` is set explicitly (its default value is 1)."""
+    return self.metadata_.matrix_spec[bundle_index].HasField("num_channels")
+
+  def get_tensor_size(self, bundle_index):
+    matrix_size = self.get_matrix_size(bundle_index)
+    num_channels = self.get_num_channels(bundle_index)
+    return matrix_size[0], matrix_size[1], num_channels
+
+  def get_sequence_size(self):
+    return self.metadata_.sequence_size
+
+  def get_output_size(self):
+    return self.metadata_.output_dim
+
+  def size(self):
+    return self.metadata_.sample_count
+
+  def get_label_to_index_map(self):
+    return self.metadata_.label_to_index_map
+
+  def get_feature_to_index_map(self):
+    return self.metadata_.feature_to_index_map
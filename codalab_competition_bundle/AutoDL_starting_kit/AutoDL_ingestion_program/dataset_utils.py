@@ -38,24 +38,61 @@ def enforce_sequence_size(sample, sequence_size):
   return sample
 
 
-def decompress_image(compressed_image):
-  """Decode a JPEG compressed image into a 3-D float Tensor.
+def decompress_image(compressed_image, num_channels=3, dtype=tf.float32,
+                     ratio=1):
+  """Decode a JPEG compressed image into a 3-D Tensor.
 
   TODO(andreamichi): Test this function.
 
   Args:
     compressed_image: string representing an image compressed as JPEG.
+    num_channels: number of color channels of the decoded image.
+    dtype: `tf.float32` for values ranging from [0, 1), or `tf.uint8` to keep
+        the raw values ranging from [0, 255] (4 times less memory).
+    ratio: downscaling ratio (1, 2, 4 or 8) applied by the JPEG decoder
+        itself (DCT scaling), which is much faster than decoding at full
+        resolution then resizing. Only supported for JPEG images.
   Returns:
-    3-D float Tensor with values ranging from [0, 1).
+    3-D Tensor of type `dtype`.
   """
   # Note that the resulting image contains an unknown height and width
   # that is set dynamically by decode_jpeg. The returned image
   # is a 3-D Tensor of uint8 [0, 255]. The third dimension is the channel.
-  image = tf.image.decode_image(compressed_image, channels=3)
+  if ratio > 1:
+    image = tf.image.decode_jpeg(compressed_image, channels=num_channels,
+                                 ratio=ratio)
+  else:
+    image = tf.image.decode_image(compressed_image, channels=num_channels)
 
-  # Use float32 rather than uint8.
-  image = tf.image.convert_image_dtype(image, dtype=tf.float32)
+  if dtype != tf.uint8:
+    image = tf.image.convert_image_dtype(image, dtype=dtype)
 
-  image.set_shape([None, None, 3])
+  image.set_shape([None, None, num_channels])
 
   return image
+
+
+def decompress_images(compressed_images, num_channels=3, dtype=tf.float32,
+                      ratio=1, parallel_iterations=10):
+  """Decode a sequence of JPEG compressed images into a 4-D Tensor.
+
+  The frames are decoded in parallel and converted to `dtype` at once.
+
+  Args:
+    compressed_images: 1-D string Tensor of images compressed as JPEG, all of
+        the same size.
+    parallel_iterations: number of frames decoded in parallel.
+    Other arguments: see `decompress_image`.
+  Returns:
+    4-D Tensor of shape [T, H, W, num_channels] and of type `dtype`.
+  """
+  images = tf.map_fn(
+      lambda x: decompress_image(x, num_channels=num_channels, dtype=tf.uint8,
+                                 ratio=ratio),
+      compressed_images,
+      dtype=tf.uint8,
+      parallel_iterations=parallel_iterations,
+      back_prop=False)
+  if dtype != tf.uint8:
+    images = tf.image.convert_image_dtype(images, dtype=dtype)
+  return images
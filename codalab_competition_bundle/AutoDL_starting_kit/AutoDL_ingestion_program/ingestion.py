@@ -36,8 +36,9 @@
 # We implemented several classes:
 # 1) DATA LOADING:
 #    ------------
-# dataset.py
-# dataset.AutoDLMetadata: Read metadata in metadata.textproto
+# dataset.py, dataset_metadata.py
+# dataset_metadata.AutoDLMetadata: Read metadata in metadata.textproto (no
+#   TensorFlow needed), also available as dataset.AutoDLMetadata
 # dataset.AutoDLDataset: Read data and give tf.data.Dataset
 # 2) LEARNING MACHINE:
 #    ----------------
@@ -92,6 +93,95 @@ max_cycle = 1
 max_estimators = 1000
 max_samples = float('Inf')
 
+# Parsing of the datasets
+#########################
+# Number of SequenceExamples parsed in parallel by AutoDLDataset: None parses
+# sequentially, -1 lets tf.data autotune it. Records can also be parsed in
+# batches of parse_batch_size with one op (None parses them one by one).
+num_parallel_parse_calls = -1
+parse_batch_size = None
+# Number of shards of a dataset read concurrently (None reads them in a single
+# sequential stream) and size in bytes of the read buffer of each shard. The
+# training set interleaves the shards (in a non-deterministic order if
+# sloppy_train_reads) while the test set is always read in the shard order.
+num_parallel_reads = None
+read_buffer_size = None
+sloppy_train_reads = True
+# Cache of the parsed and decoded samples, so that only the first pass over the
+# training/test set pays for parsing and decoding: None (no cache), 'memory',
+# 'disk' or 'auto' (memory up to cache_memory_limit bytes, disk above). The
+# memory cache lives in the iterator over the dataset, so it only pays off if
+# the model keeps one iterator across its calls (e.g. the PersistentSession of
+# the sample model, not an Estimator): set persistent_train_iterator then,
+# otherwise 'auto' uses the disk.
+cache_datasets = None
+cache_memory_limit = 2 * 1024 ** 3
+persistent_train_iterator = False
+# If True, SPARSE bundles are given to the model as tf.SparseTensor objects
+# instead of dense tensors. The model needs to handle them.
+sparse_output = False
+# Decoding of the images of COMPRESSED bundles: number of frames decoded in
+# parallel in each example
+decode_parallel_iterations = 10
+# Types of the samples given to the model. None gives float32 tensors,
+# 'compact' gives uint8 images (in [0, 255]) and float16 dense and sparse
+# inputs, leaving normalization to the model.
+dtype_policy = None
+
+# Pipelining of the train/predict process
+#########################################
+# If True, the test set is parsed in the background into an on-disk cache
+# while the model trains for the first time (so the test set always uses the
+# 'disk' cache), and prediction files are written on a writer thread while the
+# model trains again. The time saved by the overlap is reported.
+pipeline_train_test = False
+
+# Format of the prediction files
+################################
+# If True, predictions are written as float32 in the binary NumPy .npy format
+# (under the same file names), which is much faster to write and to read than
+# text. The scoring program reads both formats.
+binary_predictions = False
+
+# Tracing of the phases
+#######################
+# If True, the construction of the datasets and of the model, each Model.train
+# and Model.test call and the writing of each prediction file are recorded
+# (wall and CPU time, memory, number of examples) in output_dir, in
+# <dataset>.trace.jsonl and <dataset>.trace.json (Chrome trace format), see
+# tracing.py. Off by default, not to add files next to the predictions.
+trace_phases = False
+
+# Monitoring of the resources
+#############################
+# If True, the memory (RSS, available memory, memory of the container), CPU
+# utilization, I/O bytes and open files of the ingestion program are sampled
+# every monitor_interval seconds, tagged with the current phase (e.g. train,
+# test), and written to resources.csv next to duration.txt (in the directory
+# of each dataset for worker processes), see resource_monitor.py. Off by
+# default, not to add files next to the predictions.
+monitor_resources = False
+monitor_interval = 1
+
+# Parallel processing of several datasets
+##########################################
+# If num_dataset_workers > 1 (or -1 for as many as the available CPUs allow),
+# the datasets are dispatched to that many worker processes, each with its own
+# AutoDLDataset, Model and time budget. The predictions of each dataset are
+# then written to its own directory output_dir/<dataset name>/, with its own
+# start.txt and duration.txt, so that it can be scored on its own. Each worker
+# is pinned to cpus_per_worker CPUs (None splits the available CPUs evenly)
+# and, if pin_worker_memory, allocates its memory on the NUMA node of its CPUs.
+# If use_fork_server, the workers are forked from a fork server which imported
+# TensorFlow, the dataset code and the participant's model once (see
+# WORKER_MODULES), so that they start with warm imports, instead of being new
+# Python interpreters which import them again. The startup latency of each
+# worker (until these modules are imported) is reported.
+num_dataset_workers = None
+cpus_per_worker = None
+pin_worker_memory = True
+use_fork_server = True
+
 # Redirect stardant output to live results page (detailed_results.html)
 # to have live output for debugging
 REDIRECT_STDOUT = False
@@ -141,11 +231,14 @@ from sys import argv, path
 import datetime
 the_date = datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
 
+# Prefix of the log messages, e.g. the dataset of a worker process
+log_tag = ''
+
 def print_log(*content):
   """Logging function. (could've also used `import logging`.)"""
   if verbose:
     now = datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
-    print("INGESTION INFO: " + str(now)+ " ", end='')
+    print("INGESTION INFO: " + str(now)+ " " + log_tag, end='')
     print(*content)
 
 def clean_last_output(output_dir):
@@ -184,6 +277,220 @@ def get_time_budget(autodl_dataset):
   # Now it's 2 hours for any dataset (to be discussed).
   return 7200
 
+def write_start_file(output_dir):
+  """Create start file to tell scoring program that submission has begun.
+
+  Returns:
+    The path of the start file.
+  """
+  start_filename =  'start.txt'
+  start_filepath = os.path.join(output_dir, start_filename)
+  with open(start_filepath, 'w') as f:
+    f.write('Started!')
+  return start_filepath
+
+def write_duration_file(output_dir, duration):
+  """Write the time spent to a duration.txt file.
+
+  It is renamed once written, since the scoring program reads it when it
+  appears.
+  """
+  duration_filename =  'duration.txt'
+  duration_tmp_filepath = os.path.join(output_dir, '.duration.txt.tmp')
+  with open(duration_tmp_filepath, 'w') as f:
+    f.write(str(duration))
+  os.rename(duration_tmp_filepath, os.path.join(output_dir, duration_filename))
+  if verbose:
+    print_log("Successfully write duration to {}.".format(duration_filename))
+
+# Modules imported by the worker processes before processing their dataset
+# ('__main__' is this program)
+WORKER_MODULES = ['__main__', 'numpy', 'tensorflow', 'data_io', 'dataset',
+                  'ingestion_pipeline', 'model']
+
+def start_resource_monitor(output_dir):
+  """Start sampling the resources of this process to output_dir/resources.csv,
+  tagged with the phases of the calling thread.
+
+  Returns:
+    The ResourceMonitor to close, or None if monitor_resources is False.
+  """
+  if not monitor_resources:
+    return None
+  import threading
+  import tracing
+  from resource_monitor import ResourceMonitor
+  thread = threading.current_thread()
+  return ResourceMonitor(os.path.join(output_dir, 'resources.csv'),
+                         interval=monitor_interval,
+                         get_phase=lambda: tracing.get_phase(thread)).start()
+
+def get_dataset_output_dir(output_dir, basename):
+  """Output directory of a dataset processed by a worker process."""
+  return os.path.join(output_dir, basename[:-5])
+
+def ingest_dataset(basename, input_dir, output_dir):
+  """Train/predict process on one dataset, e.g. 'adult.data', writing the
+  predictions (and the trace of its phases) to output_dir."""
+  import tracing
+  tracer = None
+  if trace_phases:
+    trace_path = os.path.join(output_dir, basename[:-5] + '.trace')
+    tracer = tracing.Tracer(trace_path + '.jsonl', trace_path + '.json')
+  elif monitor_resources:
+    tracer = tracing.Tracer() # Only keeps the phases for the monitor
+  tracing.set_tracer(tracer)
+  try:
+    with tracing.span('ingest_dataset', dataset=basename):
+      _ingest_dataset(basename, input_dir, output_dir)
+  finally:
+    tracing.set_tracer(None)
+    if tracer is not None:
+      tracer.close()
+
+def _ingest_dataset(basename, input_dir, output_dir):
+  # Imported here for the worker processes, which do not run the main program
+  import data_io
+  from model import Model
+  from dataset import AutoDLDataset # THE class of AutoDL datasets
+  from ingestion_pipeline import AsyncWriter
+  from ingestion_pipeline import DatasetWarmer
+  import tracing
+
+  print_log("========== Ingestion program version " + str(version) + " ==========")
+  print_log("************************************************")
+  print_log("******** Processing dataset " + basename[:-5].capitalize() + " ********")
+  print_log("************************************************")
+
+  # ======== Learning on a time budget:
+  # Keep track of time not to exceed your time budget. Time spent to inventory data neglected.
+  start = time.time()
+
+  # ======== Creating a data object with data, informations about it
+  print_log("Reading training set and test set...")
+
+  ##### Begin creating training set and test set #####
+  dataset_options = {
+      'num_parallel_calls': num_parallel_parse_calls,
+      'parse_batch_size': parse_batch_size,
+      'num_parallel_reads': num_parallel_reads,
+      'read_buffer_size': read_buffer_size,
+      'cache': cache_datasets,
+      'cache_memory_limit': cache_memory_limit,
+      'sparse_output': sparse_output,
+      'decode_parallel_iterations': decode_parallel_iterations,
+      'dtype_policy': dtype_policy}
+  with tracing.span('create_train_dataset') as span:
+    D_train = AutoDLDataset(os.path.join(input_dir, basename, "train"),
+                            interleave_shards=True,
+                            sloppy=sloppy_train_reads,
+                            persistent_iterator=persistent_train_iterator,
+                            **dataset_options)
+    span.set(num_examples=D_train.get_metadata().size())
+  test_dir = os.path.join(input_dir, basename, "test")
+  test_warmer = None
+  if pipeline_train_test:
+    dataset_options['cache'] = 'disk'
+    test_warmer = DatasetWarmer(test_dir, **dataset_options)
+  with tracing.span('create_test_dataset') as span:
+    D_test = AutoDLDataset(test_dir, **dataset_options)
+    span.set(num_examples=D_test.get_metadata().size())
+  if test_warmer is not None:
+    # Started after D_test is built, which cleans the cache lockfiles
+    test_warmer.start()
+  ##### End creating training set and test set #####
+
+  # ======== Keep track of time
+  if debug_mode<1:
+      time_budget = get_time_budget(D_train)        # <== HERE IS THE TIME BUDGET!
+  else:
+      time_budget = max_time
+
+  # ========= Creating a model
+  print_log("Creating model...")
+  ##### Begin creating model #####
+  with tracing.span('create_model'):
+    M = Model(D_train.get_metadata()) # The metadata of D_train and D_test only differ in sample_count
+  ###### End creating model ######
+
+  # Keeping track of how many predictions are made
+  prediction_order_number = 0
+  def write_predictions(filename, predictions):
+    with tracing.span('write_predictions', filename=os.path.basename(filename),
+                      num_examples=len(predictions)):
+      data_io.write(filename, predictions, binary=binary_predictions)
+  writer = AsyncWriter(write_predictions) if pipeline_train_test else None
+
+  # Start the CORE PART: train/predict process
+  start = time.time()
+  while(True):
+    remaining_time_budget = start + time_budget - time.time()
+    print_log("Training the model...")
+    # Train the model (the model may add attributes to the span, see tracing)
+    with tracing.span('train', call=prediction_order_number,
+                      remaining_time_budget=remaining_time_budget):
+      M.train(D_train.get_dataset(),
+              remaining_time_budget=remaining_time_budget)
+    overlap_saved = 0
+    if writer is not None:
+      overlap_saved += writer.pop_write_time()
+    if test_warmer is not None:
+      with tracing.span('wait_test_dataset'):
+        waited, warmup_duration = test_warmer.wait()
+      overlap_saved += max(warmup_duration - waited, 0)
+      test_warmer = None
+    remaining_time_budget = start + time_budget - time.time()
+    # Make predictions using the trained model
+    with tracing.span('test', call=prediction_order_number,
+                      remaining_time_budget=remaining_time_budget) as span:
+      Y_test = M.test(D_test.get_dataset(),
+                      remaining_time_budget=remaining_time_budget)
+      if Y_test is not None:
+        span.set(num_examples=len(Y_test))
+    if Y_test is None: # Stop train/predict process if Y_test is None
+      break
+    # Prediction files: adult.predict_0, adult.predict_1, ...
+    filename_test = basename[:-5] + '.predict_' +\
+      str(prediction_order_number)
+    # Write predictions to output_dir
+    if writer is not None:
+      writer.submit(os.path.join(output_dir,filename_test), Y_test)
+    else:
+      write_predictions(os.path.join(output_dir,filename_test), Y_test)
+    prediction_order_number += 1
+    print_log("[+] Prediction success, time spent so far %5.2f sec" % (time.time() - start))
+    if pipeline_train_test:
+      print_log("[+] Time saved by overlapping with training %5.2f sec"
+                % overlap_saved)
+    remaining_time_budget = start + time_budget - time.time()
+    print_log( "[+] Time left %5.2f sec" % remaining_time_budget)
+    if remaining_time_budget<=0:
+      break
+  if writer is not None:
+    # All prediction files are written before the end of ingestion
+    with tracing.span('wait_prediction_writes'):
+      writer.close()
+
+def run_dataset_worker(basename, input_dir, output_dir):
+  """Entry point of the worker processes: process one dataset, as the whole
+  ingestion program does, in its own output_dir."""
+  global log_tag
+  log_tag = '[' + basename[:-5] + '] '
+  worker_start = time.time()
+  import data_io
+  data_io.mkdir(output_dir)
+  start_filepath = write_start_file(output_dir)
+  monitor = start_resource_monitor(output_dir)
+  try:
+    ingest_dataset(basename, input_dir, output_dir)
+  finally:
+    # Also if the model fails, so that the worker leaves no start.txt behind
+    # and the resources sampled until then are written
+    os.remove(start_filepath)
+    if monitor is not None:
+      monitor.close()
+  write_duration_file(output_dir, time.time() - worker_start)
+
 # =========================== BEGIN PROGRAM ================================
 
 if __name__=="__main__" and debug_mode<4:
@@ -238,6 +545,9 @@ if __name__=="__main__" and debug_mode<4:
     import model # participants' model.py
     from model import Model
     from dataset import AutoDLDataset # THE class of AutoDL datasets
+    from ingestion_pipeline import AsyncWriter
+    from ingestion_pipeline import DatasetWarmer
+    from ingestion_pool import WorkerPool, get_num_workers
 
     # Clear potentiablly results of previous execution (for local run)
     clean_last_output(output_dir)
@@ -251,10 +561,8 @@ if __name__=="__main__" and debug_mode<4:
     data_io.mkdir(output_dir)
 
     # Create start file to tell scoring program that submission has begin
-    start_filename =  'start.txt'
-    start_filepath = os.path.join(output_dir, start_filename)
-    with open(start_filepath, 'w') as f:
-      f.write('Started!')
+    start_filepath = write_start_file(output_dir)
+    monitor = start_resource_monitor(output_dir)
 
     #### INVENTORY DATA (and sort dataset names alphabetically)
     datanames = data_io.inventory_data(input_dir)
@@ -276,65 +584,53 @@ if __name__=="__main__" and debug_mode<4:
     # Loop over datasets (if several)
     # For AutoDL challenge, there is only 1 dataset for each track, so this loop
     # can actually be ignored. Here basename is e.g. 'adult.data'
-    for i, basename in enumerate(datanames):
-
-        print_log("========== Ingestion program version " + str(version) + " ==========")
-        print_log("************************************************")
-        print_log("******** Processing dataset " + basename[:-5].capitalize() + " ********")
-        print_log("************************************************")
-
-        # ======== Learning on a time budget:
-        # Keep track of time not to exceed your time budget. Time spent to inventory data neglected.
-        start = time.time()
-
-        # ======== Creating a data object with data, informations about it
-        print_log("Reading training set and test set...")
-
-        ##### Begin creating training set and test set #####
-        D_train = AutoDLDataset(os.path.join(input_dir, basename, "train"))
-        D_test = AutoDLDataset(os.path.join(input_dir, basename, "test"))
-        ##### End creating training set and test set #####
-
-        # ======== Keep track of time
-        if debug_mode<1:
-            time_budget = get_time_budget(D_train)        # <== HERE IS THE TIME BUDGET!
-        else:
-            time_budget = max_time
-
-        # ========= Creating a model
-        print_log("Creating model...")
-        ##### Begin creating model #####
-        M = Model(D_train.get_metadata()) # The metadata of D_train and D_test only differ in sample_count
-        ###### End creating model ######
-
-        # Keeping track of how many predictions are made
-        prediction_order_number = 0
-
-        # Start the CORE PART: train/predict process
-        start = time.time()
-        while(True):
-          remaining_time_budget = start + time_budget - time.time()
-          print_log("Training the model...")
-          # Train the model
-          M.train(D_train.get_dataset(),
-                  remaining_time_budget=remaining_time_budget)
-          remaining_time_budget = start + time_budget - time.time()
-          # Make predictions using the trained model
-          Y_test = M.test(D_test.get_dataset(),
-                          remaining_time_budget=remaining_time_budget)
-          if Y_test is None: # Stop train/predict process if Y_test is None
-            break
-          # Prediction files: adult.predict_0, adult.predict_1, ...
-          filename_test = basename[:-5] + '.predict_' +\
-            str(prediction_order_number)
-          # Write predictions to output_dir
-          data_io.write(os.path.join(output_dir,filename_test), Y_test)
-          prediction_order_number += 1
-          print_log("[+] Prediction success, time spent so far %5.2f sec" % (time.time() - start))
-          remaining_time_budget = start + time_budget - time.time()
-          print_log( "[+] Time left %5.2f sec" % remaining_time_budget)
-          if remaining_time_budget<=0:
-            break
+    if num_dataset_workers is not None and num_dataset_workers != 1\
+        and datanames:
+        # Datasets processed in parallel, each by its own worker process
+        num_workers = get_num_workers(num_dataset_workers, len(datanames),
+                                      cpus_per_worker)
+        print_log("Processing {} datasets with {} worker processes"\
+                  .format(len(datanames), num_workers))
+        # The modules are already imported here (e.g. model above). The fork
+        # server imports them from the same sys.path (including program_dir
+        # and submission_dir added above), and skips those that fail, which
+        # the workers then import themselves (see cold_modules below)
+        pool = WorkerPool(num_workers, cpus_per_worker=cpus_per_worker,
+                          pin_memory=pin_worker_memory, modules=WORKER_MODULES,
+                          fork_server=use_fork_server)
+        tasks = [(basename, (basename, input_dir,
+                             get_dataset_output_dir(output_dir, basename)))
+                 for basename in datanames]
+        startups = []
+        for basename, exitcode, duration, startup in\
+            pool.run(run_dataset_worker, tasks):
+            if startup is not None:
+                startups.append(startup)
+            cold_modules = pool.cold_modules.get(basename)
+            if use_fork_server and cold_modules:
+                print_log("WARNING: the fork server did not import {}, the "
+                          "worker of {} imported them itself"\
+                          .format(cold_modules, basename))
+            startup_str = "unknown" if startup is None else\
+                "{:.2f} sec".format(startup)
+            if exitcode == 0:
+                print_log("[+] Dataset {} done in {:.2f} sec (startup {})"\
+                          .format(basename, duration, startup_str))
+            else:
+                execution_success = False
+                print_log("[-] Dataset {} failed with exit code {} after "
+                          "{:.2f} sec (startup {})"\
+                          .format(basename, exitcode, duration, startup_str))
+        if startups:
+            print_log("[+] Worker startup latency ({}): mean {:.3f} sec, "
+                      "min {:.3f} sec, max {:.3f} sec"\
+                      .format("fork server" if use_fork_server
+                              else "new interpreters",
+                              sum(startups) / len(startups),
+                              min(startups), max(startups)))
+    else:
+        for i, basename in enumerate(datanames):
+            ingest_dataset(basename, input_dir, output_dir)
 
     # Finishing ingestion program
     overall_time_spent = time.time() - overall_start
@@ -343,12 +639,11 @@ if __name__=="__main__" and debug_mode<4:
     if os.path.exists(start_filepath):
       os.remove(start_filepath)
 
+    if monitor is not None:
+      monitor.close()
+
     # Write overall_time_spent to a duration.txt file
-    duration_filename =  'duration.txt'
-    with open(os.path.join(output_dir, duration_filename), 'w') as f:
-      f.write(str(overall_time_spent))
-      if verbose:
-          print_log("Successfully write duration to {}.".format(duration_filename))
+    write_duration_file(output_dir, overall_time_spent)
     if execution_success:
         print_log("[+] Done")
         print_log("[+] Overall time spent %5.2f sec " % overall_time_spent)
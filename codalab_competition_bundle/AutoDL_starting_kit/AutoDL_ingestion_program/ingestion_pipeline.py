@@ -0,0 +1,148 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Background work of the ingestion program, overlapped with training.
+
+`DatasetWarmer` fills the on-disk cache of the test set while the model trains,
+so that the first `Model.test` call reads parsed samples instead of parsing
+and decoding the test set. `AsyncWriter` writes the prediction files on a
+writer thread, so that the next training round starts as soon as `Model.test`
+returns.
+"""
+
+import queue
+import threading
+import time
+import tensorflow as tf
+import tracing
+from dataset import AutoDLDataset
+
+
+class DatasetWarmer(object):
+  """Run one pass over an AutoDLDataset on a background thread.
+
+  The dataset should use the 'disk' cache: the pass writes the cache file,
+  which is then read by any other dataset built on the same data and options.
+  """
+
+  def __init__(self, dataset_name, **dataset_options):
+    self.dataset_name_ = dataset_name
+    self.dataset_options_ = dataset_options
+    self.duration_ = None
+    self.error_ = None
+    self.thread_ = threading.Thread(target=self._run)
+    self.thread_.daemon = True
+
+  def start(self):
+    self.thread_.start()
+    return self
+
+  def _run(self):
+    begin = time.time()
+    autodl_dataset = None
+    try:
+      # Own graph and session, since the main thread builds its graphs
+      # concurrently.
+      with tf.Graph().as_default(), tracing.span('warm_dataset') as span:
+        autodl_dataset = AutoDLDataset(self.dataset_name_,
+                                       **self.dataset_options_)
+        span.set(num_examples=autodl_dataset.get_metadata().size())
+        # Fetch a scalar per example to avoid copying the samples
+        dataset = autodl_dataset.get_dataset().map(lambda *sample: 0)
+        next_element = dataset.batch(1000).make_one_shot_iterator().get_next()
+        with tf.Session() as sess:
+          while True:
+            try:
+              sess.run(next_element)
+            except tf.errors.OutOfRangeError:
+              break
+    except Exception as e: # pylint: disable=broad-except
+      self.error_ = e
+      # Leave a usable cache to the main thread
+      if autodl_dataset is not None:
+        autodl_dataset.remove_stale_cache_lockfiles()
+    self.duration_ = time.time() - begin
+
+  def wait(self):
+    """Wait for the end of the pass.
+
+    Returns:
+      A pair (time waited, duration of the pass) in seconds. The difference
+      is the time saved by running the pass in the background. Failing passes
+      are not fatal: the dataset is then parsed when it is used.
+    """
+    begin = time.time()
+    self.thread_.join()
+    waited = time.time() - begin
+    if self.error_ is not None:
+      tf.logging.warning("Background pass over {} failed: {}"\
+                         .format(self.dataset_name_, self.error_))
+    return waited, self.duration_
+
+
+class AsyncWriter(object):
+  """Call `write_fn(filename, predictions)` on a writer thread, in order.
+
+  The predictions must not be modified after being submitted.
+  """
+
+  def __init__(self, write_fn):
+    self.write_fn_ = write_fn
+    self.queue_ = queue.Queue()
+    self.lock_ = threading.Lock()
+    self.write_time_ = 0 # Time spent writing since the last `pop_write_time`
+    self.error_ = None
+    self.thread_ = threading.Thread(target=self._run)
+    self.thread_.daemon = True
+    self.thread_.start()
+
+  def _run(self):
+    while True:
+      item = self.queue_.get()
+      try:
+        if item is None:
+          return
+        if self.error_ is None:
+          begin = time.time()
+          self.write_fn_(*item)
+          with self.lock_:
+            self.write_time_ += time.time() - begin
+      except Exception as e: # pylint: disable=broad-except
+        self.error_ = e
+      finally:
+        self.queue_.task_done()
+
+  def _raise_error(self):
+    if self.error_ is not None:
+      raise self.error_
+
+  def submit(self, filename, predictions):
+    """Schedule the writing of `predictions` to `filename`."""
+    self._raise_error()
+    self.queue_.put((filename, predictions))
+
+  def pop_write_time(self):
+    """Returns the time spent writing files since the last call.
+
+    This time was spent in parallel with the main thread, i.e. saved.
+    """
+    with self.lock_:
+      write_time, self.write_time_ = self.write_time_, 0
+    return write_time
+
+  def close(self):
+    """Wait for all the submitted files to be written and stop the thread."""
+    self.queue_.put(None)
+    self.thread_.join()
+    self._raise_error()
@@ -0,0 +1,310 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pool of worker processes of the ingestion program, one task per process.
+
+Each task (e.g. the train/predict process of one dataset) runs in a new
+process, so that it gets its own TensorFlow runtime, and at most `num_workers`
+tasks run at the same time. Each worker slot is pinned to its own set of CPUs
+and, on NUMA machines, allocates its memory on the node of these CPUs.
+
+Workers are either new Python interpreters ('spawn'), which import TensorFlow
+and the other modules they need again, or are forked from a long-lived fork
+server ('forkserver') which imported these modules once, so that they start
+with warm imports. The fork server is started with the module search path
+(sys.path) of this process, which Python does not pass to it otherwise, and
+silently skips the modules it cannot import: the workers report them (see
+`WorkerPool.cold_modules`). The startup latency of each worker, from its start
+to the end of these imports, is measured.
+
+The sizes of the thread pools of OpenMP and BLAS libraries (e.g. those of
+NumPy) are read from the environment when the libraries are loaded, i.e. when
+the fork server imports them for forked workers. They are thus set to the
+number of CPUs of a worker in the environment the fork server (or each new
+interpreter) starts with.
+
+CPU pinning uses `os.sched_setaffinity` and memory pinning the
+set_mempolicy(2) system call (through ctypes, no dependency needed). Both are
+Linux-only and skipped elsewhere.
+"""
+
+import contextlib
+import ctypes
+import ctypes.util
+import glob
+import importlib
+import multiprocessing
+import os
+import platform
+import re
+import sys
+import time
+from multiprocessing import forkserver
+from multiprocessing.connection import wait as wait_sentinels
+
+# set_mempolicy(2): allocate on the given nodes first, then on the others when
+# they are full (MPOL_BIND would fail the allocations instead)
+MPOL_PREFERRED = 1
+SYS_SET_MEMPOLICY = {'x86_64': 238, 'aarch64': 237, 'ppc64le': 261}
+# Environment variables of the sizes of the thread pools of OpenMP and BLAS
+# libraries, set to the number of CPUs of the workers before they start
+THREAD_COUNT_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                          'MKL_NUM_THREADS']
+
+
+def parse_cpulist(cpulist):
+  """Parse a Linux CPU list, e.g. '0-3,8-11', into a list of integers."""
+  cpus = []
+  for part in cpulist.strip().split(','):
+    if not part:
+      continue
+    bounds = part.split('-')
+    cpus.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+  return cpus
+
+
+def get_numa_nodes():
+  """Returns a dict mapping each CPU to its NUMA node (empty if unknown)."""
+  cpu_nodes = {}
+  for node_dir in glob.glob('/sys/devices/system/node/node[0-9]*'):
+    node = int(re.search(r'node(\d+)$', node_dir).group(1))
+    try:
+      with open(os.path.join(node_dir, 'cpulist')) as f:
+        cpus = parse_cpulist(f.read())
+    except (IOError, OSError, ValueError):
+      continue
+    for cpu in cpus:
+      cpu_nodes[cpu] = node
+  return cpu_nodes
+
+
+def get_available_cpus():
+  """CPUs this process may run on, grouped by NUMA node."""
+  if hasattr(os, 'sched_getaffinity'):
+    cpus = os.sched_getaffinity(0)
+  else:
+    cpus = range(multiprocessing.cpu_count())
+  cpu_nodes = get_numa_nodes()
+  return sorted(cpus, key=lambda cpu: (cpu_nodes.get(cpu, 0), cpu))
+
+
+def get_num_workers(num_workers, num_tasks, cpus_per_worker=None):
+  """Number of workers to run num_tasks tasks.
+
+  Args:
+    num_workers: requested number of workers, or -1 for as many workers as
+      available CPUs (divided by cpus_per_worker).
+    num_tasks: number of tasks, there is no more workers than tasks.
+    cpus_per_worker: number of CPUs of each worker, None to split the CPUs.
+  """
+  if num_workers is None or num_workers < 0:
+    num_workers = max(len(get_available_cpus()) // (cpus_per_worker or 1), 1)
+  return max(min(num_workers, num_tasks), 1)
+
+
+def split_cpus(num_workers, cpus_per_worker=None):
+  """Returns the list of the CPUs of each worker.
+
+  The available CPUs are split evenly between the workers (in consecutive
+  groups, so that a worker stays on one NUMA node when possible), or in groups
+  of cpus_per_worker CPUs, shared when there are not enough CPUs.
+  """
+  cpus = get_available_cpus()
+  if cpus_per_worker is None:
+    cpus_per_worker = max(len(cpus) // num_workers, 1)
+  cpus_per_worker = min(cpus_per_worker, len(cpus))
+  return [[cpus[(i * cpus_per_worker + j) % len(cpus)]
+           for j in range(cpus_per_worker)]
+          for i in range(num_workers)]
+
+
+def get_thread_count_environment(num_cpus):
+  """Environment variables limiting the thread pools to num_cpus threads."""
+  return {variable: str(num_cpus) for variable in THREAD_COUNT_VARIABLES}
+
+
+@contextlib.contextmanager
+def updated_environment(variables):
+  """Context manager setting environment variables, e.g. for the processes
+  started meanwhile, and restoring them afterwards."""
+  previous = {name: os.environ.get(name) for name in variables}
+  os.environ.update(variables)
+  try:
+    yield
+  finally:
+    for name, value in previous.items():
+      if value is None:
+        del os.environ[name]
+      else:
+        os.environ[name] = value
+
+
+def set_preferred_numa_node(node):
+  """Allocate the memory of this process on a NUMA node first.
+
+  Returns:
+    True if the memory policy was set.
+  """
+  syscall_number = SYS_SET_MEMPOLICY.get(platform.machine())
+  if syscall_number is None:
+    return False
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+  except OSError:
+    return False
+  word_bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+  nodemask = (ctypes.c_ulong * (node // word_bits + 1))()
+  nodemask[node // word_bits] = 1 << (node % word_bits)
+  maxnode = len(nodemask) * word_bits + 1
+  return libc.syscall(syscall_number, MPOL_PREFERRED, nodemask,
+                      ctypes.c_ulong(maxnode)) == 0
+
+
+def pin_process(cpus, pin_memory=True):
+  """Pin this process to the given CPUs and to the memory of their node.
+
+  Returns:
+    The NUMA node the memory is pinned to, or None.
+  """
+  if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, cpus)
+  # For the libraries loaded from now on, see WorkerPool for the others
+  os.environ.update(get_thread_count_environment(len(cpus)))
+  cpu_nodes = get_numa_nodes()
+  if not pin_memory or len(set(cpu_nodes.values())) <= 1:
+    return None # Not a NUMA machine
+  nodes = [cpu_nodes.get(cpu, 0) for cpu in cpus]
+  node = max(set(nodes), key=nodes.count) # Node of most CPUs
+  return node if set_preferred_numa_node(node) else None
+
+
+def _run_pinned(target, args, cpus, pin_memory, modules, start_time,
+                startup_queue):
+  """Entry point of the worker processes."""
+  pin_process(cpus, pin_memory)
+  # The main module of the parent is imported as '__mp_main__'
+  cold_modules = [module for module in modules
+                  if (module if module != '__main__' else '__mp_main__')
+                  not in sys.modules]
+  for module in modules:
+    importlib.import_module(module) # Already imported if forked with them
+  startup_queue.put((multiprocessing.current_process().name,
+                     time.time() - start_time, cold_modules))
+  target(*args)
+
+
+class WorkerPool(object):
+  """Run tasks in worker processes pinned to their own CPUs.
+
+  Usage:
+    pool = WorkerPool(num_workers=4, modules=['numpy'], fork_server=True)
+    for name, exitcode, duration, startup in pool.run(target, tasks):
+      ...
+
+  The target and its arguments must be picklable, i.e. the target is a
+  module-level function.
+  """
+
+  def __init__(self, num_workers, cpus_per_worker=None, pin_memory=True,
+               modules=(), fork_server=False):
+    """
+    Args:
+      num_workers: maximum number of tasks running at the same time.
+      cpus_per_worker: number of CPUs of each worker, None to split the
+        available CPUs evenly.
+      pin_memory: whether to allocate the memory of each worker on the NUMA
+        node of its CPUs.
+      modules: names of the modules the workers need, imported before the
+        target runs (and counted in the startup latency). '__main__' is the
+        main module of the parent process.
+      fork_server: if True, the modules are imported once by a fork server,
+        from which the workers are forked. They should be importable without
+        side effects from the sys.path of this process when the first task
+        starts, e.g. already imported by this process.
+    """
+    self.num_workers = num_workers
+    self.pin_memory = pin_memory
+    self.worker_cpus = split_cpus(num_workers, cpus_per_worker)
+    self.modules = list(modules)
+    self.fork_server = fork_server
+    # Name of each task -> modules its worker imported itself, e.g. those the
+    # fork server failed to import
+    self.cold_modules = {}
+    if fork_server:
+      self.context = multiprocessing.get_context('forkserver')
+      self.context.set_forkserver_preload(self.modules)
+    else:
+      self.context = multiprocessing.get_context('spawn')
+
+  def _start_fork_server(self):
+    """Start the fork server (if not running) with the module search path of
+    this process, including the directories added at runtime, and the thread
+    pool sizes of the workers.
+
+    The fork server receives sys.path but does not use it (up to Python 3.12
+    at least), and ignores the modules it cannot import. It is given as
+    PYTHONPATH, which its forked workers inherit.
+    """
+    environment = get_thread_count_environment(
+        max(len(cpus) for cpus in self.worker_cpus))
+    environment['PYTHONPATH'] = os.pathsep.join(
+        os.path.abspath(directory) for directory in sys.path if directory)
+    with updated_environment(environment):
+      forkserver.ensure_running()
+
+  def run(self, target, tasks):
+    """Run `target(*args)` for each (name, args) of tasks.
+
+    Yields:
+      (name, exitcode, duration, startup) of each task as it ends, in the
+      order of the ends. A nonzero exitcode means that the task failed.
+      startup is the startup latency of the worker in seconds (None if it
+      failed before the end of its imports) and duration includes it. The
+      modules the worker imported itself are then in `cold_modules[name]`.
+    """
+    tasks = list(tasks)
+    if tasks and self.fork_server:
+      self._start_fork_server()
+    tasks.reverse() # Pop the tasks in order
+    free_slots = list(range(self.num_workers))
+    running = {} # sentinel -> (name, process, slot, start time)
+    startup_queue = self.context.SimpleQueue()
+    startups = {}
+    while tasks or running:
+      while tasks and free_slots:
+        name, args = tasks.pop()
+        slot = free_slots.pop(0)
+        begin = time.time()
+        process = self.context.Process(
+            target=_run_pinned, name=name,
+            args=(target, args, self.worker_cpus[slot], self.pin_memory,
+                  self.modules, begin, startup_queue))
+        # Inherited by new interpreters (forked workers have those of the
+        # fork server)
+        with updated_environment(
+            get_thread_count_environment(len(self.worker_cpus[slot]))):
+          process.start()
+        running[process.sentinel] = (name, process, slot, begin)
+      for sentinel in wait_sentinels(list(running)):
+        name, process, slot, begin = running.pop(sentinel)
+        process.join()
+        free_slots.append(slot)
+        free_slots.sort()
+        while not startup_queue.empty():
+          worker_name, startup, cold_modules = startup_queue.get()
+          startups[worker_name] = startup
+          self.cold_modules[worker_name] = cold_modules
+        yield (name, process.exitcode, time.time() - begin,
+               startups.pop(name, None))
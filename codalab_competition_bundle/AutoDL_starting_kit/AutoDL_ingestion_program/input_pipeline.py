@@ -0,0 +1,268 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Input pipelines of the models, from the datasets of `train` and `test`.
+
+`build_input_pipeline` turns the dataset of examples given to `Model.train` or
+`Model.test` into a dataset of batches:
+
+  cache -> shuffle -> repeat -> map (parallel) -> batch -> prefetch
+
+- The examples are cached (in memory) before being shuffled, so that the
+  epochs after the first one do not read and parse them again. 'auto' caches
+  when the dataset fits under a memory limit. The cache lives in the iterator
+  over the pipeline, so it only pays off if the iterator is kept across the
+  calls of the model: not with a `tf.estimator.Estimator`, which builds a new
+  one at each call.
+- Per-example preprocessing runs in parallel. The models only preprocess
+  examples of variable shapes (cropping and resizing them to a fixed shape),
+  which must be done before batching; examples of fixed shapes are batched
+  without any map.
+- Batches are prefetched, so that the pipeline prepares the next batches while
+  the model trains on the current one.
+Degrees of parallelism and prefetch buffers are set by tf.data (AUTOTUNE) by
+default.
+
+`InputProfiler` tells whether the training rounds are input-bound (the model
+waits for the pipeline) or compute-bound, from the time each training step
+waits for its batch (see `get_timed_next`). With `InputProfilerHook` it also
+works with `tf.estimator.Estimator`.
+
+  import input_pipeline
+  ...
+  def input_function(self, dataset, is_training):
+    dataset = input_pipeline.build_input_pipeline(
+        dataset, self.batch_size, is_training, map_fn=...)
+    return input_pipeline.get_next_batch(dataset)
+  ...
+  self.classifier.train(input_fn=train_input_fn, steps=steps_to_train,
+      hooks=[input_pipeline.InputProfilerHook(self.input_profiler)])
+"""
+
+import time
+import numpy as np
+import tensorflow as tf
+import tracing
+
+# Let tf.data choose the degree of parallelism and the prefetch buffer
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+# Caching of the examples before shuffling, see `build_input_pipeline`
+CACHE_MODES = (None, "memory", "auto")
+DEFAULT_CACHE_MEMORY_LIMIT = 1024 ** 3 # 1GB
+
+# Collection of the wait times of `get_next_batch`, read by InputProfilerHook
+WAIT_TIME_COLLECTION = "input_pipeline_wait_times"
+
+
+def _flatten(structure):
+  if isinstance(structure, (tuple, list)):
+    return [x for element in structure for x in _flatten(element)]
+  if isinstance(structure, dict):
+    return [x for key in sorted(structure) for x in _flatten(structure[key])]
+  return [structure]
+
+
+def _map_structure(fn, structure):
+  if isinstance(structure, (tuple, list)):
+    return type(structure)(_map_structure(fn, x) for x in structure)
+  if isinstance(structure, dict):
+    return {key: _map_structure(fn, value) for key, value in structure.items()}
+  return fn(structure)
+
+
+def estimate_example_nbytes(dataset):
+  """Size in bytes of one example of `dataset`, or None if some dimensions
+  are unknown (e.g. for images of variable sizes)."""
+  nbytes = 0
+  for shape, dtype in zip(_flatten(dataset.output_shapes),
+                          _flatten(dataset.output_types)):
+    if not shape.is_fully_defined():
+      return None
+    nbytes += dtype.size * int(np.prod(shape.as_list()))
+  return nbytes
+
+
+def build_input_pipeline(dataset, batch_size, is_training, map_fn=None,
+                         shuffle_buffer=100, cache=None, num_examples=None,
+                         cache_memory_limit=DEFAULT_CACHE_MEMORY_LIMIT,
+                         num_parallel_calls=AUTOTUNE,
+                         prefetch_buffer=AUTOTUNE):
+  """Dataset of the batches of `dataset`, shuffled and repeated for training.
+
+  Args:
+    dataset: a `tf.data.Dataset` of examples, e.g. (example, labels).
+    batch_size: number of examples of the batches.
+    is_training: if True, the examples are shuffled and repeated forever.
+    map_fn: function applied to each example (with the elements of the
+      example as arguments), or None.
+    shuffle_buffer: number of examples of the shuffle buffer.
+    cache: one of `CACHE_MODES`, for training only. 'memory' caches the
+      examples in memory before shuffling, 'auto' does so if the
+      `num_examples` examples fit in `cache_memory_limit` bytes.
+    num_examples: number of examples of `dataset`, used by 'auto'.
+    cache_memory_limit: memory ceiling in bytes of 'auto'.
+    num_parallel_calls: number of examples mapped in parallel,
+      `AUTOTUNE` lets tf.data choose it and None maps sequentially.
+    prefetch_buffer: number of batches prefetched, `AUTOTUNE` lets tf.data
+      choose it and 0 disables prefetching.
+  """
+  if cache not in CACHE_MODES:
+    raise ValueError("Unknown cache mode {}, should be one of {}."\
+                     .format(cache, CACHE_MODES))
+  if is_training:
+    if cache == "auto":
+      example_nbytes = estimate_example_nbytes(dataset)
+      if example_nbytes is None or num_examples is None or\
+          example_nbytes * num_examples > cache_memory_limit:
+        cache = None
+    if cache is not None:
+      dataset = dataset.cache()
+    # Shuffle input examples
+    dataset = dataset.shuffle(buffer_size=shuffle_buffer)
+    # Convert to RepeatDataset to train for several epochs
+    dataset = dataset.repeat()
+  if map_fn is not None:
+    dataset = dataset.map(map_fn, num_parallel_calls=num_parallel_calls)
+  dataset = dataset.batch(batch_size=batch_size)
+  if prefetch_buffer:
+    dataset = dataset.prefetch(prefetch_buffer)
+  return dataset
+
+
+def get_timed_next(iterator):
+  """Next batch of `iterator` and the time in seconds that a step computing
+  the batch waits for it, a scalar tensor to fetch with the step.
+
+  The wait is timed by two timestamps around the `get_next` op: almost none if
+  the batch is ready in the prefetch buffer, the time the pipeline lags behind
+  the model otherwise.
+  """
+  begin = tf.timestamp()
+  with tf.control_dependencies([begin]):
+    batch = iterator.get_next()
+  with tf.control_dependencies(_flatten(batch)):
+    end = tf.timestamp()
+  # The step only computes on the batch after the second timestamp, which
+  # would otherwise queue behind the computations when few threads run ops
+  with tf.control_dependencies([end]):
+    batch = _map_structure(tf.identity, batch)
+  return batch, end - begin
+
+
+def get_next_batch(dataset):
+  """Next batch of a one-shot iterator over `dataset`, as for the input_fn of
+  an Estimator. The time waited for it (see `get_timed_next`) is added to the
+  collection read by `InputProfilerHook`."""
+  batch, wait_time = get_timed_next(dataset.make_one_shot_iterator())
+  tf.add_to_collection(WAIT_TIME_COLLECTION, wait_time)
+  return batch
+
+
+class InputProfiler(object):
+  """Split the time of training rounds into input-bound and compute-bound time.
+
+  Each training step fetches the time it waited for its batch (see
+  `get_timed_next`), so that the rounds are profiled on the batches they
+  train on. If the pipeline keeps up with the model, the batches are ready in
+  the prefetch buffer and the steps barely wait: the round is compute-bound.
+  Otherwise each step waits for the time the pipeline lags behind the model:
+  the round is input-bound.
+  """
+
+  def __init__(self, threshold=0.1, verbose=True):
+    """
+    Args:
+      threshold: a round is input-bound if its steps wait for their batches
+        at least this fraction of its time.
+      verbose: whether to print a report of each round.
+    """
+    self.threshold = threshold
+    self.verbose = verbose
+    self.rounds = []
+    self.input_bound_time = 0
+    self.compute_bound_time = 0
+
+  def record_round(self, num_steps, duration, wait_time):
+    """Record a training round of num_steps steps in duration seconds, which
+    waited wait_time seconds in total for their batches (None if unknown).
+
+    Returns:
+      The record of the round, a dict.
+    """
+    input_fraction = None
+    bound = None
+    if wait_time is not None and duration > 0:
+      input_fraction = min(wait_time / duration, 1.)
+      bound = "input" if input_fraction >= self.threshold else "compute"
+      if bound == "input":
+        self.input_bound_time += duration
+      else:
+        self.compute_bound_time += duration
+    record = {"num_steps": num_steps,
+              "duration": duration,
+              "step_time": duration / max(num_steps, 1),
+              "wait_time": wait_time,
+              "input_fraction": input_fraction,
+              "bound": bound}
+    self.rounds.append(record)
+    tracing.annotate(input_wait_time=wait_time, input_fraction=input_fraction,
+                     bound=bound)
+    if self.verbose and bound is not None:
+      print("INPUT PIPELINE: {} steps in {:.2f} sec, {:.2f} sec waiting for "
+            "the input ({:.0%}): {}-bound. Total input-bound time: {:.2f} "
+            "sec, compute-bound time: {:.2f} sec."\
+            .format(num_steps, duration, wait_time, input_fraction, bound,
+                    self.input_bound_time, self.compute_bound_time))
+    return record
+
+
+class InputProfilerHook(tf.train.SessionRunHook):
+  """Profile a `tf.estimator.Estimator.train` call with an InputProfiler.
+
+  The batches are those of `get_next_batch` in the input_fn, whose wait times
+  are fetched with each step.
+  """
+
+  def __init__(self, profiler):
+    self.profiler = profiler
+    self.wait_time = None
+    self.total_wait_time = 0.
+    self.num_steps = 0
+    self.begin_time = None
+
+  def begin(self):
+    wait_times = tf.get_collection(WAIT_TIME_COLLECTION)
+    self.wait_time = tf.add_n(wait_times) if wait_times else None
+    self.total_wait_time = 0.
+    self.num_steps = 0
+    self.begin_time = None
+
+  def before_run(self, run_context):
+    if self.begin_time is None:
+      self.begin_time = time.time()
+    if self.wait_time is not None:
+      return tf.train.SessionRunArgs(self.wait_time)
+
+  def after_run(self, run_context, run_values):
+    self.num_steps += 1
+    if self.wait_time is not None:
+      self.total_wait_time += run_values.results
+
+  def end(self, session):
+    if self.begin_time is None:
+      return
+    duration = time.time() - self.begin_time
+    wait_time = self.total_wait_time if self.wait_time is not None else None
+    self.profiler.record_round(self.num_steps, duration, wait_time)
@@ -0,0 +1,187 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time series of the resources used by the ingestion program.
+
+`ResourceMonitor` samples, on a background thread at a fixed interval, the
+resources of the process: resident memory (RSS), CPU utilization (CPU time of
+all threads divided by wall time, so up to the number of cores), bytes read
+from and written to storage, open file descriptors and threads, as well as the
+memory available on the machine and the memory used by the container (cgroup),
+whose limit triggers the OOM killer. Each sample is tagged with the current
+phase (e.g. train or test, see tracing.py).
+
+Samples are appended to a CSV file and flushed as they are taken, so that the
+time series survives the process being killed, e.g. when running out of
+memory. The values are read from /proc (Linux), unavailable values are left
+empty.
+"""
+
+import os
+import threading
+import time
+
+COLUMNS = ['time', 'phase', 'rss', 'cpu_utilization', 'read_bytes',
+           'write_bytes', 'open_files', 'num_threads', 'mem_available',
+           'cgroup_memory']
+CGROUP_MEMORY_FILES = ['/sys/fs/cgroup/memory.current', # cgroup v2
+                       '/sys/fs/cgroup/memory/memory.usage_in_bytes'] # v1
+CGROUP_MEMORY_LIMIT_FILES = ['/sys/fs/cgroup/memory.max', # cgroup v2
+                             '/sys/fs/cgroup/memory/memory.limit_in_bytes'] # v1
+
+
+def _read_file(filename):
+  try:
+    with open(filename) as f:
+      return f.read()
+  except (IOError, OSError):
+    return None
+
+
+def _read_fields(filename):
+  """Parse a /proc file of 'key: value [kB]' lines into a dict of integers."""
+  content = _read_file(filename)
+  fields = {}
+  for line in (content or '').splitlines():
+    key, _, value = line.partition(':')
+    value = value.split()
+    if value and value[0].isdigit():
+      fields[key] = int(value[0]) * (1024 if value[1:] == ['kB'] else 1)
+  return fields
+
+
+def read_process_stat():
+  """Returns (CPU time in seconds, number of threads, RSS in bytes) of this
+  process, or Nones if unavailable."""
+  content = _read_file('/proc/self/stat')
+  if content is None:
+    times = os.times()
+    return times[0] + times[1], None, None
+  # The fields after the command name, starting with the state (field 3)
+  fields = content[content.rindex(')') + 2:].split()
+  clock_ticks = os.sysconf('SC_CLK_TCK')
+  cpu_time = (int(fields[11]) + int(fields[12])) / float(clock_ticks)
+  return (cpu_time, int(fields[17]),
+          int(fields[21]) * os.sysconf('SC_PAGE_SIZE'))
+
+
+def count_open_files():
+  try:
+    return len(os.listdir('/proc/self/fd'))
+  except (IOError, OSError):
+    return None
+
+
+def _read_first_integer(filenames):
+  for filename in filenames:
+    content = _read_file(filename)
+    if content is not None and content.strip().isdigit():
+      return int(content)
+  return None
+
+
+def read_cgroup_memory():
+  return _read_first_integer(CGROUP_MEMORY_FILES)
+
+
+def read_available_memory():
+  """Memory in bytes that the process can still allocate: the memory
+  available on the machine, or less if the container (cgroup) has a limit.
+  None if unknown."""
+  available = _read_fields('/proc/meminfo').get('MemAvailable')
+  limit = _read_first_integer(CGROUP_MEMORY_LIMIT_FILES)
+  usage = read_cgroup_memory()
+  if limit is not None and usage is not None:
+    # Without limit, cgroup v1 reports a huge number ('max' for v2)
+    container_available = max(limit - usage, 0)
+    if available is None or container_available < available:
+      available = container_available
+  return available
+
+
+class ResourceMonitor(object):
+  """Sample the resources of the process on a background thread.
+
+  Usage:
+    monitor = ResourceMonitor(filepath, interval=1, get_phase=...).start()
+    ...
+    monitor.close()
+  """
+
+  def __init__(self, filepath, interval=1, get_phase=None):
+    """
+    Args:
+      filepath: CSV file of the time series.
+      interval: time between two samples in seconds.
+      get_phase: function returning the current phase, or None.
+    """
+    self.filepath = filepath
+    self.interval = interval
+    self.get_phase = get_phase
+    self.start_time = None
+    self.last_time = None
+    self.last_cpu_time = None
+    self.stop_event = threading.Event()
+    self.thread = threading.Thread(target=self._run, name='resource_monitor')
+    self.thread.daemon = True
+    self.file = None
+
+  def start(self):
+    self.file = open(self.filepath, 'w')
+    self.file.write(','.join(COLUMNS) + '\n')
+    self.start_time = time.time()
+    self.thread.start()
+    return self
+
+  def sample(self):
+    """Returns the current values of COLUMNS."""
+    now = time.time()
+    cpu_time, num_threads, rss = read_process_stat()
+    cpu_utilization = None # Unknown for the first sample
+    if self.last_time is not None and now > self.last_time:
+      cpu_utilization = (cpu_time - self.last_cpu_time) / (now - self.last_time)
+    self.last_time, self.last_cpu_time = now, cpu_time
+    io = _read_fields('/proc/self/io')
+    return [round(now - self.start_time, 3),
+            self.get_phase() if self.get_phase is not None else '',
+            rss,
+            None if cpu_utilization is None else round(cpu_utilization, 3),
+            io.get('read_bytes'),
+            io.get('write_bytes'),
+            count_open_files(),
+            num_threads,
+            _read_fields('/proc/meminfo').get('MemAvailable'),
+            read_cgroup_memory()]
+
+  def _write_sample(self):
+    values = self.sample()
+    self.file.write(','.join('' if x is None else str(x) for x in values)
+                    + '\n')
+    self.file.flush()
+
+  def _run(self):
+    while True:
+      self._write_sample()
+      if self.stop_event.wait(self.interval):
+        return
+
+  def close(self):
+    """Take a last sample and stop the thread."""
+    if self.file is None:
+      return
+    self.stop_event.set()
+    self.thread.join()
+    self._write_sample()
+    self.file.close()
+    self.file = None
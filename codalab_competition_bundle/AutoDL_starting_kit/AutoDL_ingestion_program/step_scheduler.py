@@ -0,0 +1,346 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time budget management of the train/predict process of a model.
+
+A model is evaluated by the area under its learning curve (ALC): the score of
+each prediction against the time at which it is made, on a log time axis (see
+the scoring program). `StepScheduler` decides how many steps to train before
+each prediction so that this area is large within the time budget:
+
+- The time of a training step and of a prediction are estimated online by
+  exponential moving averages (EMA) of their mean and variance. The first
+  `train` and `test` calls, which also build graphs and parse the datasets,
+  are estimated separately from the following ones. So is the error of the
+  time predicted for each `train` call, e.g. its fixed costs, which matter in
+  short calls.
+- Before each `train` call, the next numbers of steps are planned: for each
+  candidate growth of the number of steps, the future predictions are simulated
+  with the expected times and an expected learning curve (`expected_score`,
+  which models can replace), and the candidate with the largest expected ALC
+  is chosen. The steps are then limited so that training and the next
+  prediction fit in the remaining time budget with pessimistic times (mean
+  plus `risk` standard deviations).
+
+A model adopts it through hooks around its `train` and `test` calls:
+
+  import step_scheduler
+  ...
+  def __init__(self, metadata):
+    ...
+    self.scheduler = step_scheduler.StepScheduler()
+
+  def train(self, dataset, remaining_time_budget=None):
+    steps_to_train = self.scheduler.get_steps_to_train(remaining_time_budget)
+    if steps_to_train <= 0:
+      ... # Stop
+    with self.scheduler.time_train(steps_to_train):
+      ... # Train steps_to_train steps
+
+  def test(self, dataset, remaining_time_budget=None):
+    if not self.scheduler.can_test(remaining_time_budget):
+      return None
+    with self.scheduler.time_test():
+      ... # Predict
+"""
+
+import contextlib
+import math
+import time
+
+# Remaining time budget assumed when none is given (it is always given in the
+# challenge)
+DEFAULT_TIME_BUDGET = 1200
+
+
+class RunningEstimate(object):
+  """Exponential moving average of the mean and variance of a quantity."""
+
+  def __init__(self, decay=0.3, prior_relative_std=0.5, min_count=3):
+    """
+    Args:
+      decay: weight of each new value, in (0, 1]. Larger values follow changes
+        faster.
+      prior_relative_std: standard deviation, relative to the mean, assumed
+        while fewer than min_count values were seen.
+      min_count: number of values from which the variance is estimated.
+    """
+    self.decay = decay
+    self.prior_relative_std = prior_relative_std
+    self.min_count = min_count
+    self.count = 0
+    self.mean = None
+    self.variance = 0.
+
+  def update(self, value):
+    self.count += 1
+    if self.mean is None:
+      self.mean = float(value)
+      return
+    # Incremental exponentially weighted mean and variance
+    diff = value - self.mean
+    increment = self.decay * diff
+    self.mean += increment
+    self.variance = (1 - self.decay) * (self.variance + diff * increment)
+
+  def get_std(self):
+    if self.mean is None:
+      return None
+    if self.count < self.min_count:
+      return self.prior_relative_std * abs(self.mean)
+    return math.sqrt(self.variance)
+
+  def get_upper(self, risk):
+    """Mean plus risk standard deviations (None if no value was seen)."""
+    if self.mean is None:
+      return None
+    return self.mean + risk * self.get_std()
+
+
+def saturating_score(half_steps):
+  """Expected learning curve, reaching half of its maximum at half_steps."""
+  return lambda num_steps: num_steps / float(num_steps + half_steps)
+
+
+def log_time(elapsed, time_budget):
+  """Position in [0, 1] of a time on the log time axis of the scoring program."""
+  return math.log(elapsed + 2) / math.log(time_budget + 1)
+
+
+class StepScheduler(object):
+  """Number of steps to train before each prediction, within a time budget.
+
+  See the module docstring for the hooks and the strategy.
+  """
+
+  def __init__(self, time_budget=None, first_steps=10, default_test_time=50.,
+               growth_factors=(1.5, 2., 3., 4., 8.), decay=0.3, risk=2.,
+               expected_score=None, min_steps=1, max_steps=None):
+    """
+    Args:
+      time_budget: total time budget, by default the remaining time budget of
+        the first call to `get_steps_to_train`.
+      first_steps: number of steps of the first `train` call.
+      default_test_time: conservative time of a prediction before any was
+        made.
+      growth_factors: candidate factors by which the cumulated number of steps
+        grows from one prediction to the next.
+      decay: weight of each new time in the moving averages.
+      risk: number of standard deviations added to the mean times to check
+        that training and predicting fit in the remaining time budget.
+      expected_score: function of the cumulated number of steps giving the
+        expected score of the predictions, increasing. By default, a
+        saturating curve reaching half its maximum at 500 steps.
+      min_steps: minimum number of steps worth training before a prediction.
+      max_steps: maximum number of steps of a `train` call, or None.
+    """
+    self.time_budget = time_budget
+    self.first_steps = first_steps
+    self.default_test_time = default_test_time
+    self.growth_factors = growth_factors
+    self.risk = risk
+    self.expected_score = expected_score or saturating_score(500)
+    self.min_steps = min_steps
+    self.max_steps = max_steps
+    self.step_time = RunningEstimate(decay)
+    self.test_time = RunningEstimate(decay)
+    self.train_call_error = RunningEstimate(decay)
+    self.first_train_time = None # Per step
+    self.first_test_time = None
+    self.cumulated_num_steps = 0
+    self.num_train_calls = 0
+    self.num_tests = 0
+    self.total_train_time = 0
+    self.total_test_time = 0
+    self.last_test_end = None # Elapsed time at the end of the last prediction
+
+  # ======== Hooks of the model ========
+
+  def record_train(self, num_steps, duration):
+    """To call after training num_steps steps in duration seconds."""
+    if num_steps <= 0:
+      return
+    self.num_train_calls += 1
+    self.cumulated_num_steps += num_steps
+    self.total_train_time += duration
+    if self.first_train_time is None:
+      self.first_train_time = duration / float(num_steps)
+      return
+    step_time = self.get_step_time()
+    self.train_call_error.update(duration - num_steps * step_time)
+    self.step_time.update(duration / float(num_steps))
+
+  def record_test(self, duration, remaining_time_budget=None):
+    """To call after a prediction made in duration seconds."""
+    self.num_tests += 1
+    self.total_test_time += duration
+    if self.first_test_time is None:
+      self.first_test_time = duration
+    else:
+      self.test_time.update(duration)
+    if remaining_time_budget is not None and self.time_budget is not None:
+      self.last_test_end = self.time_budget - remaining_time_budget
+
+  @contextlib.contextmanager
+  def time_train(self, num_steps):
+    """Context manager calling `record_train` with the time of its block."""
+    begin = time.time()
+    yield
+    self.record_train(num_steps, time.time() - begin)
+
+  @contextlib.contextmanager
+  def time_test(self, remaining_time_budget=None):
+    """Context manager calling `record_test` with the time of its block.
+
+    remaining_time_budget is the remaining time budget at its beginning.
+    """
+    begin = time.time()
+    yield
+    duration = time.time() - begin
+    self.record_test(duration, None if remaining_time_budget is None
+                     else remaining_time_budget - duration)
+
+  def can_test(self, remaining_time_budget):
+    """Whether a prediction is expected to end within the time budget."""
+    if remaining_time_budget is None:
+      return True
+    return self.get_test_time(pessimistic=True) <= remaining_time_budget
+
+  def get_steps_to_train(self, remaining_time_budget):
+    """Number of steps to train before the next prediction, 0 to stop."""
+    if remaining_time_budget is None: # Never the case in the competition
+      remaining_time_budget = DEFAULT_TIME_BUDGET
+    if remaining_time_budget <= 0:
+      return 0
+    if self.time_budget is None:
+      self.time_budget = remaining_time_budget
+    if self.first_train_time is None:
+      return self.first_steps
+    max_steps = self.get_max_steps(remaining_time_budget)
+    if max_steps < self.min_steps:
+      return 0
+    steps = self.plan(remaining_time_budget)[0]
+    return int(max(min(steps, max_steps), self.min_steps))
+
+  # ======== Estimates ========
+
+  def get_step_time(self, pessimistic=False):
+    """Time of a training step (None before training)."""
+    if self.step_time.mean is None:
+      # Only the first call, which includes one-off costs: pessimistic
+      return self.first_train_time
+    if pessimistic:
+      return self.step_time.get_upper(self.risk)
+    return self.step_time.mean
+
+  def get_test_time(self, pessimistic=False):
+    """Time of the next prediction."""
+    if self.test_time.mean is not None:
+      if pessimistic:
+        return self.test_time.get_upper(self.risk)
+      return self.test_time.mean
+    if self.first_test_time is not None:
+      # Only the first prediction, which includes one-off costs: pessimistic
+      return self.first_test_time
+    return self.default_test_time
+
+  def get_max_steps(self, remaining_time_budget):
+    """Largest number of steps such that training them and predicting fit
+    in the remaining time budget, with pessimistic times."""
+    step_time = self.get_step_time(pessimistic=True)
+    margin = max(self.train_call_error.get_upper(self.risk) or 0, 0)
+    max_steps = (remaining_time_budget - self.get_test_time(pessimistic=True)
+                 - margin) / max(step_time, 1e-9)
+    if self.max_steps is not None:
+      max_steps = min(max_steps, self.max_steps)
+    return int(max(max_steps, 0))
+
+  # ======== Planning ========
+
+  def simulate(self, remaining_time_budget, growth_factor, first_steps=None):
+    """Expected future predictions if the cumulated number of steps grows by
+    growth_factor before each prediction, with the expected times.
+
+    Returns:
+      (steps, points): the numbers of steps trained before each prediction and
+      the (elapsed time, expected score) of the predictions.
+    """
+    step_time = max(self.get_step_time(), 1e-9)
+    test_time = self.get_test_time()
+    elapsed = self.time_budget - remaining_time_budget
+    total_steps = self.cumulated_num_steps
+    steps = []
+    points = []
+    while True:
+      if first_steps is not None and not steps:
+        num_steps = first_steps
+      else:
+        num_steps = max(int(total_steps * (growth_factor - 1)), self.min_steps)
+      # The last prediction uses all the remaining time
+      max_steps = int((self.time_budget - elapsed - test_time) / step_time)
+      if self.max_steps is not None:
+        max_steps = min(max_steps, self.max_steps)
+      if max_steps < self.min_steps:
+        break
+      if num_steps > max_steps or (
+          max_steps - num_steps) * step_time < test_time:
+        num_steps = max_steps
+      elapsed += num_steps * step_time + test_time
+      total_steps += num_steps
+      steps.append(num_steps)
+      points.append((elapsed, self.expected_score(total_steps)))
+    return steps, points
+
+  def get_expected_alc(self, points, remaining_time_budget):
+    """Expected area under the learning curve from the last prediction (or
+    from the beginning), as computed by the scoring program: trapezoids on
+    the log time axis, the last score extended to the end of the budget."""
+    if self.num_tests > 0:
+      last_test_end = self.last_test_end
+      if last_test_end is None:
+        last_test_end = self.time_budget - remaining_time_budget
+      last = (last_test_end, self.expected_score(self.cumulated_num_steps))
+    else:
+      last = (0, 0.) # The curve starts from 0 at the beginning
+    area = 0.
+    for point in points:
+      area += (log_time(point[0], self.time_budget) -
+               log_time(last[0], self.time_budget)) * (point[1] + last[1]) / 2
+      last = point
+    area += (1 - log_time(last[0], self.time_budget)) * last[1]
+    return area
+
+  def plan(self, remaining_time_budget):
+    """Numbers of steps before each of the future predictions maximizing the
+    expected ALC, among the growth factors of the cumulated number of steps.
+    """
+    best_alc, best_steps = None, [self.first_steps]
+    for growth_factor in self.growth_factors:
+      steps, points = self.simulate(remaining_time_budget, growth_factor)
+      if not steps:
+        continue
+      alc = self.get_expected_alc(points, remaining_time_budget)
+      if best_alc is None or alc > best_alc:
+        best_alc, best_steps = alc, steps
+    return best_steps
+
+  def __str__(self):
+    step_time = self.get_step_time()
+    return ("{} steps trained in {} calls, {} predictions. "
+            "Estimated time per step: {}, per prediction: {:.2f} sec."\
+            .format(self.cumulated_num_steps, self.num_train_calls,
+                    self.num_tests,
+                    "unknown" if step_time is None else
+                    "{:.2e} sec".format(step_time),
+                    self.get_test_time()))
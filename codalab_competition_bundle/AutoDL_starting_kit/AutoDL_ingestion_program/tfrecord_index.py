@@ -0,0 +1,143 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offset index of TFRecord files, for random access to their records.
+
+A TFRecord file is a sequence of records, each stored as
+  uint64 length
+  uint32 masked_crc32_of_length
+  byte   data[length]
+  uint32 masked_crc32_of_data
+The index of a shard is built once by reading the record headers only, and is
+saved in a sidecar `.npy` file next to the shard (when the directory is
+writable). Its name starts with `index-` so that it never matches the
+`sample*` pattern of the data files.
+"""
+
+import os
+import struct
+import numpy as np
+
+HEADER_SIZE = 12 # length (8 bytes) + CRC of length (4 bytes)
+FOOTER_SIZE = 4 # CRC of data (4 bytes)
+
+def index_filename(shard_filename):
+  """Returns the path to the sidecar index file of a shard."""
+  dirname, basename = os.path.split(shard_filename)
+  return os.path.join(dirname, "index-" + basename + ".npy")
+
+
+def build_shard_index(shard_filename):
+  """Scan the record headers of a TFRecord file.
+
+  Returns:
+    A numpy array of shape (num_records, 2) whose rows are the (byte offset,
+    length) of the data of each record.
+  """
+  offsets = []
+  lengths = []
+  file_size = os.path.getsize(shard_filename)
+  with open(shard_filename, "rb") as f:
+    position = 0
+    while position < file_size:
+      header = f.read(HEADER_SIZE)
+      if len(header) < HEADER_SIZE:
+        raise IOError("Truncated record header at byte {} of {}."\
+                      .format(position, shard_filename))
+      length = struct.unpack("<Q", header[:8])[0]
+      offsets.append(position + HEADER_SIZE)
+      lengths.append(length)
+      position += HEADER_SIZE + length + FOOTER_SIZE
+      f.seek(position)
+  index = np.zeros((len(offsets), 2), dtype=np.int64)
+  index[:, 0] = offsets
+  index[:, 1] = lengths
+  return index
+
+
+def load_shard_index(shard_filename, use_sidecar=True):
+  """Load the index of a shard from its sidecar, or build (and save) it."""
+  sidecar = index_filename(shard_filename)
+  if use_sidecar and os.path.isfile(sidecar) and\
+      os.path.getmtime(sidecar) >= os.path.getmtime(shard_filename):
+    return np.load(sidecar)
+  index = build_shard_index(shard_filename)
+  if use_sidecar:
+    tmp_path = sidecar + ".tmp.{}.npy".format(os.getpid())
+    try:
+      np.save(tmp_path, index)
+      os.rename(tmp_path, sidecar)
+    except (IOError, OSError):
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+  return index
+
+
+class TFRecordIndex(object):
+  """Random access to the records of a list of TFRecord shards.
+
+  Records are numbered from 0 in the order of the shards, then in the order
+  of the records in each shard (i.e. the order of sequential reading).
+  """
+
+  def __init__(self, shard_filenames, use_sidecar=True):
+    self.shard_filenames_ = list(shard_filenames)
+    self.shard_indexes_ = [load_shard_index(filename, use_sidecar=use_sidecar)
+                           for filename in self.shard_filenames_]
+    # Id of the first record of each shard
+    self.shard_starts_ = np.cumsum(
+        [0] + [len(index) for index in self.shard_indexes_])
+
+  def __len__(self):
+    return int(self.shard_starts_[-1])
+
+  def locate(self, record_id):
+    """Returns (shard filename, byte offset, length) of a record."""
+    if record_id < 0:
+      record_id += len(self)
+    if not 0 <= record_id < len(self):
+      raise IndexError("Record id {} out of range [0, {})."\
+                       .format(record_id, len(self)))
+    shard = np.searchsorted(self.shard_starts_, record_id, side="right") - 1
+    offset, length = self.shard_indexes_[shard][
+        record_id - self.shard_starts_[shard]]
+    return self.shard_filenames_[shard], int(offset), int(length)
+
+  def get_record(self, record_id):
+    """Returns the serialized record `record_id`, reading only its bytes."""
+    filename, offset, length = self.locate(record_id)
+    with open(filename, "rb") as f:
+      f.seek(offset)
+      return f.read(length)
+
+  def get_records(self, record_ids):
+    """Yields the serialized records `record_ids`, in the given order.
+
+    Each shard is opened only once for consecutive ids in the same shard.
+    """
+    current_filename = None
+    f = None
+    try:
+      for record_id in record_ids:
+        filename, offset, length = self.locate(record_id)
+        if filename != current_filename:
+          if f is not None:
+            f.close()
+          f = open(filename, "rb")
+          current_filename = filename
+        f.seek(offset)
+        yield f.read(length)
+    finally:
+      if f is not None:
+        f.close()
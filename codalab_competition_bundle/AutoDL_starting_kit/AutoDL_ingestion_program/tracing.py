@@ -0,0 +1,249 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timing instrumentation of the phases of the ingestion program.
+
+The ingestion program records a span for each phase (construction of the
+datasets and of the model, each `Model.train` and `Model.test` call, the
+writing of each prediction file, ...) with its wall time, the CPU time of the
+process, the resident memory (RSS) at its beginning and end, and attributes
+such as the number of examples. The kernel only keeps the peak RSS over the
+lifetime of the process: a span records it at its end (`process_peak_rss`)
+and how much the span raised it (`process_peak_rss_increase`, 0 if the span
+stayed under the peak of earlier phases).
+
+Spans are written, as they end, to a JSONL file (one JSON object per line),
+and to a trace in the Chrome trace format (to open in chrome://tracing or
+Perfetto) when the tracer is closed.
+
+Models can add attributes to the span of the current `train` or `test` call,
+e.g. the number of examples they trained on:
+
+  try:
+    import tracing
+  except ImportError: # Not run by the ingestion program
+    tracing = None
+  ...
+  if tracing is not None:
+    tracing.annotate(num_steps=steps, num_examples=steps * batch_size)
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+try:
+  import resource
+except ImportError: # Not available on Windows
+  resource = None
+
+# Unit of ru_maxrss, in bytes: kilobytes on Linux, bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_tracer = None # Tracer of `span` and `annotate`
+
+
+def get_rss():
+  """Current resident set size of the process in bytes, or None."""
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (IOError, OSError, ValueError, IndexError):
+    return None
+
+
+def get_peak_rss():
+  """Peak resident set size of the process in bytes, or None."""
+  if resource is None:
+    return None
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+class Span(object):
+  """A phase being recorded."""
+
+  def __init__(self, name, attributes):
+    self.name = name
+    self.attributes = attributes
+    self.thread = threading.current_thread()
+    self.begin = time.time()
+    self.cpu_begin = time.process_time()
+    self.rss_begin = get_rss()
+    self.peak_rss_begin = get_peak_rss()
+
+  def set(self, **attributes):
+    """Add attributes (JSON-serializable values) to the span."""
+    self.attributes.update(attributes)
+
+  def end(self, depth):
+    """Returns the record of the span."""
+    end = time.time()
+    rss_end = get_rss()
+    # The peak maintained by the kernel may lag behind the current RSS
+    peak_rss = max([x for x in (get_peak_rss(), self.rss_begin, rss_end)
+                    if x is not None] or [None])
+    peak_rss_increase = None
+    if peak_rss is not None and self.peak_rss_begin is not None:
+      peak_rss_increase = max(peak_rss - self.peak_rss_begin, 0)
+    record = {'name': self.name,
+              'begin': self.begin,
+              'end': end,
+              'wall_time': end - self.begin,
+              'cpu_time': time.process_time() - self.cpu_begin,
+              'rss_begin': self.rss_begin,
+              'rss_end': rss_end,
+              'process_peak_rss': peak_rss,
+              'process_peak_rss_increase': peak_rss_increase,
+              'thread': self.thread.name,
+              'depth': depth}
+    record.update(self.attributes)
+    return record
+
+
+class Tracer(object):
+  """Record spans, possibly nested, from several threads.
+
+  Usage:
+    tracer = Tracer(jsonl_path, chrome_trace_path)
+    with tracer.span('train', call=0) as s:
+      ...
+      s.set(num_examples=1000)
+    tracer.close()
+  """
+
+  def __init__(self, jsonl_path=None, chrome_trace_path=None):
+    """
+    Args:
+      jsonl_path: file to which the spans are appended as they end, or None.
+      chrome_trace_path: file to which the trace is written by `close`, in
+        the Chrome trace format, or None.
+    """
+    self.jsonl_path = jsonl_path
+    self.chrome_trace_path = chrome_trace_path
+    self.start = time.time()
+    self.records = []
+    self.lock = threading.Lock()
+    self.stacks = {} # Thread ident -> stack of the open spans of the thread
+    self.jsonl_file = open(jsonl_path, 'w') if jsonl_path else None
+
+  def _get_stack(self):
+    # Only modified by its own thread, read by others
+    return self.stacks.setdefault(threading.current_thread().ident, [])
+
+  def current_span(self, thread=None):
+    """The innermost open span of a thread (the current thread by default),
+    or None."""
+    if thread is None:
+      thread = threading.current_thread()
+    stack = self.stacks.get(thread.ident)
+    try:
+      return stack[-1] if stack else None
+    except IndexError: # Popped by its thread in the meantime
+      return None
+
+  @contextlib.contextmanager
+  def span(self, name, **attributes):
+    """Context manager recording a span, which it returns."""
+    stack = self._get_stack()
+    span = Span(name, attributes)
+    stack.append(span)
+    try:
+      yield span
+    finally:
+      stack.pop()
+      self._add_record(span.end(depth=len(stack)))
+
+  def _add_record(self, record):
+    with self.lock:
+      self.records.append(record)
+      if self.jsonl_file is not None:
+        self.jsonl_file.write(json.dumps(record) + '\n')
+        self.jsonl_file.flush()
+
+  def get_chrome_trace(self):
+    """Returns the spans recorded so far in the Chrome trace format."""
+    pid = os.getpid()
+    thread_ids = {}
+    events = []
+    with self.lock:
+      records = list(self.records)
+    for record in sorted(records, key=lambda r: r['begin']):
+      thread = record['thread']
+      if thread not in thread_ids:
+        thread_ids[thread] = len(thread_ids)
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                       'tid': thread_ids[thread], 'args': {'name': thread}})
+      args = {k: v for k, v in record.items()
+              if k not in ('name', 'begin', 'end', 'thread', 'depth')}
+      events.append({'name': record['name'],
+                     'cat': 'ingestion',
+                     'ph': 'X',
+                     'ts': (record['begin'] - self.start) * 1e6,
+                     'dur': record['wall_time'] * 1e6,
+                     'pid': pid,
+                     'tid': thread_ids[thread],
+                     'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'start': self.start}}
+
+  def close(self):
+    """Write the Chrome trace and close the JSONL file."""
+    if self.chrome_trace_path:
+      dirname, filename = os.path.split(self.chrome_trace_path)
+      tmp_path = os.path.join(dirname, '.' + filename + '.tmp')
+      with open(tmp_path, 'w') as f:
+        json.dump(self.get_chrome_trace(), f)
+      os.rename(tmp_path, self.chrome_trace_path)
+    if self.jsonl_file is not None:
+      self.jsonl_file.close()
+      self.jsonl_file = None
+
+
+def set_tracer(tracer):
+  """Set the tracer of `span` and `annotate` (None to disable them)."""
+  global _tracer
+  _tracer = tracer
+
+
+def get_tracer():
+  return _tracer
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+  """`Tracer.span` of the current tracer. Records nothing without tracer."""
+  tracer = _tracer
+  if tracer is None:
+    yield Span(name, attributes)
+  else:
+    with tracer.span(name, **attributes) as s:
+      yield s
+
+
+def get_phase(thread):
+  """Name of the innermost open span of a thread, '' if there is none."""
+  tracer = _tracer
+  current = tracer.current_span(thread) if tracer is not None else None
+  return current.name if current is not None else ''
+
+
+def annotate(**attributes):
+  """Add attributes to the innermost open span of the current thread, e.g.
+  the `train` or `test` call of a model. Does nothing without tracer."""
+  tracer = _tracer
+  current = tracer.current_span() if tracer is not None else None
+  if current is not None:
+    current.set(**attributes)
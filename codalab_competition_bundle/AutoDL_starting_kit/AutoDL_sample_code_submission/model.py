@@ -29,8 +29,20 @@ import os
 
 # Import the challenge algorithm (model) API from algorithm.py
 import algorithm
+# Time budget management shared with the other models, see step_scheduler.py
+import step_scheduler
+# Input pipelines shared with the other models, see input_pipeline.py
+import input_pipeline
+# Choice of the batch size shared with the other models, see batch_size_probe.py
+import batch_size_probe
+# Timing instrumentation of the ingestion program, see tracing.py
+try:
+  import tracing
+except ImportError:
+  tracing = None
 
 # Utility packages
+import threading
 import time
 import datetime
 import numpy as np
@@ -55,8 +67,36 @@ class Model(algorithm.Algorithm):
     sequence_size = self.metadata_.get_sequence_size()
     self.fixed_sequence_size = sequence_size > 0
 
-    # Set batch size (for both training and testing)
-    self.batch_size = 30
+    # Attributes for preprocessing
+    self.default_image_size = (112,112)
+    self.default_num_frames = 10
+    self.default_shuffle_buffer = 100
+
+    # Set batch size (for both training and testing), see batch_size_probe.py
+    self.default_batch_size = 30
+    example_shape = batch_size_probe.get_preprocessed_shape(
+        batch_size_probe.get_example_shape(self.metadata_),
+        self.preprocess_tensor_4d)
+    self.batch_size_probe = batch_size_probe.BatchSizeProbe(
+        self.model_fn, example_shape, self.output_dim,
+        max_batch_size=self.num_examples_train)
+    self.batch_size = self.batch_size_probe.run() or self.default_batch_size
+    print_log("Batch size: {}".format(self.batch_size))
+
+    # Reports whether the training rounds are input-bound or compute-bound
+    self.input_profiler = input_pipeline.InputProfiler()
+
+    # Execution mode. If True, the graph, the iterators and the weights live
+    # in memory across the calls of train and test (see PersistentSession
+    # below), and checkpoints are written in the background. Otherwise, each
+    # call rebuilds them with a tf.estimator.Estimator, restoring the weights
+    # from the last checkpoint.
+    self.use_persistent_session = True
+
+    # Cache of the training examples before shuffling, see input_pipeline.py.
+    # The cache lives in the iterator: only the persistent session keeps it
+    # across calls, an Estimator would fill a new one at each call
+    self.cache_examples = 'auto' if self.use_persistent_session else None
 
     model_fn = self.model_fn
 
@@ -65,25 +105,29 @@ class Model(algorithm.Algorithm):
                              os.pardir,
                              'checkpoints_' + self.dataset_name)
 
-    # Classifier using model_fn (see below)
-    self.classifier = tf.estimator.Estimator(
-      model_fn=model_fn,
-      model_dir=model_dir)
-
-    # Attributes for preprocessing
-    self.default_image_size = (112,112)
-    self.default_num_frames = 10
-    self.default_shuffle_buffer = 100
+    if self.use_persistent_session:
+      # Same network and checkpoints as the Estimator below
+      self.session = PersistentSession(
+          logits_fn=self.cnn_logits,
+          loss_fn=sigmoid_cross_entropy_with_logits,
+          train_op_fn=self.train_op_fn,
+          input_fn=self.input_dataset,
+          model_dir=model_dir,
+          input_profiler=self.input_profiler)
+      self.classifier = None
+    else:
+      # Classifier using model_fn (see below)
+      self.classifier = tf.estimator.Estimator(
+        model_fn=model_fn,
+        model_dir=model_dir)
+      self.session = None
 
     # Attributes for managing time budget
-    # Cumulated number of training steps
+    # The expected score is assumed to reach half its maximum after one epoch
     self.birthday = time.time()
-    self.total_train_time = 0
-    self.cumulated_num_steps = 0
-    self.estimated_time_per_step = None
-    self.total_test_time = 0
-    self.cumulated_num_tests = 0
-    self.estimated_time_test = None
+    steps_per_epoch = max(self.num_examples_train / self.batch_size, 1)
+    self.scheduler = step_scheduler.StepScheduler(
+        expected_score=step_scheduler.saturating_score(steps_per_epoch))
     self.trained = False
     self.done_training = False
     # Critical number for early stopping
@@ -122,42 +166,50 @@ class Model(algorithm.Algorithm):
           should keep track of its execution time to avoid exceeding its time
           budget. If remaining_time_budget is None, no time budget is imposed.
     """
+    # No more training once the model chose to stop (see test)
+    if self.done_training:
+      return
+
     # Get number of steps to train according to some strategy
     steps_to_train = self.get_steps_to_train(remaining_time_budget)
 
     if steps_to_train <= 0:
       print_log("Not enough time remaining for training. " +
-            "Estimated time for training per step: {:.2f}, "\
-            .format(self.estimated_time_per_step) +
-            "and for test: {}, ".format(tentative_estimated_time_test) +
-            "but remaining time budget is: {:.2f}. "\
+            "Remaining time budget: {:.2f} sec. "\
             .format(remaining_time_budget) +
-            "Skipping...")
+            str(self.scheduler) + " Skipping...")
       self.done_training = True
+      self.close_session()
     else:
       msg_est = ""
-      if self.estimated_time_per_step:
+      estimated_time_per_step = self.scheduler.get_step_time()
+      if estimated_time_per_step:
         msg_est = "estimated time for this: " +\
-                  "{:.2f} sec.".format(steps_to_train * self.estimated_time_per_step)
+                  "{:.2f} sec.".format(steps_to_train * estimated_time_per_step)
       print_log("Begin training for another {} steps...{}".format(steps_to_train, msg_est))
 
       # Prepare input function for training
       train_input_fn = lambda: self.input_function(dataset, is_training=True)
 
-      # Start training
+      # Start training, timed for time budget managing
       train_start = time.time()
-      self.classifier.train(input_fn=train_input_fn, steps=steps_to_train)
+      with self.scheduler.time_train(steps_to_train):
+        if self.use_persistent_session:
+          self.session.train(dataset, steps=steps_to_train)
+        else:
+          self.classifier.train(
+              input_fn=train_input_fn, steps=steps_to_train,
+              hooks=[input_pipeline.InputProfilerHook(self.input_profiler)])
       train_end = time.time()
+      if tracing is not None:
+        tracing.annotate(num_steps=steps_to_train,
+                         num_examples=steps_to_train * self.batch_size)
 
-      # Update for time budget managing
       train_duration = train_end - train_start
-      self.total_train_time += train_duration
-      self.cumulated_num_steps += steps_to_train
-      self.estimated_time_per_step = self.total_train_time / self.cumulated_num_steps
       print_log("{} steps trained. {:.2f} sec used. ".format(steps_to_train, train_duration) +\
-            "Now total steps trained: {}. ".format(self.cumulated_num_steps) +\
-            "Total time used for training: {:.2f} sec. ".format(self.total_train_time) +\
-            "Current estimated time per step: {:.2e} sec.".format(self.estimated_time_per_step))
+            "Total time used for training: {:.2f} sec. "\
+            .format(self.scheduler.total_train_time) +\
+            str(self.scheduler))
 
   def test(self, dataset, remaining_time_budget=None):
     """Test this algorithm on the tensorflow |dataset|.
@@ -175,6 +227,7 @@ class Model(algorithm.Algorithm):
           learning curve.
     """
     if self.done_training:
+      self.close_session()
       return None
 
     # The following snippet of code intends to do:
@@ -188,44 +241,55 @@ class Model(algorithm.Algorithm):
       print_log("Oops! Choose to stop early for next call!")
       self.done_training = True
     test_begin = time.time()
-    if remaining_time_budget and self.estimated_time_test and\
-        self.estimated_time_test > remaining_time_budget:
+    estimated_time_test = self.scheduler.get_test_time(pessimistic=True)
+    if not self.scheduler.can_test(remaining_time_budget):
       print_log("Not enough time for test. " +\
-            "Estimated time for test: {:.2e}, ".format(self.estimated_time_test) +\
+            "Estimated time for test: {:.2e}, ".format(estimated_time_test) +\
             "But remaining time budget is: {:.2f}. ".format(remaining_time_budget) +\
             "Stop train/predict process by returning None.")
+      self.done_training = True
+      self.close_session()
       return None
-    msg_est = ""
-    if self.estimated_time_test:
-      msg_est = "estimated time: {:.2e} sec.".format(self.estimated_time_test)
+    msg_est = "estimated time: {:.2e} sec.".format(estimated_time_test)
     print_log("Begin testing...", msg_est)
 
     # Prepare input function for testing
     test_input_fn = lambda: self.input_function(dataset, is_training=False)
 
-    # Start testing (i.e. making prediction on test set)
-    test_results = self.classifier.predict(input_fn=test_input_fn)
+    # Start testing (i.e. making prediction on test set), timed for time
+    # budget managing
+    with self.scheduler.time_test(remaining_time_budget):
+      if self.use_persistent_session:
+        predictions = self.session.predict(dataset)
+      else:
+        test_results = self.classifier.predict(input_fn=test_input_fn)
 
-    predictions = [x['probabilities'] for x in test_results]
-    has_same_length = (len({len(x) for x in predictions}) == 1)
-    print_log("Asserting predictions have the same number of columns...")
-    assert(has_same_length)
-    predictions = np.array(predictions)
+        predictions = [x['probabilities'] for x in test_results]
+        has_same_length = (len({len(x) for x in predictions}) == 1)
+        print_log("Asserting predictions have the same number of columns...")
+        assert(has_same_length)
+        predictions = np.array(predictions)
     test_end = time.time()
-    # Update some variables for time management
     test_duration = test_end - test_begin
-    self.total_test_time += test_duration
-    self.cumulated_num_tests += 1
-    self.estimated_time_test = self.total_test_time / self.cumulated_num_tests
     print_log("[+] Successfully made one prediction. {:.2f} sec used. ".format(test_duration) +\
-          "Total time used for testing: {:.2f} sec. ".format(self.total_test_time) +\
-          "Current estimated time for test: {:.2e} sec.".format(self.estimated_time_test))
+          "Total time used for testing: {:.2f} sec. "\
+          .format(self.scheduler.total_test_time) +\
+          str(self.scheduler))
+    if self.done_training:
+      self.close_session()
     return predictions
 
   ##############################################################################
   #### Above 3 methods (__init__, train, test) should always be implemented ####
   ##############################################################################
 
+  def close_session(self):
+    """Write the last checkpoint and close the persistent session, once the
+    model is done training (no effect if already closed or without persistent
+    session)."""
+    if self.use_persistent_session:
+      self.session.close()
+
   # Model functions that contain info on neural network architectures
   # Several model functions are to be implemented, for different domains
   def model_fn(self, features, labels, mode):
@@ -234,6 +298,46 @@ class Model(algorithm.Algorithm):
     For more information on how to write a model function, see:
       https://www.tensorflow.org/guide/custom_estimators#write_a_model_function
     """
+    logits = self.cnn_logits(features,
+                             training=mode == tf.estimator.ModeKeys.TRAIN)
+    sigmoid_tensor = tf.nn.sigmoid(logits, name="sigmoid_tensor")
+
+    predictions = {
+      # Generate predictions (for PREDICT and EVAL mode)
+      "classes": tf.argmax(input=logits, axis=1),
+      # "classes": binary_predictions,
+      # Add `sigmoid_tensor` to the graph. It is used for PREDICT and by the
+      # `logging_hook`.
+      "probabilities": sigmoid_tensor
+    }
+
+    if mode == tf.estimator.ModeKeys.PREDICT:
+      return tf.estimator.EstimatorSpec(mode=mode, predictions=predictions)
+
+    # Calculate Loss (for both TRAIN and EVAL modes)
+    # For multi-label classification, a correct loss is sigmoid cross entropy
+    loss = sigmoid_cross_entropy_with_logits(labels=labels, logits=logits)
+
+    # Configure the Training Op (for TRAIN mode)
+    if mode == tf.estimator.ModeKeys.TRAIN:
+      train_op = self.train_op_fn(loss)
+      return tf.estimator.EstimatorSpec(mode=mode, loss=loss, train_op=train_op)
+
+    # Add evaluation metrics (for EVAL mode)
+    assert mode == tf.estimator.ModeKeys.EVAL
+    eval_metric_ops = {
+        "accuracy": tf.metrics.accuracy(
+            labels=labels, predictions=predictions["classes"])}
+    return tf.estimator.EstimatorSpec(
+        mode=mode, loss=loss, eval_metric_ops=eval_metric_ops)
+
+  def cnn_logits(self, features, training):
+    """Logits of the Auto-Scaling 3D CNN.
+
+    Args:
+      features: batch of preprocessed examples.
+      training: boolean (or boolean tensor), True when training (dropout).
+    """
     input_layer = features
 
     # Replace missing values by 0
@@ -264,42 +368,18 @@ class Model(algorithm.Algorithm):
                                    units=64, activation=tf.nn.relu)
     hidden_layer = tf.layers.dropout(
         inputs=hidden_layer, rate=0.15,
-        training=mode == tf.estimator.ModeKeys.TRAIN)
+        training=training)
 
     logits = tf.layers.dense(inputs=hidden_layer, units=self.output_dim)
-    sigmoid_tensor = tf.nn.sigmoid(logits, name="sigmoid_tensor")
+    return logits
 
-    predictions = {
-      # Generate predictions (for PREDICT and EVAL mode)
-      "classes": tf.argmax(input=logits, axis=1),
-      # "classes": binary_predictions,
-      # Add `sigmoid_tensor` to the graph. It is used for PREDICT and by the
-      # `logging_hook`.
-      "probabilities": sigmoid_tensor
-    }
-
-    if mode == tf.estimator.ModeKeys.PREDICT:
-      return tf.estimator.EstimatorSpec(mode=mode, predictions=predictions)
-
-    # Calculate Loss (for both TRAIN and EVAL modes)
-    # For multi-label classification, a correct loss is sigmoid cross entropy
-    loss = sigmoid_cross_entropy_with_logits(labels=labels, logits=logits)
-
-    # Configure the Training Op (for TRAIN mode)
-    if mode == tf.estimator.ModeKeys.TRAIN:
-      optimizer = tf.train.AdamOptimizer()
-      train_op = optimizer.minimize(
-          loss=loss,
-          global_step=tf.train.get_global_step())
-      return tf.estimator.EstimatorSpec(mode=mode, loss=loss, train_op=train_op)
-
-    # Add evaluation metrics (for EVAL mode)
-    assert mode == tf.estimator.ModeKeys.EVAL
-    eval_metric_ops = {
-        "accuracy": tf.metrics.accuracy(
-            labels=labels, predictions=predictions["classes"])}
-    return tf.estimator.EstimatorSpec(
-        mode=mode, loss=loss, eval_metric_ops=eval_metric_ops)
+  def train_op_fn(self, loss):
+    """Training op minimizing the loss, incrementing the global step."""
+    optimizer = tf.train.AdamOptimizer()
+    train_op = optimizer.minimize(
+        loss=loss,
+        global_step=tf.train.get_global_step())
+    return train_op
 
   def input_function(self, dataset, is_training):
     """Given `dataset` received by the method `self.train` or `self.test`,
@@ -308,21 +388,23 @@ class Model(algorithm.Algorithm):
     For more information on how to write an input function, see:
       https://www.tensorflow.org/guide/custom_estimators#write_an_input_function
     """
-    dataset = dataset.map(lambda *x: (self.preprocess_tensor_4d(x[0]), x[1]))
-
-    if is_training:
-      # Shuffle input examples
-      dataset = dataset.shuffle(buffer_size=self.default_shuffle_buffer)
-      # Convert to RepeatDataset to train for several epochs
-      dataset = dataset.repeat()
-
-    # Set batch size
-    dataset = dataset.batch(batch_size=self.batch_size)
-
-    iterator = dataset.make_one_shot_iterator()
-    example, labels = iterator.get_next()
+    dataset = self.input_dataset(dataset, is_training)
+    example, labels = input_pipeline.get_next_batch(dataset)
     return example, labels
 
+  def input_dataset(self, dataset, is_training):
+    """Dataset of the batches of preprocessed (example, labels) of `dataset`,
+    shuffled and repeated for training."""
+    # Preprocess the examples only if some of their dimensions are unknown,
+    # preprocess_tensor_4d leaves the others unchanged
+    map_fn = None
+    if not dataset.output_shapes[0].is_fully_defined():
+      map_fn = lambda *x: (self.preprocess_tensor_4d(x[0]), x[1])
+    return input_pipeline.build_input_pipeline(
+        dataset, self.batch_size, is_training, map_fn=map_fn,
+        shuffle_buffer=self.default_shuffle_buffer,
+        cache=self.cache_examples, num_examples=self.num_examples_train)
+
   def preprocess_tensor_4d(self, tensor_4d):
     """Preprocess a 4-D tensor (only when some dimensions are `None`, i.e.
     non-fixed). The output tensor wil have fixed, known shape.
@@ -368,31 +450,16 @@ class Model(algorithm.Algorithm):
   def get_steps_to_train(self, remaining_time_budget):
     """Get number of steps for training according to `remaining_time_budget`.
 
-    The strategy is:
+    The strategy is the one of `step_scheduler.StepScheduler`:
       1. If no training is done before, train for 10 steps (ten batches);
       2. Otherwise, estimate training time per step and time needed for test,
          then compare to remaining time budget to compute a potential maximum
          number of steps (max_steps) that can be trained within time budget;
-      3. Choose a number (steps_to_train) between 0 and max_steps and train for
-         this many steps. Double it each time.
+      3. Choose a number (steps_to_train) between 0 and max_steps maximizing
+         the expected area under the learning curve, and train for this many
+         steps.
     """
-    if not remaining_time_budget: # This is never true in the competition anyway
-      remaining_time_budget = 1200 # if no time limit is given, set to 20min
-
-    if not self.estimated_time_per_step:
-      steps_to_train = 10
-    else:
-      if self.estimated_time_test:
-        tentative_estimated_time_test = self.estimated_time_test
-      else:
-        tentative_estimated_time_test = 50 # conservative estimation for test
-      max_steps = int((remaining_time_budget - tentative_estimated_time_test) / self.estimated_time_per_step)
-      max_steps = max(max_steps, 1)
-      if self.cumulated_num_tests < np.log(max_steps) / np.log(2):
-        steps_to_train = int(2 ** self.cumulated_num_tests) # Double steps_to_train after each test
-      else:
-        steps_to_train = 0
-    return steps_to_train
+    return self.scheduler.get_steps_to_train(remaining_time_budget)
 
   def age(self):
     return time.time() - self.birthday
@@ -401,14 +468,182 @@ class Model(algorithm.Algorithm):
     """The criterion to stop further training (thus finish train/predict
     process).
     """
-    # return self.cumulated_num_tests > 10 # Limit to make 10 predictions
+    # return self.scheduler.num_tests > 10 # Limit to make 10 predictions
     # return np.random.rand() < self.early_stop_proba
     batch_size = self.batch_size
     num_examples = self.metadata_.size()
-    num_epochs = self.cumulated_num_steps * batch_size / num_examples
+    num_epochs = self.scheduler.cumulated_num_steps * batch_size / num_examples
     print_log("Model already trained for {} epochs.".format(num_epochs))
     return num_epochs > self.num_epochs_we_want_to_train # Train for at least certain number of epochs then stop
 
+class PersistentSession(object):
+  """Graph, iterators and weights of a model, kept in memory across the calls
+  of train and test.
+
+  A tf.estimator.Estimator rebuilds its graph, restores the weights from the
+  last checkpoint and creates a new input pipeline at each `train` and
+  `predict` call, which dominates short calls. Here the graph is built once
+  with a session that lives as long as the model: the training iterator keeps
+  its position (and shuffle buffer) from one call to the next, and the test
+  iterator is re-initialized for each prediction. Both feed the same network
+  through a feedable iterator.
+
+  If an input_pipeline.InputProfiler is given, it profiles each `train` call.
+
+  Checkpoints are written in the background: the variables are copied in one
+  session run to shadow variables, which a thread then saves while training
+  goes on. They use the variable names of the Estimator, so that both restore
+  each other's checkpoints.
+  """
+
+  def __init__(self, logits_fn, loss_fn, train_op_fn, input_fn, model_dir,
+               checkpoint_secs=600, input_profiler=None):
+    """
+    Args:
+      logits_fn: function of (features, training) returning the logits, where
+        training is a boolean tensor.
+      loss_fn: function of (labels, logits) returning the loss.
+      train_op_fn: function of the loss returning the training op, which
+        increments the global step.
+      input_fn: function of (dataset, is_training) returning the dataset of
+        the batches of (features, labels).
+      model_dir: directory of the checkpoints. The last one is restored.
+      checkpoint_secs: minimum time between two checkpoints written during
+        training, or None to only write one at `close`.
+      input_profiler: an input_pipeline.InputProfiler, or None.
+    """
+    self.logits_fn = logits_fn
+    self.loss_fn = loss_fn
+    self.train_op_fn = train_op_fn
+    self.input_fn = input_fn
+    self.model_dir = model_dir
+    self.checkpoint_secs = checkpoint_secs
+    self.input_profiler = input_profiler
+    self.graph = None
+    self.session = None
+    self.train_iterator = None
+    self.test_iterator = None
+    self.save_thread = None
+    self.last_save = time.time()
+
+  def _build(self, dataset):
+    """Build the graph and the session, with the structure of the batches of
+    `dataset`."""
+    self.graph = tf.Graph()
+    with self.graph.as_default():
+      batches = self.input_fn(dataset, is_training=False)
+      # The labels of the test set may have another shape
+      output_shapes = (batches.output_shapes[0], tf.TensorShape(None))
+      self.handle = tf.placeholder(tf.string, shape=[])
+      iterator = tf.data.Iterator.from_string_handle(
+          self.handle, batches.output_types, output_shapes)
+      (features, labels), self.wait_time = input_pipeline.get_timed_next(
+          iterator)
+      self.training = tf.placeholder_with_default(False, shape=[])
+      self.global_step = tf.train.get_or_create_global_step()
+      logits = self.logits_fn(features, training=self.training)
+      self.probabilities = tf.nn.sigmoid(logits, name="sigmoid_tensor")
+      loss = self.loss_fn(labels=labels, logits=logits)
+      self.train_op = self.train_op_fn(loss)
+
+      # Shadow variables of the checkpoints written in the background
+      variables = tf.global_variables()
+      shadows = [tf.Variable(tf.zeros(v.shape, dtype=v.dtype.base_dtype),
+                             trainable=False, collections=[])
+                 for v in variables]
+      self.snapshot_op = tf.group(*[shadow.assign(v)
+                                    for shadow, v in zip(shadows, variables)])
+      self.saver = tf.train.Saver({v.op.name: shadow
+                                   for shadow, v in zip(shadows, variables)})
+
+      self.session = tf.Session()
+      self.session.run([tf.global_variables_initializer(),
+                        tf.variables_initializer(shadows)])
+      checkpoint = tf.train.latest_checkpoint(self.model_dir)
+      if checkpoint:
+        print_log("Restoring weights from {}".format(checkpoint))
+        tf.train.Saver(variables).restore(self.session, checkpoint)
+      tf.gfile.MakeDirs(self.model_dir)
+
+  def train(self, dataset, steps):
+    """Train `steps` steps on the batches of `dataset` (the same dataset at
+    each call, the training iterator is created at the first one)."""
+    if self.graph is None:
+      self._build(dataset)
+    if self.train_iterator is None:
+      with self.graph.as_default():
+        self.train_iterator = self.input_fn(dataset, is_training=True)\
+                                  .make_one_shot_iterator()
+        self.train_handle = self.session.run(
+            self.train_iterator.string_handle())
+    feed_dict = {self.handle: self.train_handle, self.training: True}
+    begin = time.time()
+    wait_time = 0.
+    for _ in range(steps):
+      _, step_wait_time = self.session.run([self.train_op, self.wait_time],
+                                           feed_dict=feed_dict)
+      wait_time += step_wait_time
+    if self.input_profiler is not None:
+      self.input_profiler.record_round(steps, time.time() - begin, wait_time)
+    if self.checkpoint_secs is not None and\
+        time.time() - self.last_save >= self.checkpoint_secs:
+      self.save()
+
+  def predict(self, dataset):
+    """Returns the predicted probabilities on all the examples of `dataset`
+    (the same dataset at each call, the test iterator is created at the first
+    one)."""
+    if self.graph is None:
+      self._build(dataset)
+    if self.test_iterator is None:
+      with self.graph.as_default():
+        self.test_iterator = self.input_fn(dataset, is_training=False)\
+                                 .make_initializable_iterator()
+        self.test_handle = self.session.run(self.test_iterator.string_handle())
+    self.session.run(self.test_iterator.initializer)
+    feed_dict = {self.handle: self.test_handle}
+    predictions = []
+    while True:
+      try:
+        predictions.append(self.session.run(self.probabilities,
+                                            feed_dict=feed_dict))
+      except tf.errors.OutOfRangeError:
+        break
+    return np.concatenate(predictions)
+
+  def save(self, block=False):
+    """Write a checkpoint of the current weights in the background, unless the
+    previous one is still being written, or before returning if block.
+
+    Returns:
+      True if a checkpoint is written.
+    """
+    if self.session is None:
+      return False
+    if self.save_thread is not None:
+      if self.save_thread.is_alive() and not block:
+        return False
+      self.save_thread.join()
+    _, global_step = self.session.run([self.snapshot_op, self.global_step])
+    # Without meta graph, which would be exported while the graph may change
+    self.save_thread = threading.Thread(
+        target=self.saver.save,
+        args=(self.session, os.path.join(self.model_dir, 'model.ckpt')),
+        kwargs={'global_step': global_step, 'write_meta_graph': False})
+    self.save_thread.start()
+    self.last_save = time.time()
+    if block:
+      self.save_thread.join()
+    return True
+
+  def close(self):
+    """Write the last checkpoint and close the session."""
+    if self.session is None:
+      return
+    self.save(block=True)
+    self.session.close()
+    self.session = None
+
 def print_log(*content):
   """Logging function. (could've also used `import logging`.)"""
   now = datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
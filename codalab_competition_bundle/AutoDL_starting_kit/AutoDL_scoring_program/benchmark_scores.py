@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+# Benchmark of the metrics of libscores.py and score.py against their previous
+# (loop-based) implementations, which are kept here as reference.
+#
+# For each metric, checks that both implementations give the same score, then
+# prints the time taken by each of them, on float64 and float32 predictions.
+# The AUC of each column computed with the vectorized tied ranks is checked to
+# be bit-for-bit equal to the AUC computed with tiedrank, on highly tied
+# (quantized) predictions.
+# The scores of prediction files read by blocks of rows are checked to be
+# bit-for-bit equal to the scores of the full arrays, and the peak memory
+# allocated by both is printed.
+# Usage:
+#   python benchmark_scores.py --num_examples 100000 --num_classes 1000 \
+#     --auc_num_examples 1000000 --auc_num_classes 100
+
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from functools import reduce
+
+import numpy as np
+
+import libscores
+import score
+
+# ======= Reference implementations ========
+
+def legacy_acc_stat(solution, prediction):
+    TN = sum(np.multiply((1 - solution), (1 - prediction)))
+    FN = sum(np.multiply(solution, (1 - prediction)))
+    TP = sum(np.multiply(solution, prediction))
+    FP = sum(np.multiply((1 - solution), prediction))
+    return (TN, FP, TP, FN)
+
+def legacy_mvmean(R, axis=0):
+    # With list(map(...)) instead of map(...), which is broken on Python 3
+    if len(R.shape) == 0: return R
+    average = lambda x: reduce(lambda i, j: (0, (j[0] / (j[0] + 1.)) * i[1] + (1. / (j[0] + 1)) * j[1]), enumerate(x))[
+        1]
+    R = np.array(R)
+    if len(R.shape) == 1: return average(R)
+    if axis == 1:
+        return np.array(list(map(average, R)))
+    else:
+        return np.array(list(map(average, R.transpose())))
+
+def legacy_binarize_predictions(array, task='binary.classification'):
+    bin_array = np.zeros(array.shape)
+    if (task != 'multiclass.classification') or (array.shape[1] == 1):
+        bin_array[array >= 0.5] = 1
+    else:
+        sample_num = array.shape[0]
+        for i in range(sample_num):
+            j = np.argmax(array[i, :])
+            bin_array[i, j] = 1
+    return bin_array
+
+def legacy_auc_columns(solution, prediction):
+    '''AUC of each column, with one call to tiedrank per column.'''
+    label_num = solution.shape[1]
+    auc = np.empty(label_num)
+    for k in range(label_num):
+        r_ = libscores.tiedrank(prediction[:, k])
+        s_ = solution[:, k]
+        npos = np.sum(s_ == 1)
+        nneg = np.sum(s_ < 1)
+        auc[k] = (np.sum(r_[s_ == 1]) - npos * (npos + 1) / 2) / (nneg * npos)
+    return auc
+
+@contextlib.contextmanager
+def legacy_kernels():
+    '''Run the metrics of libscores and score with the reference kernels.'''
+    patched = [(libscores, 'acc_stat', legacy_acc_stat),
+               (libscores, 'mvmean', legacy_mvmean),
+               (libscores, 'binarize_predictions', legacy_binarize_predictions),
+               (score, 'acc_stat', legacy_acc_stat),
+               (score, 'mvmean', legacy_mvmean)]
+    originals = [(module, name, getattr(module, name))
+                 for module, name, _ in patched]
+    for module, name, function in patched:
+        setattr(module, name, function)
+    try:
+        yield
+    finally:
+        for module, name, function in originals:
+            setattr(module, name, function)
+
+# ======= Benchmark ========
+
+METRICS = [
+    ('autodl_bac', score.autodl_bac),
+    ('bac (multilabel)', libscores.nbac_binary_score),
+    ('bac (multiclass)', libscores.nbac_multiclass_score),
+    ('f1 (multilabel)', libscores.f1_binary_score),
+    ('pac (multilabel)', libscores.npac_binary_score),
+    ('pac (multiclass)', libscores.npac_multiclass_score),
+]
+
+def make_data(num_examples, num_classes, seed=42):
+    '''One-hot solution and noisy probability-like predictions.'''
+    random_state = np.random.RandomState(seed)
+    labels = random_state.randint(num_classes, size=num_examples)
+    solution = np.zeros((num_examples, num_classes))
+    solution[np.arange(num_examples), labels] = 1
+    prediction = 0.6 * solution + 0.4 * random_state.rand(num_examples,
+                                                           num_classes)
+    return solution, prediction
+
+def timed(function, *args):
+    begin = time.time()
+    result = function(*args)
+    return result, time.time() - begin
+
+def benchmark(num_examples, num_classes, skip_legacy=False):
+    solution, prediction = make_data(num_examples, num_classes)
+    prediction32 = prediction.astype(np.float32)
+    solution32 = solution.astype(np.float32)
+    print('{} examples x {} classes'.format(num_examples, num_classes))
+    print('{:<18} {:>12} {:>12} {:>12} {:>10}'.format(
+        'metric', 'legacy (s)', 'f64 (s)', 'f32 (s)', 'max diff'))
+    for name, metric in METRICS:
+        new_score, new_time = timed(metric, solution, prediction)
+        new32_score, new32_time = timed(metric, solution32, prediction32)
+        if skip_legacy:
+            legacy_time, diff = float('nan'), float('nan')
+        else:
+            with legacy_kernels():
+                legacy_score, legacy_time = timed(metric, solution, prediction)
+            diff = np.max(np.abs(np.asarray(new_score) - legacy_score))
+            assert diff < 1e-6, '{}: {} != {}'.format(name, new_score,
+                                                      legacy_score)
+        assert abs(new32_score - new_score) < 1e-4,\
+            '{} (float32): {} != {}'.format(name, new32_score, new_score)
+        print('{:<18} {:>12.4f} {:>12.4f} {:>12.4f} {:>10.2e}'.format(
+            name, legacy_time, new_time, new32_time, diff))
+
+def benchmark_auc(num_examples, num_classes, num_levels=10,
+                  legacy_num_classes=1):
+    '''Time the AUC of all columns, on predictions quantized to num_levels
+    values. The reference implementation only runs on the first
+    legacy_num_classes columns, since it is quadratic in the number of ties.'''
+    solution, prediction = make_data(num_examples, num_classes)
+    prediction = np.floor(prediction * num_levels) / num_levels
+    print('AUC: {} examples x {} classes, {} distinct prediction values'\
+          .format(num_examples, num_classes, num_levels))
+    auc, new_time = timed(libscores.auc_columns, solution, prediction)
+    print('  tied ranks of all columns: {:.4f} s ({:.4f} s per column)'\
+          .format(new_time, new_time / num_classes))
+    if legacy_num_classes > 0:
+        legacy_auc, legacy_time = timed(legacy_auc_columns,
+                                        solution[:, :legacy_num_classes],
+                                        prediction[:, :legacy_num_classes])
+        assert np.array_equal(auc[:legacy_num_classes], legacy_auc),\
+            'AUC differ: {} != {}'.format(auc[:legacy_num_classes], legacy_auc)
+        print('  tiedrank on {} column(s): {:.4f} s ({:.4f} s per column), '
+              'bit-for-bit equal'.format(legacy_num_classes, legacy_time,
+                                         legacy_time / legacy_num_classes))
+
+def peak_memory(function, *args):
+    '''Returns the result of the function and the peak memory it allocated.'''
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_streaming(num_examples, num_classes, block_size):
+    '''Score text and binary prediction files, loaded at once or streamed.'''
+    solution, prediction = make_data(num_examples, num_classes)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        solution_file = os.path.join(tmp_dir, 'data.solution')
+        np.savetxt(solution_file, solution, fmt='%d')
+        prediction_files = [os.path.join(tmp_dir, 'data.predict_0'),
+                            os.path.join(tmp_dir, 'data.predict_1')]
+        np.savetxt(prediction_files[0], prediction)
+        np.save(prediction_files[1], prediction.astype(np.float32))
+        os.rename(prediction_files[1] + '.npy', prediction_files[1])
+
+        def score_dense(prediction_file):
+            solution = libscores.read_array(solution_file)
+            prediction = libscores.read_array(prediction_file)
+            return (score.autodl_bac(solution, prediction),
+                    score.accuracy(solution, prediction))
+
+        def score_streaming(prediction_file):
+            solution = score.read_solution(solution_file, block_size)
+            return score.score_prediction_file(solution, prediction_file,
+                                               score.autodl_bac_from_stat,
+                                               True, block_size)
+
+        print('Streaming: {} examples x {} classes, blocks of {} bytes'\
+              .format(num_examples, num_classes, block_size))
+        for prediction_file, file_format in zip(prediction_files,
+                                                ['text', 'npy']):
+            (dense, dense_memory), dense_time = timed(peak_memory, score_dense,
+                                                      prediction_file)
+            (streaming, streaming_memory), streaming_time = timed(
+                peak_memory, score_streaming, prediction_file)
+            assert dense == streaming, 'Scores differ: {} != {}'.format(
+                dense, streaming)
+            print('  {:<5} full arrays: {:.2f} s, {:.1f} MB; by blocks: '
+                  '{:.2f} s, {:.1f} MB; bit-for-bit equal'.format(
+                      file_format, dense_time, dense_memory / 2 ** 20,
+                      streaming_time, streaming_memory / 2 ** 20))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the metrics of libscores.py and score.py.')
+    parser.add_argument('--num_examples', type=int, default=20000)
+    parser.add_argument('--num_classes', type=int, default=1000)
+    parser.add_argument('--skip_legacy', action='store_true',
+                        help='Only time the current implementations.')
+    parser.add_argument('--auc_num_examples', type=int, default=1000000)
+    parser.add_argument('--auc_num_classes', type=int, default=100)
+    parser.add_argument('--auc_num_levels', type=int, default=10,
+                        help='Number of distinct values of the predictions.')
+    parser.add_argument('--auc_legacy_num_classes', type=int, default=1,
+                        help='Number of columns scored with tiedrank.')
+    parser.add_argument('--stream_num_examples', type=int, default=200000)
+    parser.add_argument('--stream_num_classes', type=int, default=100)
+    parser.add_argument('--stream_block_size', type=int, default=2 ** 22,
+                        help='Size in bytes of the blocks of rows read.')
+    args = parser.parse_args()
+    benchmark(args.num_examples, args.num_classes, args.skip_legacy)
+    benchmark_auc(args.auc_num_examples, args.auc_num_classes,
+                  args.auc_num_levels,
+                  0 if args.skip_legacy else args.auc_legacy_num_classes)
+    benchmark_streaming(args.stream_num_examples, args.stream_num_classes,
+                        args.stream_block_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,12 +20,12 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF SOFTWARE, DOCUMENTS, MATERIALS,
 # PUBLICATIONS, OR INFORMATION MADE AVAILABLE FOR THE CHALLENGE.
 
+import itertools
 import os
 from sys import stderr
 from sys import version
 
 import numpy as np
-import scipy as sp
 from sklearn import metrics
 from sklearn.preprocessing import *
 
@@ -41,7 +41,6 @@ except ImportError:  # pip < 10
 from glob import glob
 import platform
 import psutil
-from functools import reduce
 
 if (os.name == "nt"):
     filesep = '\\'
@@ -51,13 +50,53 @@ else:
 
 # ========= Useful functions ==============
 
-def read_array(filename):
-    ''' Read array and convert to 2d np arrays '''
-    array = np.loadtxt(filename)
+NPY_MAGIC = b'\x93NUMPY'
+
+def is_npy_file(filename):
+    ''' True if the file is in the binary NumPy .npy format (whatever its
+    extension), recognized by its magic string. '''
+    with open(filename, 'rb') as f:
+        return f.read(len(NPY_MAGIC)) == NPY_MAGIC
+
+def read_array(filename, mmap_mode=None):
+    ''' Read array and convert to 2d np arrays.
+    Files in the binary NumPy .npy format (whatever their extension) are
+    recognized by their magic string, other files are read as text.
+    .npy files are mapped from disk instead of read if mmap_mode is given
+    (e.g. 'r', see np.load). '''
+    if is_npy_file(filename):
+        array = np.load(filename, mmap_mode=mmap_mode)
+    else:
+        array = np.loadtxt(filename)
     if len(array.shape) == 1:
         array = array.reshape(-1, 1)
     return array
 
+def iter_row_blocks(filename, block_size=2 ** 26):
+    ''' Read an array file like read_array, by blocks of rows of about
+    block_size bytes (at least one row), to process arrays that do not fit in
+    memory. Yields 2d np arrays. '''
+    if is_npy_file(filename):
+        array = read_array(filename, mmap_mode='r')
+        row_size = max(array.shape[1] * array.dtype.itemsize, 1)
+        block_rows = max(block_size // row_size, 1)
+        for i in range(0, array.shape[0], block_rows):
+            yield np.array(array[i:i + block_rows])
+        return
+    with open(filename) as f:
+        lines = []
+        num_bytes = 0
+        for line in itertools.chain(f, [None]):
+            if line is not None:
+                lines.append(line)
+                num_bytes += len(line)
+                if num_bytes < block_size:
+                    continue
+            if any(l.strip() for l in lines):
+                yield np.loadtxt(lines, ndmin=2)
+            lines = []
+            num_bytes = 0
+
 
 def sanitize_array(array):
     ''' Replace NaN and Inf (there should not be any!)'''
@@ -106,30 +145,118 @@ def binarize_predictions(array, task='binary.classification'):
     # eps = 1e-15
     # np.random.seed(sum(array.shape))
     # array = array + eps*np.random.rand(array.shape[0],array.shape[1])
-    bin_array = np.zeros(array.shape)
+    bin_array = np.zeros(array.shape, dtype=array.dtype)
     if (task != 'multiclass.classification') or (array.shape[1] == 1):
         bin_array[array >= 0.5] = 1
     else:
         sample_num = array.shape[0]
-        for i in range(sample_num):
-            j = np.argmax(array[i, :])
-            bin_array[i, j] = 1
+        bin_array[np.arange(sample_num), np.argmax(array, axis=1)] = 1
     return bin_array
 
 
+# Number of rows of the blocks in which RowBlockStatistics sum the rows
+STAT_BLOCK_ROWS = 4096
+
+class RowBlockStatistics(object):
+    ''' Statistics of a (solution, prediction) pair, accumulated over the rows
+    so that they can be computed on arrays read piece by piece (see
+    iter_row_blocks), in bounded memory.
+    The rows are summed by blocks of block_rows rows counted from the first
+    row, whatever the pieces given to update (the last rows of a piece are
+    kept until their block is complete), then the blocks are summed in order.
+    So the result does not depend on how the rows are split: it is the same,
+    bit for bit, as for the full arrays given at once.
+    Subclasses implement _add_block. '''
+
+    def __init__(self, block_rows=STAT_BLOCK_ROWS):
+        self.block_rows = block_rows
+        self.sample_num = 0
+        self.pending = None # (solution, prediction) of an incomplete block
+        self.finished = False
+
+    def _add_block(self, solution, prediction):
+        raise NotImplementedError
+
+    def _add_contiguous_block(self, solution, prediction):
+        # The order of the sums of NumPy depends on the memory layout
+        self._add_block(np.ascontiguousarray(solution),
+                        np.ascontiguousarray(prediction))
+
+    def update(self, solution, prediction):
+        ''' Add the next rows of the solution and prediction. Returns self. '''
+        if self.finished:
+            raise ValueError('Cannot update finished statistics')
+        if solution.shape != prediction.shape:
+            raise ValueError('Different shapes of solution and prediction: '
+                             '{} != {}'.format(solution.shape, prediction.shape))
+        num_rows = solution.shape[0]
+        self.sample_num += num_rows
+        i = 0
+        if self.pending is not None:
+            pending_solution, pending_prediction = self.pending
+            i = min(self.block_rows - pending_solution.shape[0], num_rows)
+            self.pending = (np.concatenate((pending_solution, solution[:i])),
+                            np.concatenate((pending_prediction, prediction[:i])))
+            if self.pending[0].shape[0] < self.block_rows:
+                return self
+            self._add_contiguous_block(*self.pending)
+            self.pending = None
+        while num_rows - i >= self.block_rows:
+            self._add_contiguous_block(solution[i:i + self.block_rows],
+                                       prediction[i:i + self.block_rows])
+            i += self.block_rows
+        if i < num_rows:
+            self.pending = (np.array(solution[i:]), np.array(prediction[i:]))
+        return self
+
+    def finish(self):
+        ''' Add the last incomplete block. No rows can be added after. '''
+        if not self.finished:
+            if self.pending is not None:
+                self._add_contiguous_block(*self.pending)
+                self.pending = None
+            self.finished = True
+        return self
+
+
+class ConfusionStatistics(RowBlockStatistics):
+    ''' Column-wise sufficient statistics of acc_stat: TP, the number of
+    positives and the number of predicted positives, summed in float64. '''
+
+    def __init__(self, block_rows=STAT_BLOCK_ROWS):
+        RowBlockStatistics.__init__(self, block_rows)
+        self.TP = 0.
+        self.pos_num = 0.
+        self.pred_pos_num = 0.
+
+    def _add_block(self, solution, prediction):
+        self.TP = self.TP + np.sum(np.multiply(solution, prediction), axis=0,
+                                   dtype=np.float64)
+        self.pos_num = self.pos_num + np.sum(solution, axis=0, dtype=np.float64)
+        self.pred_pos_num = self.pred_pos_num + np.sum(prediction, axis=0,
+                                                       dtype=np.float64)
+
+    def get_acc_stat(self):
+        ''' Return accuracy statistics TN, FP, TP, FN of all the rows. '''
+        self.finish()
+        TP = self.TP
+        FN = self.pos_num - TP
+        FP = self.pred_pos_num - TP
+        TN = self.sample_num - self.pos_num - self.pred_pos_num + TP
+        return (TN, FP, TP, FN)
+
+
 def acc_stat(solution, prediction):
     ''' Return accuracy statistics TN, FP, TP, FN
-     Assumes that solution and prediction are binary 0/1 vectors.'''
+     Assumes that solution and prediction are binary 0/1 vectors.
+     (Predictions in [0, 1] give the "soft" statistics.) The statistics of
+     the columns are computed with column-wise reductions accumulated in
+     float64, also for float32 inputs: only TP needs a product, since
+     FN = POS - TP, FP = PRED_POS - TP and TN = N - POS - PRED_POS + TP.
+     The rows are summed by blocks, see ConfusionStatistics to compute the
+     statistics of arrays read piece by piece.'''
     # This uses floats so the results are floats
-    TN = sum(np.multiply((1 - solution), (1 - prediction)))
-    FN = sum(np.multiply(solution, (1 - prediction)))
-    TP = sum(np.multiply(solution, prediction))
-    FP = sum(np.multiply((1 - solution), prediction))
-    # print "TN =",TN
-    # print "FP =",FP
-    # print "TP =",TP
-    # print "FN =",FN
-    return (TN, FP, TP, FN)
+    return ConfusionStatistics().update(solution, prediction).get_acc_stat()
 
 
 def tiedrank(a):
@@ -162,19 +289,70 @@ def tiedrank(a):
     return S
 
 
+def sorted_tiedrank(sorted_array):
+    ''' Return the ranks (with base 1) of the elements of each row of an array
+    sorted along axis 1, resolving ties by averaging.
+    The runs of equal values are found at once for all rows: the average rank
+    of a run is (first + last) / 2 + 1, which is exactly what tiedrank computes
+    (these are half-integers).'''
+    sorted_array = np.asarray(sorted_array)
+    m = sorted_array.shape[1]
+    idx = np.arange(m)
+    # Starts and ends of the runs of equal values
+    is_first = np.ones(sorted_array.shape, dtype=bool)
+    is_first[:, 1:] = sorted_array[:, 1:] != sorted_array[:, :-1]
+    is_last = np.ones(sorted_array.shape, dtype=bool)
+    is_last[:, :-1] = is_first[:, 1:]
+    first = np.maximum.accumulate(np.where(is_first, idx, 0), axis=1)
+    last = np.minimum.accumulate(np.where(is_last, idx, m - 1)[:, ::-1],
+                                 axis=1)[:, ::-1]
+    return (first + last) / 2. + 1
+
+
+def auc_columns(solution, prediction, max_chunk_elements=2 ** 22):
+    ''' Return the AUC of each column of prediction, computed from the tied
+    ranks of its values like in auc_metric (Mann-Whitney statistic), in
+    O(n log n) per column.
+    Columns are processed by chunks of about max_chunk_elements values to bound
+    the memory used. Instead of scattering the ranks back, the solution is
+    gathered in the sorted order.'''
+    sample_num, label_num = solution.shape
+    chunk_size = max(1, max_chunk_elements // max(sample_num, 1))
+    sum_pos_ranks = np.empty(label_num)
+    for j0 in range(0, label_num, chunk_size):
+        j1 = min(j0 + chunk_size, label_num)
+        pred_chunk = np.ascontiguousarray(prediction[:, j0:j1].T)
+        sol_chunk = np.ascontiguousarray(solution[:, j0:j1].T)
+        order = np.argsort(pred_chunk, axis=1, kind='mergesort')
+        sorted_pred = np.take_along_axis(pred_chunk, order, axis=1)
+        sorted_sol = np.take_along_axis(sol_chunk, order, axis=1)
+        ranks = sorted_tiedrank(sorted_pred)
+        # Exact: sums of half-integers below 2**52
+        sum_pos_ranks[j0:j1] = np.sum(np.where(sorted_sol == 1, ranks, 0),
+                                      axis=1)
+    npos = np.sum(solution == 1, axis=0)
+    nneg = np.sum(solution < 1, axis=0)
+    for k in np.flatnonzero(np.sum(solution, axis=0) == 0):
+        print('WARNING: no positive class example in class {}'.format(k + 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (sum_pos_ranks - npos * (npos + 1) / 2) / (nneg * npos)
+
+
 def mvmean(R, axis=0):
-    ''' Moving average to avoid rounding errors. A bit slow, but...
+    ''' Mean without rounding errors piling up: the sum is accumulated in
+    float64 (also for float32 inputs) with NumPy's pairwise summation, whose
+    error grows as O(log n) instead of O(n) for a naive running sum.
     Computes the mean along the given axis, except if this is a vector, in which case the mean is returned.
     Does NOT flatten.'''
+    R = np.asarray(R)
     if len(R.shape) == 0: return R
-    average = lambda x: reduce(lambda i, j: (0, (j[0] / (j[0] + 1.)) * i[1] + (1. / (j[0] + 1)) * j[1]), enumerate(x))[
-        1]
-    R = np.array(R)
-    if len(R.shape) == 1: return average(R)
+    if len(R.shape) == 1: return np.mean(R, dtype=np.float64)
+    # Pairwise summation is used along the contiguous axis only
     if axis == 1:
-        return np.array(map(average, R))
+        return np.mean(np.ascontiguousarray(R), axis=1, dtype=np.float64)
     else:
-        return np.array(map(average, R.transpose()))
+        return np.mean(np.ascontiguousarray(R.transpose()), axis=1,
+                       dtype=np.float64)
 
 
 # ======= Default metrics ========
@@ -251,12 +429,12 @@ def bac_metric(solution, prediction, task='binary.classification'):
     [tn, fp, tp, fn] = acc_stat(solution, bin_prediction)
     # Bounding to avoid division by 0
     eps = 1e-15
-    tp = sp.maximum(eps, tp)
-    pos_num = sp.maximum(eps, tp + fn)
+    tp = np.maximum(eps, tp)
+    pos_num = np.maximum(eps, tp + fn)
     tpr = tp / pos_num  # true positive rate (sensitivity)
     if (task != 'multiclass.classification') or (label_num == 1):
-        tn = sp.maximum(eps, tn)
-        neg_num = sp.maximum(eps, tn + fp)
+        tn = np.maximum(eps, tn)
+        neg_num = np.maximum(eps, tn + fp)
         tnr = tn / neg_num  # true negative rate (specificity)
         bac = 0.5 * (tpr + tnr)
         base_bac = 0.5  # random predictions for binary case
@@ -265,7 +443,7 @@ def bac_metric(solution, prediction, task='binary.classification'):
         base_bac = 1. / label_num  # random predictions for multiclass case
     bac = mvmean(bac)  # average over all classes
     # Normalize: 0 for random, 1 for perfect
-    score = (bac - base_bac) / sp.maximum(eps, (1 - base_bac))
+    score = (bac - base_bac) / np.maximum(eps, (1 - base_bac))
     return score
 
 
@@ -279,7 +457,7 @@ def pac_metric(solution, prediction, task='binary.classification'):
     eps = 1e-15
     the_log_loss = log_loss(solution, prediction, task)
     # Compute the base log loss (using the prior probabilities)
-    pos_num = 1. * sum(solution)  # float conversion!
+    pos_num = np.sum(solution, axis=0, dtype=np.float64)  # float conversion!
     frac_pos = pos_num / sample_num  # prior proba of positive class
     the_base_log_loss = prior_log_loss(frac_pos, task)
     # Alternative computation of the same thing (slower)
@@ -299,7 +477,7 @@ def pac_metric(solution, prediction, task='binary.classification'):
     pac = mvmean(np.exp(-the_log_loss))
     base_pac = mvmean(np.exp(-the_base_log_loss))
     # Normalize: 0 for random, 1 for perfect
-    score = (pac - base_pac) / sp.maximum(eps, (1 - base_pac))
+    score = (pac - base_pac) / np.maximum(eps, (1 - base_pac))
     return score
 
 
@@ -314,12 +492,12 @@ def f1_metric(solution, prediction, task='binary.classification'):
     [tn, fp, tp, fn] = acc_stat(solution, bin_prediction)
     # Bounding to avoid division by 0
     eps = 1e-15
-    true_pos_num = sp.maximum(eps, tp + fn)
-    found_pos_num = sp.maximum(eps, tp + fp)
-    tp = sp.maximum(eps, tp)
+    true_pos_num = np.maximum(eps, tp + fn)
+    found_pos_num = np.maximum(eps, tp + fp)
+    tp = np.maximum(eps, tp)
     tpr = tp / true_pos_num  # true positive rate (recall)
     ppv = tp / found_pos_num  # positive predictive value (precision)
-    arithmetic_mean = 0.5 * sp.maximum(eps, tpr + ppv)
+    arithmetic_mean = 0.5 * np.maximum(eps, tpr + ppv)
     # Harmonic mean:
     f1 = tpr * ppv / arithmetic_mean
     # Average over all classes
@@ -344,7 +522,7 @@ def f1_metric(solution, prediction, task='binary.classification'):
     # tpr=ppv=frac_pos, where frac_pos=1/label_num
     else:
         base_f1 = 1. / label_num
-    score = (f1 - base_f1) / sp.maximum(eps, (1 - base_f1))
+    score = (f1 - base_f1) / np.maximum(eps, (1 - base_f1))
     return score
 
 
@@ -358,16 +536,9 @@ def auc_metric(solution, prediction, task='binary.classification'):
     binary and multilabel classification problems).'''
     # auc = metrics.roc_auc_score(solution, prediction, average=None)
     # There is a bug in metrics.roc_auc_score: auc([1,0,0],[1e-10,0,0]) incorrect
-    label_num = solution.shape[1]
-    auc = np.empty(label_num)
-    for k in range(label_num):
-        r_ = tiedrank(prediction[:, k])
-        s_ = solution[:, k]
-        if sum(s_) == 0: print('WARNING: no positive class example in class {}'.format(k + 1))
-        npos = sum(s_ == 1)
-        nneg = sum(s_ < 1)
-        auc[k] = (sum(r_[s_ == 1]) - npos * (npos + 1) / 2) / (nneg * npos)
-        # print('AUC[%d]=' % k + '%5.2f' % auc[k])
+    # The ranks of all the columns are computed at once (see auc_columns),
+    # which gives the same values as tiedrank column by column.
+    auc = auc_columns(solution, prediction)
     return 2 * mvmean(auc) - 1
 
 
@@ -416,14 +587,13 @@ def log_loss(solution, prediction, task='binary.classification'):
     if (task == 'multiclass.classification') and (label_num > 1):
         # Make sure the lines add up to one for multi-class classification
         norma = np.sum(prediction, axis=1)
-        for k in range(sample_num):
-            pred[k, :] /= sp.maximum(norma[k], eps)
-            # Make sure there is a single label active per line for multi-class classification
+        pred /= np.maximum(norma, eps)[:, np.newaxis]
+        # Make sure there is a single label active per line for multi-class classification
         sol = binarize_predictions(solution, task='multiclass.classification')
         # For the base prediction, this solution is ridiculous in the multi-label case
 
     # Bounding of predictions to avoid log(0),1/0,...
-    pred = sp.minimum(1 - eps, sp.maximum(eps, pred))
+    pred = np.minimum(1 - eps, np.maximum(eps, pred))
     # Compute the log loss
     pos_class_log_loss = - mvmean(sol * np.log(pred), axis=0)
     if (task != 'multiclass.classification') or (label_num == 1):
@@ -449,10 +619,10 @@ def log_loss(solution, prediction, task='binary.classification'):
 def prior_log_loss(frac_pos, task='binary.classification'):
     ''' Baseline log loss. For multiplr classes ot labels return the volues for each column'''
     eps = 1e-15
-    frac_pos_ = sp.maximum(eps, frac_pos)
+    frac_pos_ = np.maximum(eps, frac_pos)
     if (task != 'multiclass.classification'):  # binary case
         frac_neg = 1 - frac_pos
-        frac_neg_ = sp.maximum(eps, frac_neg)
+        frac_neg_ = np.maximum(eps, frac_neg)
         pos_class_log_loss_ = - frac_pos * np.log(frac_pos_)
         neg_class_log_loss_ = - frac_neg * np.log(frac_neg_)
         base_log_loss = pos_class_log_loss_ + neg_class_log_loss_
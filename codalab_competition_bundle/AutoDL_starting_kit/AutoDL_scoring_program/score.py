@@ -30,14 +30,25 @@ import matplotlib
 matplotlib.use('Agg')
 
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
 import time
 import datetime
+import bisect
+import json
+import tempfile
+import threading
 
 # To compute area under learning curve
 from sklearn.metrics import auc
 
-from libscores import read_array, sp, ls, mvmean
+from libscores import read_array, ls, mvmean, acc_stat
+from libscores import is_npy_file, iter_row_blocks, RowBlockStatistics
+from libscores import ConfusionStatistics, STAT_BLOCK_ROWS
+
+# Notifications of new files in the prediction directory
+from watcher import DirectoryWatcher
 
 # Convert images to Base64 to show in scores.html
 import base64
@@ -70,6 +81,32 @@ missing_score = -0.999999
 # Version number
 scoring_version = 1.0
 
+# The prediction directory is watched with inotify when available, the scoring
+# program then only wakes up when a file is written. As a safety net (e.g. for
+# file systems without notifications), the directory is also looked at every
+# RESCAN_INTERVAL seconds. Without inotify, it is polled every POLL_INTERVAL
+# seconds.
+USE_INOTIFY = True
+RESCAN_INTERVAL = 5
+POLL_INTERVAL = 0.5
+
+# The state of the learning curve (scores of the predictions already seen) is
+# saved in this file of score_dir after each new prediction. If the scoring
+# program is restarted while the ingestion program is still running, it
+# resumes from this state instead of scoring all predictions again.
+CHECKPOINT_FILENAME = 'learning_curve_state.json'
+
+# The figures and detailed_results.html are rendered on a background thread,
+# at most once every RENDER_INTERVAL seconds (the latest state is rendered).
+# Scores and the learning curve artifacts (learning-curve-<task>.json/.csv) are
+# updated as soon as a prediction is scored.
+RENDER_INTERVAL = 10
+
+# The solution is mapped from disk and the predictions are read and scored by
+# blocks of rows of about SCORING_BLOCK_SIZE bytes, so that the memory used
+# does not depend on the size of the test set.
+SCORING_BLOCK_SIZE = 2 ** 26
+
 # Metric used to compute the score of a point on the learning curve
 def autodl_bac(solution, prediction):
   """Compute the normalized balanced accuracy.
@@ -94,18 +131,21 @@ def autodl_bac(solution, prediction):
   else:
     # Participant's prediction is already binary (or at least in [0,1])
     bin_prediction = prediction
-  # Compute the confusion matrix statistics
-  tn = sum(np.multiply((1 - solution), (1 - bin_prediction)))
-  fn = sum(np.multiply(solution, (1 - bin_prediction)))
-  tp = sum(np.multiply(solution, bin_prediction))
-  fp = sum(np.multiply((1 - solution), bin_prediction))
+  # Compute the confusion matrix statistics (column-wise)
+  return autodl_bac_from_stat(*acc_stat(solution, bin_prediction))
+
+def autodl_bac_from_stat(tn, fp, tp, fn):
+  """Compute the normalized balanced accuracy from the confusion matrix
+  statistics of `acc_stat`, e.g. accumulated over the blocks of a prediction
+  file by `score_prediction_file`.
+  """
   # Bounding to avoid division by 0
   eps = 1e-15
-  tp = sp.maximum(eps, tp)
-  pos_num = sp.maximum(eps, tp + fn)
+  tp = np.maximum(eps, tp)
+  pos_num = np.maximum(eps, tp + fn)
   tpr = tp / pos_num  # true positive rate (sensitivity)
-  tn = sp.maximum(eps, tn)
-  neg_num = sp.maximum(eps, tn + fp)
+  tn = np.maximum(eps, tn)
+  neg_num = np.maximum(eps, tn + fp)
   tnr = tn / neg_num  # true negative rate (specificity)
   # Compute bac
   bac = 0.5 * (tpr + tnr)
@@ -128,18 +168,106 @@ def is_multiclass(solution):
   """
   return all(is_one_hot_vector(solution, axis=1))
 
+class AccuracyStatistics(RowBlockStatistics):
+  """Sum over the rows of the normalized prediction of the true class."""
+
+  def __init__(self, block_rows=STAT_BLOCK_ROWS):
+    RowBlockStatistics.__init__(self, block_rows)
+    self.total = 0.
+
+  def _add_block(self, solution, prediction):
+    epsilon = 1e-15
+    # normalize prediction
+    prediction_normalized =\
+      prediction / (np.sum(np.abs(prediction), axis=1, keepdims=True) + epsilon)
+    self.total += np.sum(solution * prediction_normalized)
+
+  def get_accuracy(self):
+    self.finish()
+    return self.total / self.sample_num
+
 def accuracy(solution, prediction):
   # assert(is_multiclass(solution))
-  epsilon = 1e-15
-  # normalize prediction
-  prediction_normalized =\
-    prediction / (np.sum(np.abs(prediction), axis=1, keepdims=True) + epsilon)
-  return np.sum(solution * prediction_normalized) / solution.shape[0]
+  return AccuracyStatistics().update(solution, prediction).get_accuracy()
+
+def read_solution(solution_file, block_size=SCORING_BLOCK_SIZE):
+  """Return the solution as an array mapped from disk.
+
+  A .npy solution is mapped directly. A text solution is parsed once, by
+  blocks of rows, into an anonymous temporary file, which is removed when the
+  array is released.
+  """
+  if is_npy_file(solution_file):
+    return read_array(solution_file, mmap_mode='r')
+  f = tempfile.TemporaryFile()
+  num_rows = 0
+  num_columns = None
+  for block in iter_row_blocks(solution_file, block_size):
+    if num_columns is not None and block.shape[1] != num_columns:
+      raise ValueError("Rows of {} with {} columns instead of {}"\
+                       .format(solution_file, block.shape[1], num_columns))
+    num_columns = block.shape[1]
+    num_rows += block.shape[0]
+    block.astype(np.float64).tofile(f)
+  if num_rows == 0:
+    raise ValueError("Empty solution file: {}".format(solution_file))
+  f.flush()
+  return np.memmap(f, dtype=np.float64, mode='r',
+                   shape=(num_rows, num_columns))
+
+def is_multiclass_solution(solution, block_size=SCORING_BLOCK_SIZE):
+  """`is_multiclass`, on blocks of rows of a solution mapped from disk."""
+  block_rows = max(block_size // solution[:1].nbytes, 1)
+  return all(is_multiclass(solution[i:i + block_rows])
+             for i in range(0, solution.shape[0], block_rows))
+
+def score_prediction_file(solution, prediction_file, scoring_function,
+                          is_multiclass_task, block_size=SCORING_BLOCK_SIZE):
+  """Score a prediction file read by blocks of rows, in bounded memory.
+
+  The statistics of the metrics are accumulated over the blocks, and give the
+  same scores (bit for bit) as the full arrays, see `RowBlockStatistics`.
+
+  Args:
+    solution: numpy.ndarray of shape (num_examples, num_classes), e.g. mapped
+      from disk by `read_solution`.
+    prediction_file: a prediction file, in text or binary format.
+    scoring_function: function computing the score from the confusion matrix
+      statistics of `acc_stat`, e.g. `autodl_bac_from_stat`.
+    is_multiclass_task: whether to compute the accuracy.
+  Returns:
+    (score, accuracy), accuracy is None if not `is_multiclass_task`.
+  """
+  confusion_statistics = ConfusionStatistics()
+  accuracy_statistics = AccuracyStatistics() if is_multiclass_task else None
+  num_rows = 0
+  for prediction in iter_row_blocks(prediction_file, block_size):
+    solution_block = solution[num_rows:num_rows + prediction.shape[0]]
+    if solution_block.shape != prediction.shape: raise ValueError(
+        "Bad prediction shape: {} rows of {} columns from row {}, "
+        "solution shape {}".format(prediction.shape[0], prediction.shape[1],
+                                   num_rows, solution.shape))
+    confusion_statistics.update(solution_block, prediction)
+    if accuracy_statistics is not None:
+      accuracy_statistics.update(solution_block, prediction)
+    num_rows += prediction.shape[0]
+  if num_rows != solution.shape[0]: raise ValueError(
+      "Bad prediction shape: {} rows instead of {}"\
+      .format(num_rows, solution.shape[0]))
+  score = scoring_function(*confusion_statistics.get_acc_stat())
+  acc = None
+  if accuracy_statistics is not None:
+    acc = accuracy_statistics.get_accuracy()
+  return score, acc
 
 def get_prediction_files(prediction_dir, basename, start):
   """Return prediction files for the task <basename>.
 
   Examples of prediction file name: mini.predict_0, mini.predict_1
+
+  The files can be in text or binary (.npy) format, see `read_array`. Files
+  being written by the ingestion program have a hidden temporary name (e.g.
+  .mini.predict_0.tmp) and are only listed once complete.
   """
   prediction_files = ls(os.path.join(prediction_dir, basename + '*.predict_*'))
   # Exclude all files (if any) generated before start
@@ -150,6 +278,19 @@ def get_fig_name(basename):
   fig_name = "learning-curve-" + basename + ".png"
   return fig_name
 
+def get_curve_artifact_names(basename):
+  """Names of the JSON and CSV files of the learning curve of a task."""
+  return ("learning-curve-" + basename + ".json",
+          "learning-curve-" + basename + ".csv")
+
+def write_atomically(filepath, content, mode='w'):
+  """Write a file that readers (e.g. a web server) never see incomplete."""
+  dirname, filename = os.path.split(filepath)
+  tmp_filepath = os.path.join(dirname, '.' + filename + '.tmp')
+  with open(tmp_filepath, mode) as f:
+    f.write(content)
+  os.rename(tmp_filepath, filepath)
+
 def get_basename(solution_file):
   """
   Args:
@@ -159,80 +300,284 @@ def get_basename(solution_file):
   """
   return solution_file.split(os.sep)[-1].split('.')[0]
 
-# TODO: change this function to avoid repeated computing
-def draw_learning_curve(solution_file, prediction_files,
-                        scoring_function, output_dir,
-                        basename, start, is_multiclass_task):
-  """Draw learning curve for one task."""
-  solution = read_array(solution_file) # numpy array
-  scores = []
-  timestamps = []
-  if is_multiclass_task:
-    accuracy_scores = []
-  for prediction_file in prediction_files:
+class LearningCurve(object):
+  """Incremental learning curve of one task.
+
+  Each prediction file is read and scored once. The points are kept sorted
+  by timestamp together with the area under the (log-scaled) curve up to the
+  last point, so that the ALC is updated in O(1) when a new point comes after
+  the others, which is the normal case.
+  """
+
+  def __init__(self, solution, start, scoring_function, is_multiclass_task,
+               time_budget=TIME_BUDGET):
+    """
+    Args:
+      solution: numpy.ndarray of shape (num_examples, num_classes), e.g.
+        mapped from disk by `read_solution`.
+      start: start time of the ingestion program.
+      scoring_function: function computing the score from the confusion
+        matrix statistics of `acc_stat`, see `score_prediction_file`.
+      is_multiclass_task: whether to compute the accuracy of the predictions.
+    """
+    self.solution = solution
+    self.start = start
+    self.scoring_function = scoring_function
+    self.is_multiclass_task = is_multiclass_task
+    self.time_budget = time_budget
+    self.prediction_files = set()
+    # Points of the curve, sorted by timestamp
+    self.timestamps = []
+    self.scores = []
+    self.accuracies = []
+    self._update_area()
+
+  def __len__(self):
+    return len(self.timestamps)
+
+  def get_log_x(self, timestamp):
+    """Position in [0, 1] of a timestamp on the log-scaled time axis."""
+    x = timestamp - self.start + 1 # Since X on log scale, set first x=1
+    return np.log(x + 1) / np.log(self.time_budget + 1)
+
+  def get_curve(self):
+    """Returns the lists (X, Y, log_X) of the points of the learning curve.
+
+    The origin is added as first point and points after the time budget are
+    ignored.
+    """
+    X = [t - self.start + 1 for t in self.timestamps]
+    Y = list(self.scores)
+    # Add origin as the first point of the curve
+    X.insert(0, 1) # X starts from 1 to use log
+    Y.insert(0, 0)
+    # Truncate X using X_max
+    log_X = [np.log(x+1)/np.log(self.time_budget+1)
+             for x in X if x <= self.time_budget] # log_X \in [0, 1]
+    return X[:len(log_X)], Y[:len(log_X)], log_X
+
+  def _update_area(self):
+    """Compute the area under the curve up to the last point, in O(n)."""
+    _, Y, log_X = self.get_curve()
+    self.area = area_under_learning_curve(log_X, Y) if len(log_X) >= 2 else 0
+    self.last_log_x = log_X[-1]
+    self.last_score = Y[-1]
+
+  def add_point(self, timestamp, score, accuracy=None):
+    """Add a point to the curve and update the area under it."""
+    if self.timestamps and timestamp < self.timestamps[-1]:
+      # Rare: a prediction older than the last one, recompute everything
+      i = bisect.bisect(self.timestamps, timestamp)
+      self.timestamps.insert(i, timestamp)
+      self.scores.insert(i, score)
+      self.accuracies.insert(i, accuracy)
+      self._update_area()
+      return
+    self.timestamps.append(timestamp)
+    self.scores.append(score)
+    self.accuracies.append(accuracy)
+    if timestamp - self.start + 1 <= self.time_budget:
+      log_x = self.get_log_x(timestamp)
+      # Trapezoidal rule, as `area_under_learning_curve`
+      self.area += (log_x - self.last_log_x) * (score + self.last_score) / 2
+      self.last_log_x = log_x
+      self.last_score = score
+
+  def add_prediction_file(self, prediction_file):
+    """Score a new prediction file and add it to the curve."""
     timestamp = os.path.getmtime(prediction_file)
-    prediction = read_array(prediction_file) # numpy array
-    if (solution.shape != prediction.shape): raise ValueError(
-        "Bad prediction shape {}".format(prediction.shape))
-    score = scoring_function(solution, prediction)
-    scores.append(score)
-    timestamps.append(timestamp)
-    if is_multiclass_task:
-      acc = accuracy(solution, prediction)
-      accuracy_scores.append(acc)
-  # Sort two lists according to timestamps
-  sorted_pairs = sorted(zip(timestamps, scores))
-  if len(timestamps) > 0:
-    latest_bac = sorted_pairs[-1][1]
-    print_log("BAC of the latest prediction is {:.4f}."\
-              .format(latest_bac))
-    if is_multiclass_task:
-      sorted_pairs_acc = sorted(zip(timestamps, accuracy_scores))
-      latest_acc = sorted_pairs_acc[-1][1]
-      print_log("Accuracy of the latest prediction is {:.4f}."\
-                .format(latest_acc))
-  X = [t - start + 1 for t,_ in sorted_pairs] # Since X on log scale, set first x=1
-  Y = [s for _,s in sorted_pairs]
-  # Add origin as the first point of the curve
-  X.insert(0, 1) # X starts from 1 to use log
-  Y.insert(0, 0)
-  # Truncate X using X_max
+    score, acc = score_prediction_file(self.solution, prediction_file,
+                                       self.scoring_function,
+                                       self.is_multiclass_task)
+    self.add_point(timestamp, score, acc)
+    self.prediction_files.add(prediction_file)
+    return score
+
+  def update(self, prediction_files):
+    """Add the prediction files not seen yet. Returns their number."""
+    new_files = [f for f in prediction_files if f not in self.prediction_files]
+    for prediction_file in sorted(new_files, key=os.path.getmtime):
+      self.add_prediction_file(prediction_file)
+    return len(new_files)
+
+  def get_snapshot(self):
+    """Returns a JSON-serializable copy of the curve, for reporting.
+
+    X and Y are the coordinates of the points of `get_curve`, the origin
+    included.
+    """
+    X, Y, _ = self.get_curve()
+    return {'start': self.start,
+            'time_budget': self.time_budget,
+            'num_predictions': len(self),
+            'alc': float(self.get_alc()),
+            'X': [float(x) for x in X],
+            'Y': [float(y) for y in Y],
+            'accuracies': [None if x is None else float(x)
+                           for x in self.accuracies]}
+
+  def get_alc(self):
+    """Normalized area under the learning curve.
+
+    The last score is extended up to the end of the time budget.
+    """
+    return self.area + (1 - self.last_log_x) * self.last_score
+
+  def save(self, filepath, **extra):
+    """Checkpoint the state (without the solution) in a JSON file.
+
+    `extra` items are saved with it, e.g. to identify the run.
+    """
+    state = dict(extra,
+                 start=self.start,
+                 prediction_files=sorted(self.prediction_files),
+                 timestamps=self.timestamps,
+                 scores=[float(x) for x in self.scores],
+                 accuracies=[None if x is None else float(x)
+                             for x in self.accuracies])
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'w') as f:
+      json.dump(state, f)
+    os.rename(tmp_filepath, filepath)
+
+  def restore(self, state):
+    """Restore the points of a state saved by `save`."""
+    self.start = state['start']
+    self.prediction_files = set(state['prediction_files'])
+    self.timestamps = state['timestamps']
+    self.scores = state['scores']
+    self.accuracies = state['accuracies']
+    self._update_area()
+
+def read_checkpoint(score_dir):
+  """Returns the state saved by `LearningCurve.save` in score_dir, or None."""
+  checkpoint_filepath = os.path.join(score_dir, CHECKPOINT_FILENAME)
+  if not os.path.isfile(checkpoint_filepath):
+    return None
+  try:
+    with open(checkpoint_filepath, 'r') as f:
+      return json.load(f)
+  except ValueError:
+    return None
+
+def get_run_id(solution_file, prediction_dir):
+  """Identify a scoring run by its solution and the start of the ingestion."""
+  start_filepath = os.path.join(prediction_dir, 'start.txt')
+  return {'solution_file': os.path.abspath(solution_file),
+          'ingestion_start': os.path.getmtime(start_filepath)}
+
+def is_same_run(state, solution_file, prediction_dir):
+  """True if the checkpointed `state` was saved while scoring `solution_file`
+  for the same (still running) ingestion."""
+  if state is None or not is_started(prediction_dir):
+    return False
+  run_id = get_run_id(solution_file, prediction_dir)
+  return all(state.get(key) == value for key, value in run_id.items())
+
+def write_learning_curve_artifacts(snapshot, output_dir, basename):
+  """Write the points of a learning curve (see `LearningCurve.get_snapshot`)
+  in a JSON file and in a CSV file. These small files are cheap to update at
+  each new prediction."""
+  json_name, csv_name = get_curve_artifact_names(basename)
+  write_atomically(os.path.join(output_dir, json_name), json.dumps(snapshot))
+  rows = ['time,score,accuracy']
+  # First point is the origin
+  accuracies = [None] + snapshot['accuracies']
+  for x, y, acc in zip(snapshot['X'], snapshot['Y'], accuracies):
+    rows.append('{},{},{}'.format(x, y, '' if acc is None else acc))
+  write_atomically(os.path.join(output_dir, csv_name), '\n'.join(rows) + '\n')
+
+def draw_learning_curve(snapshot, output_dir, basename):
+  """Draw learning curve for one task, from a snapshot of the curve (see
+  `LearningCurve.get_snapshot`).
+
+  Uses a figure of its own (no pyplot state), so it can run in any thread.
+  """
+  X, Y = list(snapshot['X']), list(snapshot['Y'])
   X_max = TIME_BUDGET
-  Y_max = 1
-  log_X = [np.log(x+1)/np.log(X_max+1) for x in X if x <= X_max] # log_X \in [0, 1]
-  log_X_max = 1
-  X = X[:len(log_X)]
-  Y = Y[:len(log_X)]
+  alc = snapshot['alc']
   # Draw learning curve
-  plt.clf()
-  fig, ax = plt.subplots(figsize=(7, 7.07)) #Have a small area of negative score
+  fig = Figure(figsize=(7, 7.07)) #Have a small area of negative score
+  FigureCanvasAgg(fig)
+  ax = fig.add_subplot(111)
   ax.plot(X, Y, marker="o", label="Test score", markersize=3)
   # ax.step(X, Y, marker="o", label="Test score", markersize=3, where='post')
   # Add a point on the final line using last prediction
   X.append(TIME_BUDGET)
   Y.append(Y[-1])
-  log_X.append(1)
-  if len(log_X) >= 2:
-    alc = area_under_learning_curve(log_X,Y)
-  else:
-    alc = 0
   ax.fill_between(X, Y, color='cyan')
   # ax.fill_between(X, Y, color='cyan', step='post')
   ax.text(X[-1], Y[-1], "{:.4f}".format(Y[-1])) # Show the latest/final score
   ax.plot(X[-2:], Y[-2:], '--') # Draw a dotted line from last prediction
-  plt.title("Task: " + basename + " - Current normalized ALC: " + format(alc, '.4f'))
-  plt.xlabel('time/second (log scale)')
-  plt.xlim(left=1, right=X_max)
-  plt.xscale('log')
-  plt.ylabel('score (2*BAC - 1)')
-  plt.ylim(bottom=-0.01, top=1)
+  ax.set_title("Task: " + basename + " - Current normalized ALC: " + format(alc, '.4f'))
+  ax.set_xlabel('time/second (log scale)')
+  ax.set_xlim(left=1, right=X_max)
+  ax.set_xscale('log')
+  ax.set_ylabel('score (2*BAC - 1)')
+  ax.set_ylim(bottom=-0.01, top=1)
   ax.grid(True, zorder=5)
-  plt.legend()
+  ax.legend()
   fig_name = get_fig_name(basename)
   path_to_fig = os.path.join(output_dir, fig_name)
-  plt.savefig(path_to_fig)
+  # Written under a temporary name since the HTML page may be rendered from it
+  tmp_path = os.path.join(output_dir, '.' + fig_name + '.tmp')
+  fig.savefig(tmp_path, format='png')
+  os.rename(tmp_path, path_to_fig)
   return alc
 
+class Renderer(object):
+  """Render the figures and the HTML page on a background thread.
+
+  `request(snapshot)` returns immediately. The latest requested snapshot is
+  rendered with `render_fn(snapshot)`, at most once every `min_interval`
+  seconds, so that rendering never delays scoring.
+  """
+
+  def __init__(self, render_fn, min_interval=RENDER_INTERVAL):
+    self.render_fn = render_fn
+    self.min_interval = min_interval
+    self.lock = threading.Lock()
+    self.wakeup = threading.Event()
+    self.snapshot = None # Latest snapshot not rendered yet
+    self.closing = False
+    self.thread = threading.Thread(target=self._run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def request(self, snapshot):
+    with self.lock:
+      self.snapshot = snapshot
+    self.wakeup.set()
+
+  def _run(self):
+    last_render = 0
+    while True:
+      self.wakeup.wait()
+      self.wakeup.clear()
+      if not self.closing:
+        # Wait for the end of the interval, unless closed meanwhile
+        delay = last_render + self.min_interval - time.time()
+        while delay > 0 and not self.closing:
+          self.wakeup.wait(delay)
+          self.wakeup.clear()
+          delay = last_render + self.min_interval - time.time()
+      with self.lock:
+        snapshot, self.snapshot = self.snapshot, None
+      if snapshot is not None:
+        try:
+          self.render_fn(snapshot)
+        except Exception as e: # Rendering must not stop scoring
+          print_log("Rendering failed: {}".format(e))
+        last_render = time.time()
+      if self.closing and self.snapshot is None:
+        return
+
+  def close(self):
+    """Render the last requested snapshot (if any) and stop the thread."""
+    self.closing = True
+    self.wakeup.set()
+    self.thread.join()
+
 def area_under_learning_curve(X,Y):
   return auc(X,Y)
 
@@ -244,6 +589,18 @@ def init_scores_html(detailed_results_filepath):
     html_file.write("Starting training process... <br> Please be patient. Learning curves will be generated when first predictions are made.")
     html_file.write(html_end)
 
+# Summary of a learning curve, filled by the page from the JSON artifact when
+# it can load it (it is more recent than the figure), see `write_scores_html`
+CURVE_SUMMARY_FORMAT = "{} prediction(s), latest score {:.4f}, current ALC {:.4f}"
+CURVE_SUMMARY_SCRIPT = """<script>
+document.querySelectorAll('.curve-summary').forEach(function (el) {
+  fetch(el.dataset.src).then(function (r) { return r.json(); }).then(function (c) {
+    el.textContent = c.num_predictions + ' prediction(s), latest score ' +
+      c.Y[c.Y.length - 1].toFixed(4) + ', current ALC ' + c.alc.toFixed(4);
+  }).catch(function () {});
+});
+</script>"""
+
 def write_scores_html(score_dir, auto_refresh=True):
   filename = 'detailed_results.html'
   image_paths = sorted(ls(os.path.join(score_dir, '*.png')))
@@ -251,17 +608,23 @@ def write_scores_html(score_dir, auto_refresh=True):
     html_head = """<html><head> <meta http-equiv="refresh" content="5"> </head><body><pre>"""
   else:
     html_head = """<html><body><pre>"""
-  html_end = '</pre></body></html>'
-  with open(os.path.join(score_dir, filename), 'w') as html_file:
-      # Automatic refreshing the page on file change using Live.js
-      html_file.write(html_head)
-      for image_path in image_paths:
-        with open(image_path, "rb") as image_file:
-          encoded_string = base64.b64encode(image_file.read())
-          encoded_string = encoded_string.decode('utf-8')
-          s = '<img src="data:image/png;charset=utf-8;base64,%s"/>'%encoded_string
-          html_file.write(s + '<br>')
-      html_file.write(html_end)
+  html_end = '</pre>' + CURVE_SUMMARY_SCRIPT + '</body></html>'
+  content = [html_head]
+  for json_path in sorted(ls(os.path.join(score_dir, 'learning-curve-*.json'))):
+    with open(json_path, 'r') as f:
+      snapshot = json.load(f)
+    summary = CURVE_SUMMARY_FORMAT.format(snapshot['num_predictions'],
+                                          snapshot['Y'][-1], snapshot['alc'])
+    content.append('<span class="curve-summary" data-src="{}">{}</span><br>'\
+                   .format(os.path.basename(json_path), summary))
+  for image_path in image_paths:
+    with open(image_path, "rb") as image_file:
+      encoded_string = base64.b64encode(image_file.read())
+      encoded_string = encoded_string.decode('utf-8')
+      s = '<img src="data:image/png;charset=utf-8;base64,%s"/>'%encoded_string
+      content.append(s + '<br>')
+  content.append(html_end)
+  write_atomically(os.path.join(score_dir, filename), ''.join(content))
 
 def append_to_detailed_results_page(detailed_results_filepath, content):
   with open(detailed_results_filepath, 'a') as html_file:
@@ -331,6 +694,9 @@ if __name__ == "__main__":
         swrite('\n*** WRONG NUMBER OF ARGUMENTS ***\n\n')
         exit(1)
 
+    # Read the state of a previous scoring program (if restarted) before
+    # cleaning the output
+    previous_state = read_checkpoint(score_dir)
     clean_last_output(score_dir)
 
     # if verbose: # For debugging
@@ -353,9 +719,14 @@ if __name__ == "__main__":
     # Initialize detailed_results.html
     init_scores_html(detailed_results_filepath)
 
+    watcher = DirectoryWatcher(prediction_dir, poll_interval=POLL_INTERVAL,
+                               use_inotify=USE_INOTIFY)
+    print_log("Watching prediction directory with " +
+              ("inotify." if watcher.is_notified() else "polling."))
+
     # Check if ingestion program is ready before starting
     while(not is_started(prediction_dir)):
-      time.sleep(0.5)
+      watcher.wait(timeout=RESCAN_INTERVAL)
 
     # Use the timestamp of 'detailed_results.html' as start time
     # This is more robust than using start = time.time()
@@ -364,8 +735,8 @@ if __name__ == "__main__":
     start_str = time.ctime(start)
     print_log("Start scoring program at " + start_str)
 
-    # Get the metric
-    scoring_function = autodl_bac
+    # Get the metric (computed from the statistics of the predictions)
+    scoring_function = autodl_bac_from_stat
     metric_name = "Area under Learning Curve"
 
     # Get all the solution files from the solution directory
@@ -373,63 +744,83 @@ if __name__ == "__main__":
     if len(solution_names) > 1: # Assert only one file is found
       raise ValueError("Multiple solution files found: {}!".format(solution_names))
     solution_file = solution_names[0]
-    solution = read_array(solution_file)
-    is_multiclass_task = is_multiclass(solution)
+    solution = read_solution(solution_file)
+    is_multiclass_task = is_multiclass_solution(solution)
     # Extract the dataset name from the file name
     basename = get_basename(solution_file)
     nb_preds = {x:0 for x in solution_names}
     scores = {x:0 for x in solution_names}
 
+    # Scores of the predictions, each prediction file is scored only once
+    learning_curve = LearningCurve(solution, start, scoring_function,
+                                   is_multiclass_task)
+    run_id = get_run_id(solution_file, prediction_dir)
+    checkpoint_filepath = os.path.join(score_dir, CHECKPOINT_FILENAME)
+    if is_same_run(previous_state, solution_file, prediction_dir):
+      learning_curve.restore(previous_state)
+      start = learning_curve.start
+      print_log("Resumed from checkpoint with {} predictions, start at {}."\
+                .format(len(learning_curve), time.ctime(start)))
+
     # Use 'duration.txt' file to detect if ingestion program exits early
     duration_filepath =  os.path.join(prediction_dir, 'duration.txt')
 
+    def render(snapshot):
+      draw_learning_curve(snapshot, output_dir=score_dir, basename=basename)
+      write_scores_html(score_dir)
+    renderer = Renderer(render)
+
     # Begin scoring process, along with ingestion program
     # Moniter training processes while time budget is not attained
-    known_prediction_files = {}
     while(time.time() < start + TIME_BUDGET):
-      time.sleep(0.5)
+      # Use 'duration.txt' file to detect if ingestion program exits early.
+      # It is written after the last prediction, which is thus listed below.
+      ingestion_done = os.path.isfile(duration_filepath)
       # Give list of prediction files
       prediction_files = get_prediction_files(prediction_dir, basename, start)
-      nb_preds_old = nb_preds[solution_file]
-      nb_preds_new = len(prediction_files)
-      if(nb_preds_new > nb_preds_old):
-        now = datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
+      if learning_curve.update(prediction_files) > 0 or\
+          nb_preds[solution_file] < len(learning_curve): # (resumed)
+        nb_preds_new = len(learning_curve)
         print_log("[+] New prediction found. Now number of predictions made =", nb_preds_new)
-        alc = 0
-        alc = draw_learning_curve(solution_file=solution_file,
-                                  prediction_files=prediction_files,
-                                  scoring_function=scoring_function,
-                                  output_dir=score_dir,
-                                  basename=basename,
-                                  start=start,
-                                  is_multiclass_task=is_multiclass_task)
+        learning_curve.save(checkpoint_filepath, **run_id)
+        print_log("BAC of the latest prediction is {:.4f}."\
+                  .format(learning_curve.scores[-1]))
+        if is_multiclass_task:
+          print_log("Accuracy of the latest prediction is {:.4f}."\
+                    .format(learning_curve.accuracies[-1]))
+        alc = learning_curve.get_alc()
+        snapshot = learning_curve.get_snapshot()
+        write_learning_curve_artifacts(snapshot, score_dir, basename)
+        # Update the figure and detailed_results.html in the background
+        renderer.request(snapshot)
         nb_preds[solution_file] = nb_preds_new
         scores[solution_file] = alc
         print_log("Current area under learning curve for {}: {:.4f}".format(basename, scores[solution_file]))
-        # Update scores.html
-        write_scores_html(score_dir)
-      # Use 'duration.txt' file to detect if ingestion program exits early
-      if os.path.isfile(duration_filepath):
+      if ingestion_done:
         print_log("Detected early stop of ingestion program. Stop scoring now.")
         break
+      watcher.wait(timeout=min(RESCAN_INTERVAL,
+                               max(start + TIME_BUDGET - time.time(), 0)))
 
-    # Write one last time the detailed results page without auto-refreshing
+    # Render the latest figure, then write one last time the detailed results
+    # page without auto-refreshing
+    renderer.close()
     write_scores_html(score_dir, auto_refresh=False)
 
     # Read the execution time and add it to score_file (scores.txt)
     # Spend 30 seconds to search for a duration.txt file
     duration = None
-    max_loop = 30
-    n_loop = 0
-    while n_loop < max_loop:
-        time.sleep(1)
+    deadline = time.time() + 30
+    while time.time() < deadline:
         if os.path.isfile(duration_filepath):
             with open(duration_filepath, 'r') as f:
               duration = float(f.read())
             str_temp = "Duration: %0.6f\n" % duration
             score_file.write(str_temp)
             break
-        n_loop += 1
+        watcher.wait(timeout=min(RESCAN_INTERVAL,
+                                 max(deadline - time.time(), 0)))
+    watcher.close()
 
     score = scores[solution_file]
     score_file.write("score: {:.12f}\n".format(score))
@@ -0,0 +1,132 @@
+# Watch a directory for new files, used by the scoring program to react to the
+# prediction files written by the ingestion program.
+#
+# On Linux, the kernel notifies changes through inotify (used through ctypes,
+# no dependency needed), so the scoring program wakes up as soon as a file is
+# committed and sleeps otherwise. Elsewhere (or if inotify is not available,
+# e.g. on some network file systems or when the directory does not exist yet)
+# it falls back to polling.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# Files are reported once written (closed) or renamed, not when created empty
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF |\
+             IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+def _load_libc():
+  """Returns libc if it provides inotify, else None."""
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    libc.inotify_init1
+    libc.inotify_add_watch
+  except (OSError, AttributeError):
+    return None
+  return libc
+
+
+class DirectoryWatcher(object):
+  """Wait for changes in a directory.
+
+  Usage:
+    watcher = DirectoryWatcher(prediction_dir)
+    while ...:
+      watcher.wait(timeout=5)
+      # Look at the content of prediction_dir
+  """
+
+  def __init__(self, dirname, poll_interval=0.5, use_inotify=True):
+    """
+    Args:
+      dirname: directory to watch. It may not exist yet (or be deleted and
+        re-created), the watch is (re)installed when it exists.
+      poll_interval: time in seconds between two looks at the directory when
+        inotify is not used.
+      use_inotify: if False, always poll.
+    """
+    self.dirname = dirname
+    self.poll_interval = poll_interval
+    self.libc = _load_libc() if use_inotify else None
+    self.fd = None
+    self.wd = None
+    if self.libc is not None:
+      fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+      if fd >= 0:
+        self.fd = fd
+
+  def is_notified(self):
+    """True if changes are currently notified (i.e. no polling)."""
+    return self._add_watch()
+
+  def _add_watch(self):
+    if self.fd is None:
+      return False
+    if self.wd is None and os.path.isdir(self.dirname):
+      wd = self.libc.inotify_add_watch(self.fd,
+                                       os.fsencode(self.dirname), WATCH_MASK)
+      if wd >= 0:
+        self.wd = wd
+    return self.wd is not None
+
+  def _read_events(self):
+    """Read the pending events. Returns True if some were read."""
+    try:
+      data = os.read(self.fd, 65536)
+    except (BlockingIOError, InterruptedError):
+      return False
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+      _, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+      offset += EVENT_HEADER.size + name_len
+      if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+        # The directory is gone (e.g. cleaned by the ingestion program), the
+        # watch is installed again on the new directory.
+        self.wd = None
+    return True
+
+  def wait(self, timeout=None):
+    """Block until something changed in the directory or `timeout` seconds.
+
+    Returns:
+      True if the directory may have changed (always True when polling),
+      False if `timeout` expired without any change.
+    """
+    if not self._add_watch():
+      delay = self.poll_interval
+      if timeout is not None:
+        delay = min(delay, max(timeout, 0))
+      time.sleep(delay)
+      return True
+    while True:
+      try:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+      except InterruptedError:
+        continue
+      break
+    if not readable:
+      return False
+    # Let the events of a burst of changes (e.g. write then rename) come in
+    # before returning, to wake up once for them.
+    time.sleep(0.01)
+    return self._read_events()
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+      self.wd = None